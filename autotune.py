@@ -0,0 +1,150 @@
+# Accuracy-vs-cost autotuner for the integrator and step size.
+#
+# Renders a high-accuracy reference at low resolution, then every candidate integrator/step size,
+# and scores each by PSNR/SSIM and photon-ring (shadow edge) position error against its solve
+# time. Prints the Pareto front and the cheapest setting that meets the targets.
+#
+#   python autotune.py --cpu -target_psnr 35 -max_ring_error 0.5 -o autotune.json
+import argparse
+import json
+import time
+
+import numpy as np
+import taichi as ti
+
+from camera import Camera
+from metrics import psnr, ssim, photon_ring_error, pareto_front
+from render_session import DEFAULT_JOB, RESOLUTIONS
+from runtime import init_taichi
+from scene import Scene
+from skymap import Skymap
+from solver import Solver, INTEGRATORS
+
+
+def render(my_camera, scene, integrator, h, repeats):
+    """
+    Renders with one integrator/step size.
+
+    Returns:
+    - img, horizon, seconds: image in [0, 1], horizon-hit mask and median solve time
+      (the compiling first call is not timed).
+    """
+    width, height = my_camera._image_width, my_camera._image_height
+    my_solver = Solver(scene, h=float(h), diagnostics_shape=(width, height))
+    colors = ti.Vector.field(3, dtype=ti.f32, shape=(width, height))
+    positions, directions = my_camera.positions, my_camera.directions
+
+    times = []
+    for run in range(repeats + 1):
+        colors.fill(0.0)
+        ti.sync()
+        start = time.perf_counter()
+        my_solver.solve(integrator, positions, directions, colors)
+        ti.sync()
+        if run > 0:
+            times.append(time.perf_counter() - start)
+    return my_camera.render(colors), my_solver.horizon_hits.to_numpy(), float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the cheapest integrator/step size meeting an error target.")
+    parser.add_argument("-resolution", type=str, default='320x180',
+                        help="Tuning resolution as WIDTHxHEIGHT (default: 320x180)")
+    parser.add_argument("-target_resolution", "-r", type=str, default='4k', choices=list(RESOLUTIONS),
+                        help="Production resolution used to extrapolate solve times (default: 4k)")
+    parser.add_argument("-reference_integrator", type=str, default='rk4', choices=INTEGRATORS,
+                        help="Integrator of the reference render (default: rk4)")
+    parser.add_argument("-reference_step", type=float, default=0.001,
+                        help="Step size of the reference render (default: 0.001)")
+    parser.add_argument("-integrators", nargs='+', default=list(INTEGRATORS), choices=INTEGRATORS,
+                        help="Candidate integrators (default: all)")
+    parser.add_argument("-steps", nargs='+', type=float, default=[0.1, 0.05, 0.02, 0.011, 0.005],
+                        help="Candidate step sizes (default: 0.1 0.05 0.02 0.011 0.005)")
+    parser.add_argument("-target_psnr", type=float, default=35.0,
+                        help="Minimum PSNR in dB against the reference (default: 35)")
+    parser.add_argument("-target_ssim", type=float, default=None,
+                        help="Minimum SSIM against the reference (default: not checked)")
+    parser.add_argument("-max_ring_error", type=float, default=0.5,
+                        help="Maximum photon-ring position error in tuning-resolution pixels (default: 0.5)")
+    parser.add_argument("-repeats", type=int, default=3, help="Timed runs per candidate (default: 3)")
+    parser.add_argument("-pov", "-p", nargs=3, type=float, default=DEFAULT_JOB['pov'], metavar=('x', 'y', 'z'),
+                        help="Camera position (default: main.py's)")
+    parser.add_argument("-focal", "-f", type=float, default=DEFAULT_JOB['focal'], help="Focal length")
+    parser.add_argument("-fov", type=float, default=DEFAULT_JOB['fov'], help="Field of view in degrees")
+    parser.add_argument("-texture", "-t", type=str, default=DEFAULT_JOB['texture'], help="Sky texture")
+    parser.add_argument("-at", type=str, default=DEFAULT_JOB['at'], help="Accretion disk texture")
+    parser.add_argument("-ar1", type=float, default=DEFAULT_JOB['ar1'], help="Inner disk radius")
+    parser.add_argument("-ar2", type=float, default=DEFAULT_JOB['ar2'], help="Outer disk radius")
+    parser.add_argument("--cpu", action="store_true", help="Use CPU for rendering (default: use GPU)")
+    parser.add_argument("-output", "-o", type=str, default=None, help="Write all results as JSON to this file")
+    args = parser.parse_args()
+
+    init_taichi(cpu=args.cpu)
+    width, height = (int(v) for v in args.resolution.lower().split('x'))
+    target_width, target_height = RESOLUTIONS[args.target_resolution]
+    time_scale = (target_width * target_height) / (width * height)
+
+    my_camera = Camera(np.array(args.pov, dtype=np.float32), np.float32(args.focal),
+                       np.array([0, 0, 0], dtype=np.float32), np.array([width, height]), fov=np.float32(args.fov % 180))
+    my_camera.generate_rays()
+    scene = Scene(blackhole_r=1.0, accretion_r1=float(args.ar1), accretion_r2=float(args.ar2),
+                  accretion_temp=400.0, accretion_alpha=1.0, skymap=Skymap(args.texture, r_max=10))
+    scene.set_accretion_disk_texture(args.at)
+
+    print(f'Rendering reference: {args.reference_integrator}, h={args.reference_step} at {width}x{height}...')
+    reference, reference_horizon, reference_time = render(my_camera, scene, args.reference_integrator,
+                                                          args.reference_step, repeats=1)
+
+    candidates = []
+    for integrator in args.integrators:
+        for h in args.steps:
+            img, horizon, seconds = render(my_camera, scene, integrator, h, args.repeats)
+            candidate = {
+                'integrator': integrator,
+                'h': h,
+                'solve_time': seconds,
+                'estimated_target_time': seconds * time_scale,
+                'psnr': psnr(img, reference),
+                'ssim': ssim(img, reference),
+                'ring_error_px': photon_ring_error(horizon, reference_horizon),
+            }
+            candidate['meets_target'] = bool(
+                candidate['psnr'] >= args.target_psnr
+                and candidate['ring_error_px'] <= args.max_ring_error
+                and (args.target_ssim is None or candidate['ssim'] >= args.target_ssim))
+            candidates.append(candidate)
+            print(f"  {integrator:8s} h={h:<6g} {seconds:7.3f} s  PSNR {candidate['psnr']:6.2f} dB  "
+                  f"SSIM {candidate['ssim']:.4f}  ring {candidate['ring_error_px']:.2f} px"
+                  f"{'  ok' if candidate['meets_target'] else ''}")
+
+    front = pareto_front(candidates, 'solve_time', 'psnr')
+    print(f'\nPareto front (solve time vs PSNR), {args.target_resolution} time extrapolated by pixel count:')
+    for candidate in front:
+        print(f"  {candidate['integrator']:8s} h={candidate['h']:<6g} {candidate['solve_time']:7.3f} s "
+              f"(~{candidate['estimated_target_time']:.1f} s at {args.target_resolution})  PSNR {candidate['psnr']:6.2f} dB")
+
+    passing = [candidate for candidate in candidates if candidate['meets_target']]
+    recommendation = min(passing, key=lambda candidate: candidate['solve_time']) if passing else None
+    if recommendation is None:
+        print('\nNo candidate meets the target; try smaller step sizes or relax the target.')
+    else:
+        print(f"\nRecommended: -integrator {recommendation['integrator']} -step_size {recommendation['h']} "
+              f"(~{recommendation['estimated_target_time']:.1f} s at {args.target_resolution})")
+
+    if args.output:
+        report = {
+            'resolution': [width, height],
+            'reference': {'integrator': args.reference_integrator, 'h': args.reference_step,
+                          'solve_time': reference_time},
+            'targets': {'psnr': args.target_psnr, 'ssim': args.target_ssim, 'ring_error_px': args.max_ring_error},
+            'candidates': candidates,
+            'pareto_front': front,
+            'recommendation': recommendation,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Saved {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# Render a manifest of stills in one process, reusing compiled kernels and loaded textures.
+#
+# Manifest (JSON, or YAML if PyYAML is installed):
+#   {
+#     "defaults": {"resolution": "fhd", "integrator": "rk4"},
+#     "renders": [
+#       {"pov": [6, 0, 0.5], "output": "gallery/a.png"},
+#       {"pov": [0, 5, 2], "focal": 2.0, "step_size": 0.02, "output": "gallery/b.png"}
+#     ]
+#   }
+# Keys match DEFAULT_JOB in render_session.py. A bare list of renders is also accepted.
+import argparse
+import json
+import os
+import time
+
+from render_cache import DEFAULT_CACHE_SIZE_GB, DEFAULT_RENDER_CACHE, RenderCache
+from render_session import RenderSession, normalize_job, compile_key
+from runtime import init_taichi
+from image_io import save_image
+
+
+def load_manifest(path):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("Reading YAML manifests requires PyYAML (pip install pyyaml)")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+
+    if isinstance(manifest, list):
+        manifest = {'renders': manifest}
+    defaults = manifest.get('defaults', {})
+    jobs = []
+    for index, render in enumerate(manifest['renders']):
+        job = normalize_job({**defaults, **render})
+        if 'output' not in job:
+            raise ValueError(f"Render #{index} in {path} has no 'output'")
+        jobs.append(job)
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render every image in a JSON/YAML manifest in one process.")
+    parser.add_argument("manifest", type=str, help="Path to the render manifest")
+    parser.add_argument(
+        "--cpu",
+        action="store_true",
+        help="Use CPU for rendering (default: use GPU)"
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse stored images of renders done before, in this or earlier runs"
+    )
+    parser.add_argument("-cache_dir", type=str, default=DEFAULT_RENDER_CACHE,
+                        help=f"Render cache directory for --cache. (default: {DEFAULT_RENDER_CACHE})")
+    parser.add_argument("-cache_size_gb", type=float, default=DEFAULT_CACHE_SIZE_GB,
+                        help=f"Render cache size limit. (default: {DEFAULT_CACHE_SIZE_GB:g})")
+    args = parser.parse_args()
+
+    jobs = load_manifest(args.manifest)
+    # Jobs that share compile-relevant settings run back to back on the same kernels
+    jobs.sort(key=lambda job: repr(compile_key(job)))
+    print(f'{len(jobs)} renders in {len({compile_key(job) for job in jobs})} kernel groups')
+
+    init_taichi(cpu=args.cpu)
+
+    cache = RenderCache(args.cache_dir, args.cache_size_gb) if args.cache else None
+    session = RenderSession(cache=cache)
+    start = time.perf_counter()
+    for index, job in enumerate(jobs):
+        job_start = time.perf_counter()
+        img = session.render(job)
+        output_dir = os.path.dirname(job['output'])
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        save_image(img, job['output'])
+        print(f"[{index + 1}/{len(jobs)}] {job['output']} ({time.perf_counter() - job_start:.2f} s)")
+
+    print(f'Rendered {len(jobs)} images in {time.perf_counter() - start:.2f} s')
+    if cache is not None:
+        print(f'Render cache: {cache.hits} hits, {cache.misses} misses')
+
+
+if __name__ == '__main__':
+    main()
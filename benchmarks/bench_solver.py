@@ -0,0 +1,178 @@
+# Solver benchmark matrix: integrator x step size x resolution x CPU thread count.
+#
+# Every cell runs in its own process so each gets a fresh Taichi runtime with its own
+# cpu_max_num_threads, a cold kernel cache (so compile time is measured) and its own peak RSS.
+#
+#   python benchmarks/bench_solver.py -o benchmarks/results.json
+#   python benchmarks/bench_solver.py -integrators rk4 am4 -steps 0.01 -resolutions 640x360 -threads 1 4
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from solver import INTEGRATORS
+
+# Fixed benchmark scene: main.py's default view, textures and disk
+SCENE = {
+    'pov': [6, 0, 0.5],
+    'focal': 1.8,
+    'fov': 60,
+    'texture': 'texture/high_res/space_texture_high1.jpg',
+    'at': 'texture/ad/adisk.jpg',
+    'ar1': 2,
+    'ar2': 3.5,
+}
+
+
+def parse_resolution(text):
+    width, height = text.lower().split('x')
+    return [int(width), int(height)]
+
+
+def run_cell(cell):
+    """
+    Benchmarks one configuration in the current process.
+
+    Parameters:
+    - cell: dict with 'integrator', 'h', 'resolution' [width, height], 'threads', 'repeats',
+      'warmup' and optionally 'scene' (defaults to SCENE).
+
+    Returns:
+    - result: dict of timings (seconds), throughput and per-ray step statistics.
+    """
+    import resource
+    import taichi as ti
+
+    from camera import Camera
+    from runtime import init_taichi
+    from scene import Scene
+    from skymap import Skymap
+    from solver import Solver
+
+    scene_cfg = cell.get('scene', SCENE)
+    width, height = cell['resolution']
+
+    start = time.perf_counter()
+    init_taichi(cpu=True, kernel_cache=None, cpu_max_num_threads=cell['threads'])
+    init_time = time.perf_counter() - start
+
+    os.chdir(ROOT)
+    my_camera = Camera(np.array(scene_cfg['pov'], dtype=np.float32), np.float32(scene_cfg['focal']),
+                       np.array([0, 0, 0], dtype=np.float32), np.array([width, height]), fov=scene_cfg['fov'])
+    scene = Scene(blackhole_r=1.0, accretion_r1=float(scene_cfg['ar1']),
+                  accretion_r2=float(scene_cfg['ar2']), accretion_temp=400.0,
+                  accretion_alpha=1.0,
+                  skymap=Skymap(scene_cfg['texture'], r_max=10))
+    scene.set_accretion_disk_texture(scene_cfg['at'])
+    my_solver = Solver(scene, h=float(cell['h']), diagnostics_shape=(width, height))
+    colors = ti.Vector.field(3, dtype=ti.f32, shape=(width, height))
+    positions, directions = my_camera.get_all_rays()
+
+    def solve():
+        colors.fill(0.0)
+        ti.sync()
+        solve_start = time.perf_counter()
+        my_solver.solve(cell['integrator'], positions, directions, colors)
+        ti.sync()
+        return time.perf_counter() - solve_start
+
+    # The first call includes JIT compilation; warmup calls are discarded as well
+    first_time = solve()
+    for _ in range(cell['warmup']):
+        solve()
+    times = [solve() for _ in range(cell['repeats'])]
+    solve_time = float(np.median(times))
+
+    steps = my_solver.step_counts.to_numpy().astype(np.int64)
+    num_rays = width * height
+    return {
+        **{key: cell[key] for key in ('integrator', 'h', 'resolution', 'threads', 'repeats', 'warmup')},
+        'init_time': init_time,
+        'compile_time': max(first_time - solve_time, 0.0),
+        'solve_times': times,
+        'solve_time_median': solve_time,
+        'solve_time_min': float(np.min(times)),
+        'rays_per_second': num_rays / solve_time,
+        'steps_per_second': float(steps.sum()) / solve_time,
+        'steps_per_ray_mean': float(steps.mean()),
+        'steps_per_ray_p99': float(np.percentile(steps, 99)),
+        'steps_per_ray_max': int(steps.max()),
+        'horizon_fraction': float(my_solver.horizon_hits.to_numpy().mean()),
+        # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0),
+    }
+
+
+def run_cell_subprocess(cell):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '-cell', json.dumps(cell)],
+                            check=True, capture_output=True, text=True).stdout
+    # The result is the last line; everything before it is Taichi/texture logging
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def machine_info():
+    import taichi as ti
+
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'taichi': '.'.join(str(v) for v in ti.__version__),
+    }
+
+
+def run_matrix(integrators, steps, resolutions, threads, repeats=3, warmup=1, scene=SCENE):
+    results = []
+    cells = [{'integrator': integrator, 'h': h, 'resolution': resolution, 'threads': num_threads,
+              'repeats': repeats, 'warmup': warmup, 'scene': scene}
+             for integrator in integrators for h in steps for resolution in resolutions for num_threads in threads]
+    for index, cell in enumerate(cells):
+        result = run_cell_subprocess(cell)
+        results.append(result)
+        print(f"[{index + 1}/{len(cells)}] {cell['integrator']:8s} h={cell['h']:<6g} "
+              f"{cell['resolution'][0]}x{cell['resolution'][1]} threads={cell['threads']:<3d} "
+              f"{result['solve_time_median']:.3f} s  {result['rays_per_second'] / 1e6:.2f} Mrays/s  "
+              f"{result['steps_per_second'] / 1e6:.1f} Msteps/s  steps/ray mean {result['steps_per_ray_mean']:.0f} "
+              f"p99 {result['steps_per_ray_p99']:.0f}  compile {result['compile_time']:.2f} s  "
+              f"peak {result['peak_rss_mb']:.0f} MB", flush=True)
+    return {'machine': machine_info(), 'scene': scene, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the solver kernels on CPU.")
+    parser.add_argument("-integrators", nargs='+', default=list(INTEGRATORS), choices=INTEGRATORS,
+                        help="Integrators to benchmark (default: all)")
+    parser.add_argument("-steps", nargs='+', type=float, default=[0.05, 0.02, 0.011],
+                        help="Step sizes h (default: 0.05 0.02 0.011)")
+    parser.add_argument("-resolutions", nargs='+', type=parse_resolution, default=[[320, 180], [640, 360]],
+                        help="Resolutions as WIDTHxHEIGHT (default: 320x180 640x360)")
+    parser.add_argument("-threads", nargs='+', type=int, default=sorted({1, os.cpu_count() or 1}),
+                        help="cpu_max_num_threads values (default: 1 and all cores)")
+    parser.add_argument("-repeats", type=int, default=3, help="Timed runs per cell (default: 3)")
+    parser.add_argument("-warmup", type=int, default=1, help="Untimed runs after compilation (default: 1)")
+    parser.add_argument("-output", "-o", type=str, default=None, help="Write results as JSON to this file")
+    parser.add_argument("-cell", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cell is not None:
+        print(json.dumps(run_cell(json.loads(args.cell))))
+        return
+
+    report = run_matrix(args.integrators, args.steps, args.resolutions, args.threads, args.repeats, args.warmup)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Saved {args.output}')
+
+
+if __name__ == '__main__':
+    main()
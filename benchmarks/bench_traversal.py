@@ -0,0 +1,265 @@
+# Traversal-order benchmark: how the order rays are handed to the solver affects sky texture
+# cache behaviour and CPU thread load balance.
+#
+# The rays are traced once (rk4, with per-ray step counts) to get each ray's cost and the texels
+# it reads. Then, for the solver's native order (field index i * height + j, i.e. image columns)
+# and every traversal.py order:
+#   - texture cache: every thread replays its rays' sky and disk texel reads through a private
+#     LRU cache of -cache_kb (64-byte lines) and the miss rate is reported;
+#   - load balance: rays are split across -threads threads statically (equal contiguous ranges)
+#     and dynamically (chunks of -chunk rays to the first idle thread), weighted by step count;
+#     imbalance is the slowest thread's work over the mean.
+# The 'cost' order balances tiles by the impact-parameter cost estimate; 'cost_measured' uses
+# the traced step counts instead, as a renderer would with the previous frame's diagnostics.
+# With -repeats > 0 the real solve is also timed in each order on this machine.
+#
+#   python benchmarks/bench_traversal.py                        # 4K, all orders
+#   python benchmarks/bench_traversal.py -resolution 640x360 -threads 16 -o traversal.json
+import argparse
+import collections
+import heapq
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_solver import SCENE, machine_info, parse_resolution
+from traversal import ORDERS, estimate_costs, pixel_order
+
+ALL_ORDERS = ['native'] + list(ORDERS) + ['cost_measured']
+
+LINE_BYTES = 64
+TEXEL_BYTES = 12  # ti.Vector.field(3, ti.f32)
+
+
+def sky_texels(skymap, escape):
+    # Linear texel index of each exit point's sky lookup, as Skymap.get_color_from_ray_ti
+    d = escape / np.linalg.norm(escape, axis=-1, keepdims=True)
+    if skymap.is_cube:
+        from cubemap import sample_cubemap
+        size = skymap.face_size + 2
+        index = np.arange(6 * size * size, dtype=np.int64).reshape(6, size, size, 1)
+        return sample_cubemap(index, d, bilinear=False)[..., 0]
+    theta = np.arccos(np.clip(d[..., 2], -1.0, 1.0))
+    phi = np.mod(np.arctan2(d[..., 1], d[..., 0]), 2 * np.pi)
+    u = np.clip((phi / (2 * np.pi) * (skymap.img_width - 1)).astype(np.int64), 0, skymap.img_width - 1)
+    v = np.clip((theta / np.pi * (skymap.img_height - 1)).astype(np.int64), 0, skymap.img_height - 1)
+    return v * skymap.img_width + u
+
+
+def disk_texels(scene, hits):
+    # Linear texel index of disk lookups at (x, y) hit points, as Scene.get_accretion_disk_color_ti
+    r = np.hypot(hits[..., 0], hits[..., 1])
+    phi = np.mod(np.arctan2(hits[..., 1], hits[..., 0]), 2 * np.pi)
+    u = np.clip((phi / (2 * np.pi) * (scene.img_width - 1)).astype(np.int64), 0, scene.img_width - 1)
+    v = np.clip(((r - scene.accretion_r1) / (scene.accretion_r2 - scene.accretion_r1)
+                 * (scene.img_height - 1)).astype(np.int64), 0, scene.img_height - 1)
+    return v * scene.img_width + u
+
+
+def trace_scene(width, height, h, sky_projection):
+    """
+    Traces every ray once in the native order.
+
+    Returns:
+    - steps: (width * height,) int64 step counts, indexed by x * height + y.
+    - accesses: (ray, cache line) int64 arrays of every texture read, sorted by ray.
+    """
+    import taichi as ti
+
+    from camera import Camera
+    from gbuffer import GBuffer
+    from scene import Scene
+    from skymap import Skymap
+    from solver import Solver
+
+    my_camera = Camera(np.array(SCENE['pov'], dtype=np.float32), np.float32(SCENE['focal']),
+                       np.array([0, 0, 0], dtype=np.float32), np.array([width, height]), fov=SCENE['fov'])
+    scene = Scene(blackhole_r=1.0, accretion_r1=float(SCENE['ar1']),
+                  accretion_r2=float(SCENE['ar2']), accretion_temp=400.0,
+                  accretion_alpha=1.0,
+                  skymap=Skymap(SCENE['texture'], r_max=10, projection=sky_projection))
+    scene.set_accretion_disk_texture(SCENE['at'])
+    my_solver = Solver(scene, h=h, diagnostics_shape=(width, height))
+    gbuffer = GBuffer(width, height)
+    positions, directions = my_camera.get_all_rays()
+    my_solver.trace_rk4(positions, directions, gbuffer)
+    ti.sync()
+    geometry = gbuffer.to_numpy()
+    steps = my_solver.step_counts.to_numpy().astype(np.int64).ravel()
+
+    rays = np.arange(width * height)
+    escaped = geometry['horizon'].ravel() == 0
+    sky_lines = sky_texels(scene.skymap, geometry['escape'].reshape(-1, 3)[escaped]) * TEXEL_BYTES // LINE_BYTES
+    ray_list, line_list = [rays[escaped]], [sky_lines]
+
+    # Disk texels live in their own allocation; offset their lines past the sky's
+    disk_base = int(np.prod(scene.skymap.texture_field.shape)) * TEXEL_BYTES // LINE_BYTES + 1
+    count = np.minimum(geometry['disk_count'], gbuffer.max_disk_hits).ravel()
+    hits = geometry['disk_hits'].reshape(width * height, gbuffer.max_disk_hits, 2)
+    for k in range(gbuffer.max_disk_hits):
+        has_hit = count > k
+        ray_list.append(rays[has_hit])
+        line_list.append(disk_base + disk_texels(scene, hits[has_hit, k]) * TEXEL_BYTES // LINE_BYTES)
+    ray_ids = np.concatenate(ray_list)
+    lines = np.concatenate(line_list)
+    by_ray = np.argsort(ray_ids, kind='stable')
+    return steps, (ray_ids[by_ray], lines[by_ray]), (my_camera, scene)
+
+
+def schedule(costs, threads, chunk):
+    """
+    Assigns rays, in visiting order, to threads.
+
+    Returns:
+    - static: (threads,) work of equal contiguous ranges.
+    - dynamic: (threads,) work when chunks go to the first idle thread.
+    - owner: (num_rays,) dynamic thread of each visiting position.
+    """
+    bounds = np.linspace(0, len(costs), threads + 1).astype(np.int64)
+    cumulative = np.concatenate([[0], np.cumsum(costs)])
+    static = cumulative[bounds[1:]] - cumulative[bounds[:-1]]
+
+    dynamic = np.zeros(threads, dtype=np.int64)
+    owner = np.empty(len(costs), dtype=np.int32)
+    idle = [(0, t) for t in range(threads)]
+    for start in range(0, len(costs), chunk):
+        work, thread = heapq.heappop(idle)
+        end = min(start + chunk, len(costs))
+        owner[start:end] = thread
+        work += cumulative[end] - cumulative[start]
+        dynamic[thread] = work
+        heapq.heappush(idle, (work, thread))
+    return static, dynamic, owner
+
+
+def lru_misses(lines, capacity):
+    # Misses of one access stream through an LRU cache of capacity lines
+    cache = collections.OrderedDict()
+    misses = 0
+    for line in lines.tolist():
+        if line in cache:
+            cache.move_to_end(line)
+        else:
+            misses += 1
+            cache[line] = None
+            if len(cache) > capacity:
+                cache.popitem(last=False)
+    return misses
+
+
+def evaluate(order_name, visit, steps, accesses, args):
+    # visit: native ray index (x * height + y) of every visiting position
+    static, dynamic, owner = schedule(steps[visit], args.threads, args.chunk)
+
+    # Texture reads of every thread, in the order it runs its rays
+    rank = np.empty_like(visit)
+    rank[visit] = np.arange(len(visit))
+    ray_ids, lines = accesses
+    position = rank[ray_ids]
+    by_position = np.argsort(position, kind='stable')
+    position, lines = position[by_position], lines[by_position]
+    thread_of_access = owner[position]
+    capacity = args.cache_kb * 1024 // LINE_BYTES
+    misses = sum(lru_misses(lines[thread_of_access == t], capacity) for t in range(args.threads))
+
+    mean = steps.sum() / args.threads
+    return {
+        'order': order_name,
+        'texture_reads': int(len(lines)),
+        'cache_misses': int(misses),
+        'miss_rate': misses / max(len(lines), 1),
+        'static_imbalance': float(static.max() / mean),
+        'dynamic_imbalance': float(dynamic.max() / mean),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ray traversal orders for texture locality and load balance.")
+    parser.add_argument("-resolution", type=parse_resolution, default=[3840, 2160],
+                        help="Resolution as WIDTHxHEIGHT (default: 3840x2160)")
+    parser.add_argument("-h_step", type=float, default=0.011, help="Step size h (default: 0.011)")
+    parser.add_argument("-integrator", type=str, default='rk4', help="Integrator timed with -repeats (default: rk4)")
+    parser.add_argument("-orders", nargs='+', default=ALL_ORDERS, choices=ALL_ORDERS,
+                        help="Orders to compare (default: all)")
+    parser.add_argument("-tile", type=int, default=8, help="Tile edge in pixels for the tiled orders (default: 8)")
+    parser.add_argument("-sky_projection", type=str, default='equirect', choices=['equirect', 'cube'],
+                        help="Skymap layout (default: equirect)")
+    parser.add_argument("-threads", type=int, default=16, help="Simulated CPU threads (default: 16)")
+    parser.add_argument("-chunk", type=int, default=512, help="Rays per dynamically scheduled chunk (default: 512)")
+    parser.add_argument("-cache_kb", type=int, default=256, help="Simulated private cache per thread in KB (default: 256)")
+    parser.add_argument("-repeats", type=int, default=0, help="Also time the real solve in each order this many times (default: 0)")
+    parser.add_argument("-output", "-o", type=str, default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    import taichi as ti
+
+    from runtime import init_taichi
+    from solver import Solver
+    from traversal import Traversal
+
+    init_taichi(cpu=True, kernel_cache=None)
+    os.chdir(ROOT)
+    width, height = args.resolution
+    print(f'Tracing {width}x{height} rays...')
+    steps, accesses, (my_camera, scene) = trace_scene(width, height, args.h_step, args.sky_projection)
+    # Diagnostics are indexed by pixel, so the timed solver records none
+    my_solver = Solver(scene, h=args.h_step)
+
+    # Cost estimate from the impact parameter, and how well it ranks the real step counts
+    estimate = estimate_costs(my_camera.positions.to_numpy(), my_camera.directions.to_numpy())
+    ranks = [np.argsort(np.argsort(v.ravel())) for v in (estimate, steps)]
+    print(f'Impact-parameter cost estimate: rank correlation {np.corrcoef(*ranks)[0, 1]:.3f} with step counts')
+    costs = {'cost': estimate, 'cost_measured': steps.reshape(width, height)}
+
+    results = []
+    for order in args.orders:
+        if order == 'native':
+            visit = np.arange(width * height)
+        else:
+            pixels = pixel_order(width, height, 'cost' if order in costs else order, args.tile,
+                                 costs=costs.get(order), threads=args.threads).astype(np.int64)
+            visit = pixels[:, 0] * height + pixels[:, 1]
+        result = evaluate(order, visit, steps, accesses, args)
+
+        if args.repeats > 0:
+            colors = ti.Vector.field(3, dtype=ti.f32, shape=(width, height))
+            if order == 'native':
+                positions, directions = my_camera.get_all_rays()
+                run = lambda: my_solver.solve(args.integrator, positions, directions, colors)
+            else:
+                traversal = Traversal(width, height, 'cost' if order in costs else order, args.tile,
+                                      costs=costs.get(order), threads=ti.cfg.cpu_max_num_threads)
+                traversal.generate_rays(my_camera)
+                run = lambda: traversal.solve(my_solver, args.integrator, colors)
+            run()  # compile
+            times = []
+            for _ in range(args.repeats):
+                ti.sync()
+                start = time.perf_counter()
+                run()
+                ti.sync()
+                times.append(time.perf_counter() - start)
+            result['solve_time_median'] = float(np.median(times))
+
+        results.append(result)
+        timing = f"  solve {result['solve_time_median']:.3f} s" if 'solve_time_median' in result else ''
+        print(f"{order:13s} miss rate {result['miss_rate'] * 100:6.2f}%  "
+              f"imbalance static {result['static_imbalance']:.3f} dynamic {result['dynamic_imbalance']:.3f}{timing}",
+              flush=True)
+
+    if args.output:
+        report = {'machine': machine_info(), 'scene': SCENE,
+                  'settings': {k: v for k, v in vars(args).items() if k != 'output'}, 'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Saved {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# Performance regression gate: runs a small fixed benchmark on CPU and compares it against
+# the committed baseline (benchmarks/baseline.json). Exits with status 1 and prints a diff
+# when a metric is worse than its tolerance allows.
+#
+#   python benchmarks/regression.py                    # check against the baseline
+#   python benchmarks/regression.py --update-baseline  # re-measure and overwrite the baseline
+#   python benchmarks/regression.py -tolerance solve_time_min=0.25
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_solver import SCENE, machine_info, run_cell_subprocess
+from solver import INTEGRATORS
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# Small enough to run in well under a minute; single-threaded so timings are stable.
+# Timing tolerances are loose enough to absorb run-to-run noise on sub-second solves
+CELLS = [{'integrator': integrator, 'h': 0.02, 'resolution': [160, 90], 'threads': 1, 'repeats': 5, 'warmup': 1}
+         for integrator in INTEGRATORS]
+
+# metric: (kind, tolerance, direction). 'rel' tolerances are fractions of the baseline value,
+# 'abs' ones are absolute. direction 'higher' fails only when the metric grows, 'both' on any change.
+TOLERANCES = {
+    'solve_time_min': ('rel', 0.25, 'higher'),
+    'solve_time_median': ('rel', 0.30, 'higher'),
+    'compile_time': ('rel', 1.00, 'higher'),
+    'steps_per_ray_mean': ('rel', 0.01, 'higher'),
+    'steps_per_ray_p99': ('rel', 0.02, 'higher'),
+    'horizon_fraction': ('abs', 0.002, 'both'),
+}
+
+
+def cell_key(cell):
+    return f"{cell['integrator']} h={cell['h']} {cell['resolution'][0]}x{cell['resolution'][1]} threads={cell['threads']}"
+
+
+def measure(cells):
+    results = {}
+    for cell in cells:
+        key = cell_key(cell)
+        print(f'Running {key}...', flush=True)
+        result = run_cell_subprocess({**cell, 'scene': SCENE})
+        results[key] = {metric: result[metric] for metric in TOLERANCES}
+    return results
+
+
+def compare(baseline, current, tolerances):
+    """
+    Compares measured metrics against the baseline.
+
+    Returns:
+    - rows: list of (cell, metric, baseline, current, relative change or None, failed).
+    """
+    rows = []
+    for key, metrics in current.items():
+        if key not in baseline:
+            continue
+        for metric, (kind, tolerance, direction) in tolerances.items():
+            if metric not in baseline[key]:
+                continue
+            old, new = baseline[key][metric], metrics[metric]
+            delta = new - old
+            if kind == 'rel':
+                change = delta / old if old else 0.0
+            else:
+                change = delta
+            if direction == 'higher':
+                failed = change > tolerance
+            else:
+                failed = abs(change) > tolerance
+            rows.append((key, metric, old, new, change if kind == 'rel' else None, failed))
+    return rows
+
+
+def print_diff(rows):
+    width = max(len(row[0]) for row in rows)
+    for key, metric, old, new, change, failed in rows:
+        relative = f'{change * 100:+7.1f}%' if change is not None else f'{new - old:+8.4f}'
+        print(f"{'FAIL' if failed else '  ok'}  {key:{width}s}  {metric:20s} {old:12.4f} -> {new:12.4f}  {relative}")
+
+
+def parse_tolerance(text):
+    metric, value = text.split('=')
+    if metric not in TOLERANCES:
+        raise argparse.ArgumentTypeError(f"Unknown metric '{metric}', use one of {list(TOLERANCES)}")
+    return metric, float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare solver performance against the committed baseline.")
+    parser.add_argument("-baseline", type=str, default=DEFAULT_BASELINE,
+                        help="Baseline file (default: benchmarks/baseline.json)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Measure and overwrite the baseline instead of checking it")
+    parser.add_argument("-tolerance", nargs='+', type=parse_tolerance, default=[], metavar='METRIC=VALUE',
+                        help="Override tolerances, e.g. solve_time_min=0.25")
+    args = parser.parse_args()
+
+    tolerances = dict(TOLERANCES)
+    for metric, value in args.tolerance:
+        kind, _, direction = tolerances[metric]
+        tolerances[metric] = (kind, value, direction)
+
+    if args.update_baseline:
+        baseline = {'machine': machine_info(), 'scene': SCENE, 'cells': CELLS, 'results': measure(CELLS)}
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f'Saved {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        sys.exit(f'No baseline at {args.baseline}; create one with --update-baseline')
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    machine = machine_info()
+    if baseline['machine'] != machine:
+        print(f"Warning: baseline was measured on a different machine ({baseline['machine']['processor'] or baseline['machine']['platform']}); "
+              f"timings may not be comparable. Refresh it with --update-baseline.")
+
+    current = measure(baseline['cells'])
+    rows = compare(baseline['results'], current, tolerances)
+    print()
+    print_diff(rows)
+
+    failures = sum(row[5] for row in rows)
+    if failures:
+        print(f'\n{failures} metric(s) regressed beyond tolerance')
+        sys.exit(1)
+    print('\nNo performance regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,30 @@ import taichi as ti
 
 @ti.data_oriented
 class Camera:
-    def __init__(self, pos, focal_length, look_at, img_res, up=np.array([0, 0, 1], dtype=np.float32), fov=90):
+    def __init__(self, pos, focal_length, look_at, img_res, up=np.array([0, 0, 1], dtype=np.float32), fov=90,
+                 window=None):
         # Initialize camera parameters
         pos = pos.astype(np.float32)
         look_at = look_at.astype(np.float32)
         up = up.astype(np.float32)
+        self._world_up = up
 
         self._image_width = int(img_res[0])
         self._image_height = int(img_res[1])
         self._aspect_ratio = self._image_width / self._image_height
 
+        # Optional crop window (x0, y0, width, height) of the img_res frame. Only its rays are
+        # generated, with the directions they have in the full frame. Its size fixes the field
+        # shapes; its offset can be moved later with set_window.
+        if window is None:
+            window = (0, 0, self._image_width, self._image_height)
+        self._window_width = int(window[2])
+        self._window_height = int(window[3])
+        if self._window_width < 1 or self._window_height < 1:
+            raise ValueError(f"Camera window {tuple(window)} is empty")
+        self.window_offset = ti.Vector.field(2, dtype=ti.i32, shape=())
+        self.set_window(window[0], window[1])
+
         # Define Taichi fields for camera parameters
         self.pos = ti.Vector.field(3, dtype=ti.f32, shape=())
         self.look_at = ti.Vector.field(3, dtype=ti.f32, shape=())
@@ -32,9 +46,9 @@ class Camera:
         self.aspect_ratio[None] = self._image_width / self._image_height
 
         # Allocate Taichi fields for positions, directions, and rendered image
-        self.positions = ti.Vector.field(3, dtype=ti.f32, shape=(self._image_width, self._image_height))
-        self.directions = ti.Vector.field(3, dtype=ti.f32, shape=(self._image_width, self._image_height))
-        self.image = ti.Vector.field(3, dtype=ti.f32, shape=(self._image_width, self._image_height))  # RGB image
+        self.positions = ti.Vector.field(3, dtype=ti.f32, shape=(self._window_width, self._window_height))
+        self.directions = ti.Vector.field(3, dtype=ti.f32, shape=(self._window_width, self._window_height))
+        self.image = ti.Vector.field(3, dtype=ti.f32, shape=(self._window_width, self._window_height))  # RGB image
 
         # Initialize forward, right vectors
         self.update_camera_vectors()
@@ -47,8 +61,8 @@ class Camera:
         self.right[None] = ti.math.cross(direction, self.up[None]).normalized()
         self.up[None] = ti.math.cross(self.right[None], self.forward[None]).normalized()
 
-    @ti.kernel
-    def generate_rays(self):
+    @ti.func
+    def image_plane(self):
         # Image plane dimensions
         fov_radians = (self.fov[None] / 2.0) * (3.141592653589793 / 180.0)  # Convert degrees to radians
         image_plane_height = 2.0 * self.focal_length[None] * ti.tan(fov_radians)
@@ -65,20 +79,40 @@ class Camera:
                 - (image_plane_width / 2.0) * self.right[None]
                 + (image_plane_height / 2.0) * self.up[None]
         )
+        return top_left, pixel_width, pixel_height
+
+    @ti.func
+    def pixel_direction(self, i, j, top_left, pixel_width, pixel_height):
+        # Compute the position of the current pixel on the image plane
+        pixel_pos = (
+                top_left
+                + (i + 0.5) * pixel_width * self.right[None]
+                - (j + 0.5) * pixel_height * self.up[None]
+        )
+        # Direction from the camera position to the pixel position
+        return (pixel_pos - self.pos[None]).normalized()
 
-        for i, j in ti.ndrange(self._image_width, self._image_height):
-            # Compute the position of the current pixel on the image plane
-            pixel_pos = (
-                    top_left
-                    + (i + 0.5) * pixel_width * self.right[None]
-                    - (j + 0.5) * pixel_height * self.up[None]
-            )
-            # Direction from the camera position to the pixel position
-            direction = (pixel_pos - self.pos[None]).normalized()
+    @ti.kernel
+    def generate_rays(self):
+        top_left, pixel_width, pixel_height = self.image_plane()
 
+        offset = self.window_offset[None]
+        for i, j in ti.ndrange(self._window_width, self._window_height):
             # Assign values to Taichi fields
             self.positions[i, j] = self.pos[None]
-            self.directions[i, j] = direction
+            self.directions[i, j] = self.pixel_direction(i + offset[0], j + offset[1], top_left, pixel_width, pixel_height)
+
+    @ti.kernel
+    def generate_rays_at(self, pixels: ti.template(), positions: ti.template(), directions: ti.template()):
+        # Rays of the listed window pixels, in list order, into (len(pixels), 1) fields
+        top_left, pixel_width, pixel_height = self.image_plane()
+
+        offset = self.window_offset[None]
+        for k in pixels:
+            pixel = pixels[k]
+            positions[k, 0] = self.pos[None]
+            directions[k, 0] = self.pixel_direction(pixel[0] + offset[0], pixel[1] + offset[1], top_left,
+                                                    pixel_width, pixel_height)
 
     @ti.kernel
     def generate_rays_perpendicular(self):
@@ -102,12 +136,13 @@ class Camera:
         # All rays will share the same direction, which is the forward direction.
         ray_direction = self.forward[None].normalized()
 
-        for i, j in ti.ndrange(self._image_width, self._image_height):
+        offset = self.window_offset[None]
+        for i, j in ti.ndrange(self._window_width, self._window_height):
             # Compute the position of the current pixel on the image plane
             pixel_pos = (
                     top_left
-                    + (i + 0.5) * pixel_width * self.right[None]
-                    - (j + 0.5) * pixel_height * self.up[None]
+                    + (i + offset[0] + 0.5) * pixel_width * self.right[None]
+                    - (j + offset[1] + 0.5) * pixel_height * self.up[None]
             )
 
             # For an orthographic (parallel) projection, the ray's origin is at pixel_pos,
@@ -130,9 +165,32 @@ class Camera:
     def render(self, colors):
         # Render the scene by assigning colors
         self.render_scene(colors)
+        return self.read_image()
+
+    def read_image(self):
+        # Copy the rendered image back to the host
         image_np = self.image.to_numpy()
         return np.clip(image_np, 0, 1)
 
+    def set_view(self, pos, focal_length, look_at, fov):
+        # Point an existing camera somewhere else without reallocating its fields
+        self.pos[None] = np.asarray(pos, dtype=np.float32)
+        self.look_at[None] = np.asarray(look_at, dtype=np.float32)
+        self.focal_length[None] = np.float32(focal_length)
+        self.fov[None] = np.float32(fov)
+        self.update_camera()
+
+    def set_window(self, x0, y0):
+        # Move the crop window within the full frame; its size is fixed at construction
+        x0, y0 = int(x0), int(y0)
+        if (x0 < 0 or y0 < 0 or x0 + self._window_width > self._image_width
+                or y0 + self._window_height > self._image_height):
+            raise ValueError(f"Camera window ({x0}, {y0}, {self._window_width}, {self._window_height}) "
+                             f"does not fit in the {self._image_width}x{self._image_height} frame")
+        self.window_offset[None] = [x0, y0]
+
     def update_camera(self):
-        # Update the camera's orientation vectors after position or look_at changes
-        self.update_camera_vectors()
\ No newline at end of file
+        # Update the camera's orientation vectors after position or look_at changes.
+        # Start again from the world up vector so the camera does not roll over successive updates.
+        self.up[None] = self._world_up
+        self.update_camera_vectors()
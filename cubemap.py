@@ -0,0 +1,144 @@
+# Equirectangular to cube map conversion for the skymap, in NumPy only (no Taichi), so the
+# conversion and its disk cache can be used and checked without a Taichi runtime.
+#
+# Layout: face 2 * k + (0 if positive else 1) looks down axis k (0: x, 1: y, 2: z). A direction
+# d on face (k, sign) has face coordinates s = d[a] / |d[k]|, t = d[b] / |d[k]| in [-1, 1],
+# where (a, b) are the other two axes in increasing order. Faces are stored with a one-texel
+# border sampled past the face edge, so bilinear lookups never need a neighbouring face.
+import hashlib
+import os
+
+import numpy as np
+
+FACE_AXES = ((0, 1, 2), (0, 1, 2), (1, 0, 2), (1, 0, 2), (2, 0, 1), (2, 0, 1))  # (k, a, b) per face
+CACHE_VERSION = 1
+
+# Converted cube maps, next to the compiled-kernel cache
+DEFAULT_CUBEMAP_CACHE = os.environ.get(
+    'BLACKHOLE_CUBEMAP_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'blackhole_rendering', 'cubemaps'))
+
+
+def face_directions(face, face_size):
+    """
+    Returns the (face_size + 2, face_size + 2, 3) unnormalized directions of a face's texel
+    centers, including the one-texel border.
+    """
+    k, a, b = FACE_AXES[face]
+    coords = (np.arange(-1, face_size + 1, dtype=np.float64) + 0.5) / face_size * 2.0 - 1.0
+    s, t = np.meshgrid(coords, coords, indexing='ij')
+    directions = np.empty(s.shape + (3,), dtype=np.float64)
+    directions[..., k] = 1.0 if face % 2 == 0 else -1.0
+    directions[..., a] = s
+    directions[..., b] = t
+    return directions
+
+
+def sample_equirect(texture, directions):
+    """
+    Bilinear lookup of an equirectangular texture in the layout Skymap uses
+    (u = phi / 2pi along the width, v = theta / pi along the height).
+
+    Parameters:
+    - texture: numpy.ndarray, (height, width, 3) float32 image.
+    - directions: numpy.ndarray, (..., 3) directions, not necessarily normalized.
+
+    Returns:
+    - colors: numpy.ndarray, (..., 3) float32.
+    """
+    height, width, _ = texture.shape
+    d = directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+    theta = np.arccos(np.clip(d[..., 2], -1.0, 1.0))
+    phi = np.mod(np.arctan2(d[..., 1], d[..., 0]), 2 * np.pi)
+
+    # Continuous texel coordinates; u wraps around, v is clamped at the poles
+    x = phi / (2 * np.pi) * width - 0.5
+    y = np.clip(theta / np.pi * height - 0.5, 0.0, height - 1.0)
+    x0, y0 = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+    fx, fy = (x - x0)[..., None], (y - y0)[..., None]
+    x1, y1 = (x0 + 1) % width, np.minimum(y0 + 1, height - 1)
+    x0 %= width
+    return ((1 - fx) * (1 - fy) * texture[y0, x0] + fx * (1 - fy) * texture[y0, x1]
+            + (1 - fx) * fy * texture[y1, x0] + fx * fy * texture[y1, x1]).astype(np.float32)
+
+
+def equirect_to_cubemap(texture, face_size=None):
+    """
+    Resamples an equirectangular texture into a cube map.
+
+    Parameters:
+    - texture: numpy.ndarray, (height, width, 3) float32 image.
+    - face_size: int, texels along a face edge. Defaults to width / 4, which keeps the texel
+      density of the equator; the poles, oversampled by the equirectangular layout, shrink.
+
+    Returns:
+    - faces: numpy.ndarray, (6, face_size + 2, face_size + 2, 3) float32, with borders.
+    """
+    if face_size is None:
+        face_size = max(1, texture.shape[1] // 4)
+    faces = np.empty((6, face_size + 2, face_size + 2, 3), dtype=np.float32)
+    for face in range(6):
+        faces[face] = sample_equirect(texture, face_directions(face, face_size))
+    return faces
+
+
+def load_cubemap(image_path, texture, face_size=None, cache_dir=None):
+    """
+    Converts a skymap texture to a cube map, reusing a cached conversion when available.
+
+    Parameters:
+    - image_path: str, the texture's file; its content hashes the cache entry.
+    - texture: numpy.ndarray, the decoded (height, width, 3) float32 texture.
+    - face_size: int or None, see equirect_to_cubemap.
+    - cache_dir: str or None, directory of .npy conversions. None disables the cache.
+
+    Returns:
+    - faces: numpy.ndarray, (6, face_size + 2, face_size + 2, 3) float32.
+    """
+    if face_size is None:
+        face_size = max(1, texture.shape[1] // 4)
+    cache_path = None
+    if cache_dir:
+        with open(image_path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        cache_path = os.path.join(cache_dir, f'{digest}_{face_size}_v{CACHE_VERSION}.npy')
+        if os.path.exists(cache_path):
+            return np.load(cache_path)
+
+    faces = equirect_to_cubemap(texture, face_size)
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write then rename, so a concurrent reader never sees a partial file
+        temp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, faces)
+        os.replace(temp_path, cache_path)
+    return faces
+
+
+def sample_cubemap(faces, directions, bilinear=True):
+    """
+    Cube map lookup for (..., 3) directions, as Skymap.get_color_from_ray_ti with a cube map.
+    """
+    face_size = faces.shape[1] - 2
+    d = np.asarray(directions, dtype=np.float64)
+    k = np.argmax(np.abs(d), axis=-1)
+    major = np.take_along_axis(d, k[..., None], axis=-1)[..., 0]
+    face = 2 * k + (major < 0)
+    a = np.where(k == 0, 1, 0)
+    b = np.where(k == 2, 1, 2)
+    s = np.take_along_axis(d, a[..., None], axis=-1)[..., 0] / np.abs(major)
+    t = np.take_along_axis(d, b[..., None], axis=-1)[..., 0] / np.abs(major)
+
+    # Texel coordinates with texel centers at integers, counting the border texel as 0
+    x = (s + 1.0) * 0.5 * face_size + 0.5
+    y = (t + 1.0) * 0.5 * face_size + 0.5
+    if not bilinear:
+        xi = np.clip(np.floor(x + 0.5).astype(np.int64), 1, face_size)
+        yi = np.clip(np.floor(y + 0.5).astype(np.int64), 1, face_size)
+        return faces[face, xi, yi]
+    x0 = np.clip(np.floor(x).astype(np.int64), 0, face_size)
+    y0 = np.clip(np.floor(y).astype(np.int64), 0, face_size)
+    fx = (x - x0)[..., None]
+    fy = (y - y0)[..., None]
+    return ((1 - fx) * (1 - fy) * faces[face, x0, y0] + fx * (1 - fy) * faces[face, x0 + 1, y0]
+            + (1 - fx) * fy * faces[face, x0, y0 + 1] + fx * fy * faces[face, x0 + 1, y0 + 1]).astype(np.float32)
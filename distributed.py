@@ -0,0 +1,427 @@
+# Distributed tile rendering: a coordinator splits frames into tiles and hands them to workers
+# connected over TCP. Workers receive the render settings and texture files once, render tiles
+# with a warm RenderSession and send the pixels back; tiles of a worker that fails, disconnects
+# or times out are handed to another worker.
+#
+#   python distributed.py coordinator -host 0.0.0.0 -authkey SECRET -resolution 16384x8192 -tile 1024 -output poster.png
+#   python distributed.py worker -connect coordinator-host:8715 -authkey SECRET   # on every node
+#
+#   python distributed.py coordinator -resolution fhd -local_workers 4 --cpu -threads 2   # one machine
+#
+# A .npy or .raw -output is written tile by tile into a memory-mapped file (see tile_output.py),
+# so the coordinator never holds a whole frame; rerunning an interrupted render resumes it.
+#
+#   python distributed.py coordinator -resolution 32768x16384 -tile 1024 -output poster.npy -stream_dtype uint16
+#
+# Messages are pickled Python objects over multiprocessing.connection, so whoever holds the
+# -authkey can run code on the coordinator and the workers. The coordinator listens on loopback
+# with a random key unless told otherwise, and needs an explicit -authkey to listen on any other
+# address.
+import argparse
+import collections
+import json
+import ipaddress
+import os
+import queue
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from image_io import save_image
+from render_session import RESOLUTIONS, normalize_job, orbit_pov
+from runtime import DEFAULT_KERNEL_CACHE
+from tile_output import STREAM_DTYPES, STREAM_FORMATS, TileWriter, is_stream_output, load_progress
+
+DEFAULT_PORT = 8715
+AUTHKEY_ENV = 'BLACKHOLE_AUTHKEY'  # -authkey default; also how local workers get the key
+
+
+def split_tiles(width, height, tile):
+    """
+    Returns the (x0, y0, width, height) tiles covering a frame, row by row.
+    """
+    return [(x0, y0, min(tile, width - x0), min(tile, height - y0))
+            for y0 in range(0, height, tile) for x0 in range(0, width, tile)]
+
+
+def render_window(item, resolution, tile):
+    """
+    Window (x0, y0, width, height) rendered for a work item: tile x tile (or the frame, if
+    smaller), moved left and up as needed to fit in the frame. The item's pixels start at
+    (item x0 - window x0, item y0 - window y0) in the rendered image.
+    """
+    _, x0, y0, _, _ = item
+    width, height = min(tile, resolution[0]), min(tile, resolution[1])
+    return min(x0, resolution[0] - width), min(y0, resolution[1] - height), width, height
+
+
+class TileCoordinator:
+    def __init__(self, job, items, tile, num_frames=1, tile_timeout=600.0, max_retries=3):
+        """
+        Hands out tiles to connected workers and collects the results.
+
+        Parameters:
+        - job: dict, normalized render settings shared by every tile.
+        - items: list of (frame, x0, y0, width, height) work items.
+        - tile: int, tile edge in pixels the items were split with.
+        - num_frames: int, frames of the orbit around the z-axis through job['pov']; 1 for a still.
+        - tile_timeout: float, seconds a worker may take for one tile before it is dropped
+          and the tile handed to another worker.
+        - max_retries: int, times a tile may fail before the whole render is abandoned.
+        """
+        self.job = job
+        self.tile = tile
+        self.num_frames = num_frames
+        self.tile_timeout = tile_timeout
+        self.max_retries = max_retries
+        self.results = queue.Queue()
+        self.error = None
+
+        # Texture files are sent to every worker once, by their role in the job
+        self.textures = {}
+        for key in ('texture', 'at'):
+            with open(job[key], 'rb') as f:
+                self.textures[key] = (os.path.basename(job[key]), f.read())
+
+        self._condition = threading.Condition()
+        self._pending = collections.deque(items)
+        self._in_flight = 0
+        self._completed = 0
+        self._failures = collections.Counter()
+
+    def _take(self):
+        # Next item, or None once everything is done (or abandoned). Waits while other workers
+        # still hold tiles, since they may fail and put them back.
+        with self._condition:
+            while not self._pending and self._in_flight and self.error is None:
+                self._condition.wait()
+            if not self._pending or self.error is not None:
+                return None
+            self._in_flight += 1
+            return self._pending.popleft()
+
+    def _finish(self, item, failure=None):
+        with self._condition:
+            self._in_flight -= 1
+            if failure is None:
+                self._completed += 1
+            else:
+                self._failures[item] += 1
+                if self._failures[item] > self.max_retries:
+                    self.error = f'Tile {item} failed {self._failures[item]} times, last: {failure}'
+                    self.results.put(None)
+                else:
+                    print(f'Retrying tile {item}: {failure}')
+                    self._pending.appendleft(item)
+            self._condition.notify_all()
+
+    def serve_worker(self, conn):
+        # Feeds one worker connection until the work runs out or the worker is lost
+        try:
+            _, host, pid = conn.recv()
+            worker = f'{host}:{pid}'
+            conn.send(('setup', self.job, self.textures))
+        except (EOFError, OSError) as e:
+            print(f'Worker failed during setup: {e}')
+            conn.close()
+            return
+        print(f'Worker {worker} connected')
+
+        while True:
+            item = self._take()
+            if item is None:
+                try:
+                    conn.send(('done',))
+                except OSError:
+                    pass
+                conn.close()
+                return
+
+            start = time.perf_counter()
+            try:
+                conn.send(('tile', item, self.frame_settings(item)))
+                if not conn.poll(self.tile_timeout):
+                    raise TimeoutError(f'no result after {self.tile_timeout:.0f} s')
+                kind, _, payload = conn.recv()
+            except (EOFError, OSError, TimeoutError) as e:
+                # The worker is gone or stuck: put its tile back and stop feeding it
+                self._finish(item, failure=f'worker {worker} lost ({type(e).__name__}: {e})')
+                conn.close()
+                return
+
+            if kind == 'result':
+                self.results.put((item, payload, worker, time.perf_counter() - start))
+                self._finish(item)
+            else:
+                self._finish(item, failure=f'worker {worker}: {payload}')
+
+    def frame_settings(self, item):
+        # Per-tile job fields: the render window, and the camera position of the tile's frame.
+        # Every window has the full tile size so workers compile the solver once; edge tiles
+        # are shifted back inside the frame and cropped when assembled (see render_window).
+        frame = item[0]
+        settings = {'window': list(render_window(item, self.job['resolution'], self.tile))}
+        if self.num_frames > 1:
+            settings['pov'] = orbit_pov(self.job['pov'], frame, self.num_frames)
+        return settings
+
+    def accept(self, listener):
+        # Accepts workers for as long as the coordinator runs
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError):
+                return
+            except Exception as e:  # failed authentication and the like
+                print(f'Rejected connection: {e}')
+                continue
+            threading.Thread(target=self.serve_worker, args=(conn,), daemon=True).start()
+
+
+def run_worker(address, authkey, cpu=False, threads=None, kernel_cache=DEFAULT_KERNEL_CACHE):
+    """
+    Connects to a coordinator and renders tiles until it says it is done.
+    """
+    # Imported here so the coordinator does not need a Taichi runtime
+    from render_session import RenderSession
+    from runtime import init_taichi
+
+    conn = Client(address, authkey=authkey.encode())
+    conn.send(('hello', socket.gethostname(), os.getpid()))
+    _, job, textures = conn.recv()
+
+    with tempfile.TemporaryDirectory(prefix='blackhole_textures_') as texture_dir:
+        # Textures arrive as file bytes; decode them from local copies
+        for key, (name, data) in textures.items():
+            path = os.path.join(texture_dir, f'{key}_{name}')
+            with open(path, 'wb') as f:
+                f.write(data)
+            job[key] = path
+
+        kwargs = {'cpu_max_num_threads': threads} if cpu and threads else {}
+        init_taichi(cpu=cpu, kernel_cache=kernel_cache, **kwargs)
+        session = RenderSession()
+        while True:
+            message = conn.recv()
+            if message[0] == 'done':
+                break
+            _, item, settings = message
+            try:
+                img = session.render({**job, **settings})
+                conn.send(('result', item, img.astype(np.float32)))
+            except Exception as e:
+                conn.send(('error', item, f'{type(e).__name__}: {e}'))
+    conn.close()
+
+
+def is_loopback(host):
+    # True if every address the host name resolves to is a loopback address
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return all(ipaddress.ip_address(info[4][0]).is_loopback for info in infos)
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def parse_resolution(text):
+    if text in RESOLUTIONS:
+        return list(RESOLUTIONS[text])
+    width, height = (int(v) for v in text.lower().split('x'))
+    return [width, height]
+
+
+def load_job(text):
+    # -job is a JSON object or the path of a JSON file
+    if text is None:
+        return {}
+    if os.path.exists(text):
+        with open(text) as f:
+            return json.load(f)
+    return json.loads(text)
+
+
+def run_coordinator(args):
+    width, height = parse_resolution(args.resolution)
+    job = normalize_job({**load_job(args.job), 'resolution': [width, height]})
+    tiles = split_tiles(width, height, args.tile)
+    stream = is_stream_output(args.output)
+
+    def frame_path(frame):
+        return args.output.format(frame=frame) if args.frames > 1 else args.output
+
+    def stream_params(frame):
+        # Settings a streamed file is resumed under
+        return {'job': job, 'tile': args.tile, 'frame': frame, 'frames': args.frames}
+
+    items = []
+    for frame in range(args.start, args.frames):
+        # Streamed frames skip the tiles an interrupted run already wrote
+        written = load_progress(frame_path(frame), width, height, stream_params(frame),
+                                args.stream_dtype) if stream else set()
+        items += [(frame,) + tile for tile in tiles if tile not in written]
+    if not items:
+        print(f'Nothing to render: every tile of {args.output} is already written')
+        return
+    coordinator = TileCoordinator(job, items, args.tile, num_frames=args.frames, tile_timeout=args.tile_timeout,
+                                  max_retries=args.max_retries)
+
+    listener = Listener((args.host, args.port), authkey=args.authkey.encode())
+    address = listener.address
+    threading.Thread(target=coordinator.accept, args=(listener,), daemon=True).start()
+    print(f'Coordinator on {address[0]}:{address[1]}: {len(items)} tiles of {args.tile} px '
+          f'for {args.frames - args.start} frame(s) of {width}x{height}')
+
+    local_workers = []
+    for _ in range(args.local_workers):
+        command = [sys.executable, os.path.abspath(__file__), 'worker',
+                   '-connect', f'{address[0]}:{address[1]}', '-kernel_cache', args.kernel_cache]
+        if args.cpu:
+            command.append('--cpu')
+        if args.threads:
+            command += ['-threads', str(args.threads)]
+        # The key goes through the environment rather than the command line, which other
+        # users can read from the process list
+        local_workers.append(subprocess.Popen(command, env={**os.environ, AUTHKEY_ENV: args.authkey}))
+
+    # Assemble tiles into frames and save each frame as soon as it is complete. Streamed
+    # frames are written tile by tile into memory-mapped files instead.
+    start = time.perf_counter()
+    frames = {}
+    remaining = collections.Counter(item[0] for item in items)
+    done = 0
+    try:
+        while done < len(items):
+            result = coordinator.results.get()
+            if result is None:
+                raise SystemExit(coordinator.error)
+            item, img, worker, seconds = result
+            frame, x0, y0, tile_width, tile_height = item
+            window_x0, window_y0, _, _ = render_window(item, (width, height), args.tile)
+            img = img[x0 - window_x0:x0 - window_x0 + tile_width, y0 - window_y0:y0 - window_y0 + tile_height]
+            if frame not in frames:
+                if stream:
+                    frames[frame] = TileWriter(frame_path(frame), width, height, stream_params(frame),
+                                               args.stream_dtype)
+                else:
+                    frames[frame] = np.zeros((width, height, 3), dtype=np.float32)
+            if stream:
+                frames[frame].write((x0, y0, tile_width, tile_height), img)
+            else:
+                frames[frame][x0:x0 + tile_width, y0:y0 + tile_height] = img
+            done += 1
+            remaining[frame] -= 1
+            print(f'Tile {done}/{len(items)} (frame {frame}, {x0},{y0} {tile_width}x{tile_height}) '
+                  f'from {worker} in {seconds:.2f} s')
+            if remaining[frame] == 0:
+                path = frame_path(frame)
+                if stream:
+                    frames.pop(frame).close()
+                else:
+                    if os.path.dirname(path):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                    save_image(frames.pop(frame), path, bit_depth=args.bit_depth)
+                print(f'Saved {path}')
+    finally:
+        if stream:
+            # Flush partly written frames; their sidecars let a rerun resume them
+            for writer in frames.values():
+                writer.close()
+        listener.close()
+        for process in local_workers:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    print(f'Rendered {len(items)} tiles in {time.perf_counter() - start:.2f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render frames as tiles on workers connected over TCP.")
+    parser.add_argument("mode", choices=["coordinator", "worker"],
+                        help="Hand out tiles and assemble the images, or render tiles for a coordinator")
+
+    # Connection
+    parser.add_argument("-host", type=str, default='127.0.0.1',
+                        help="Coordinator: address to listen on; any non-loopback address needs -authkey. "
+                             "(default: 127.0.0.1)")
+    parser.add_argument("-port", type=int, default=DEFAULT_PORT,
+                        help=f"Coordinator: port to listen on, 0 for any free port. (default: {DEFAULT_PORT})")
+    parser.add_argument("-connect", type=str, default=f'127.0.0.1:{DEFAULT_PORT}',
+                        help=f"Worker: coordinator address as HOST:PORT. (default: 127.0.0.1:{DEFAULT_PORT})")
+    parser.add_argument("-authkey", type=str, default=os.environ.get(AUTHKEY_ENV),
+                        help=f"Shared secret authenticating workers; anyone holding it can run code on the "
+                             f"coordinator and workers. (default: ${AUTHKEY_ENV}, or for a coordinator on "
+                             f"loopback a random key)")
+
+    # Work
+    parser.add_argument("-job", type=str, default=None,
+                        help="Render settings as a JSON object or file with DEFAULT_JOB keys from render_session.py")
+    parser.add_argument("-resolution", "-r", type=str, default='4k',
+                        help="Frame resolution: 4k, fhd or WIDTHxHEIGHT. (default: 4k)")
+    parser.add_argument("-tile", type=int, default=512,
+                        help="Tile edge in pixels. (default: 512)")
+    parser.add_argument("-frames", type=int, default=1,
+                        help="Frames of an orbit around the z-axis; 1 renders a still. (default: 1)")
+    parser.add_argument("-start", type=int, default=0,
+                        help="First frame to render. (default: 0)")
+    parser.add_argument("-output", "-o", type=str, default=None,
+                        help="Output file; with -frames > 1 a pattern with {frame}. "
+                             "(default: result.png, or frames/frame_{frame:04d}.png)")
+    parser.add_argument("-bit_depth", type=int, default=8, choices=[8, 16],
+                        help="Bits per channel for PNG and TIFF output. (default: 8)")
+    parser.add_argument("-stream_dtype", type=str, default='float32', choices=STREAM_DTYPES,
+                        help=f"Sample type of {'/'.join(STREAM_FORMATS)} output, which is written tile by tile into a "
+                             "memory-mapped file and resumed after an interruption. (default: float32)")
+    parser.add_argument("-tile_timeout", type=float, default=600.0,
+                        help="Seconds before a silent worker is dropped and its tile retried. (default: 600)")
+    parser.add_argument("-max_retries", type=int, default=3,
+                        help="Retries per tile before the render is abandoned. (default: 3)")
+    parser.add_argument("-local_workers", type=int, default=0,
+                        help="Coordinator: also start this many worker processes on this machine. (default: 0)")
+
+    # Rendering
+    parser.add_argument(
+        "--cpu",
+        action="store_true",
+        help="Use CPU for rendering (default: use GPU)"
+    )
+    parser.add_argument("-threads", type=int, default=None,
+                        help="cpu_max_num_threads of each worker. (default: all cores)")
+    parser.add_argument("-kernel_cache", type=str, default=DEFAULT_KERNEL_CACHE,
+                        help=f"Offline kernel cache directory, '' to disable. (default: {DEFAULT_KERNEL_CACHE})")
+    args = parser.parse_args()
+
+    if args.mode == 'worker':
+        if not args.authkey:
+            parser.error(f"a worker needs the coordinator's -authkey (or ${AUTHKEY_ENV})")
+        run_worker(parse_address(args.connect), args.authkey, cpu=args.cpu, threads=args.threads,
+                   kernel_cache=args.kernel_cache)
+        return
+
+    if args.output is None:
+        args.output = 'frames/frame_{frame:04d}.png' if args.frames > 1 else 'result.png'
+    elif args.frames > 1 and '{frame' not in args.output:
+        parser.error("-output needs a {frame} field when rendering several frames")
+    if not args.authkey:
+        if not is_loopback(args.host):
+            parser.error(f"listening on {args.host} needs an explicit -authkey (or ${AUTHKEY_ENV}); "
+                         "anyone who can connect with the key can run code on this machine")
+        args.authkey = secrets.token_hex()
+        print(f'Generated authkey: {args.authkey}')
+    run_coordinator(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 # main.py
 
 import numpy as np
-import matplotlib.pyplot as plt
 
 from camera import Camera
 from solver import Solver
@@ -9,10 +8,240 @@ from skymap import Skymap
 from scene import Scene
 
 import taichi as ti
+import argparse
+import multiprocessing as mp
 import os
+import queue
+
+from frame_manifest import FrameManifest, atomic_save
+from gbuffer import GBuffer
+from image_io import save_image
+from runtime import init_taichi
+from tracing import NULL_TRACER, Tracer
+from video_writer import VideoWriter
+
+
+def build_renderer(params, tracer=NULL_TRACER):
+    # Set up scene, solver and camera once per Taichi runtime.
+    with tracer.phase('texture_load'):
+        scene = Scene(blackhole_r=1.0,
+                      accretion_r1=float(params['ar1']),
+                      accretion_r2=float(params['ar2']),
+                      accretion_temp=400.0,
+                      accretion_alpha=1.0,
+                      skymap=Skymap(params['sky_texture'], r_max=10))
+        scene.set_accretion_disk_texture(params['accretion_texture'])
+    my_solver = Solver(scene, h=float(params['h']))
+
+    # Initialize the camera
+    my_camera = Camera(
+        pos=np.array(params['pov'], dtype=np.float32),
+        focal_length=params['focal'],
+        look_at=np.array([0, 0, 0], dtype=np.float32),  # Assuming looking at the origin
+        img_res=np.array(params['resolution']),
+        fov=params['fov']
+    )
+    colors = ti.Vector.field(3, dtype=ti.f32, shape=(my_camera._image_width, my_camera._image_height))
+    return my_camera, my_solver, colors
+
+
+def orbit_angle_step(params):
+    return 2.0 * np.pi / params['num_frames']
+
+
+def render_frame(my_camera, my_solver, colors, params, frame_idx, tracer=NULL_TRACER):
+    # Orbit parameters
+    cam_init_pos = np.array(params['pov'], dtype=np.float32)
+    radius = np.sqrt(cam_init_pos[0] ** 2 + cam_init_pos[1] ** 2)
+    cam_z = cam_init_pos[2]
+    initial_angle = np.arctan2(cam_init_pos[1], cam_init_pos[0]) if radius > 0 else 0.0
+    angle = initial_angle + frame_idx * orbit_angle_step(params)
+
+    # Update camera position
+    cam_x = radius * np.cos(angle)
+    cam_y = radius * np.sin(angle)
+    new_pos = np.array([cam_x, cam_y, cam_z], dtype=np.float32)
+    my_camera.pos[None] = new_pos
+
+    # Update camera vectors based on the new position
+    my_camera.update_camera()
+
+    print(f'Generating rays for frame {frame_idx}...')
+    with tracer.phase('generate_rays', frame=frame_idx):
+        my_camera.generate_rays()
+    positions, directions = my_camera.positions, my_camera.directions
+
+    colors.fill(0.0)
+
+    print(f'Solving ODE for frame {frame_idx}...')
+    with tracer.phase('solve', frame=frame_idx):
+        my_solver.solve_rk4(positions, directions, colors)
+
+    print(f'Rendering frame {frame_idx}...')
+    with tracer.phase('render_scene', frame=frame_idx):
+        my_camera.render_scene(colors)
+    with tracer.phase('to_numpy', frame=frame_idx):
+        return my_camera.read_image()
+
+
+def save_frame(img, frame_filename):
+    atomic_save(frame_filename, lambda path: save_image(img, path))
+
+
+def frame_worker(params, num_threads, output_dir, stream, trace, task_queue, result_queue):
+    # Each worker owns a Taichi CPU runtime and renders whole frames pulled from the queue.
+    tracer = Tracer(enabled=trace)
+    with tracer.phase('ti.init', sync=False):
+        init_taichi(cpu=True, cpu_max_num_threads=num_threads)
+    my_camera, my_solver, colors = build_renderer(params, tracer)
+
+    while True:
+        frame_idx = task_queue.get()
+        if frame_idx is None:
+            break
+        with tracer.phase('frame', frame=frame_idx):
+            img = render_frame(my_camera, my_solver, colors, params, frame_idx, tracer)
+            if stream:
+                # Send 8-bit frames back for in-order encoding
+                result_queue.put((frame_idx, (img * 255.0 + 0.5).astype(np.uint8)))
+            else:
+                with tracer.phase('save', frame=frame_idx):
+                    save_frame(img, f"{output_dir}/frame_{frame_idx:03d}.png")
+                result_queue.put((frame_idx, None))
+
+    if trace:
+        # Frame index None carries the worker's trace events
+        result_queue.put((None, tracer.events))
+
+
+def render_parallel(params, pending, num_workers, num_threads, output_dir, manifest, video, tracer=NULL_TRACER):
+    ctx = mp.get_context('spawn')  # Taichi runtimes must not be forked
+    task_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    for frame_idx in pending:
+        task_queue.put(frame_idx)
+    for _ in range(num_workers):
+        task_queue.put(None)
+
+    workers = [ctx.Process(target=frame_worker,
+                           args=(params, num_threads, output_dir, video is not None, tracer.enabled,
+                                 task_queue, result_queue))
+               for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    print(f'Started {num_workers} workers with {num_threads} CPU threads each')
+
+    # Frames finish out of order; video frames are buffered until their turn.
+    waiting = {}
+    next_idx = 0
+    received = 0
+    traces = 0
+    while received < len(pending) or (tracer.enabled and traces < num_workers):
+        while True:
+            try:
+                frame_idx, img = result_queue.get(timeout=10)
+                break
+            except queue.Empty:
+                failed = [worker.exitcode for worker in workers if worker.exitcode not in (None, 0)]
+                if failed:
+                    raise RuntimeError(f'Frame worker exited with code {failed[0]}; rerun to resume')
+        if frame_idx is None:
+            tracer.add_events(img)
+            traces += 1
+            continue
+        received += 1
+        if video is None:
+            manifest.mark_done(frame_idx)
+            print(f'Frame {frame_idx} saved as {output_dir}/frame_{frame_idx:03d}.png')
+            continue
+        waiting[frame_idx] = img
+        while next_idx < len(pending) and pending[next_idx] in waiting:
+            # No Taichi runtime in this process, so no device sync
+            with tracer.phase('encode', sync=False, frame=pending[next_idx]):
+                video.write(waiting.pop(pending[next_idx]))
+            print(f'Frame {pending[next_idx]} encoded')
+            next_idx += 1
+
+    for worker in workers:
+        worker.join()
 
 
 def main():
+    # Create an argument parser
+    parser = argparse.ArgumentParser(description="Render an orbit animation around the black hole.")
+
+    # Output mode (string: 'frames' or 'video')
+    parser.add_argument(
+        "-output_mode", "-m",
+        type=str,
+        default='frames',
+        choices=["frames", "video"],
+        help="'frames' writes one PNG per frame, 'video' streams frames into a video file (default: frames)"
+    )
+
+    # Video file name (string)
+    parser.add_argument("-video", type=str,
+                        default='orbit.mp4',
+                        help="Output video file name for '-output_mode video'. (default: orbit.mp4)")
+
+    # Video encoder backend
+    parser.add_argument(
+        "-encoder",
+        type=str,
+        default='auto',
+        choices=["auto", "ffmpeg", "opencv"],
+        help="Video encoder: ffmpeg pipe if available, else OpenCV VideoWriter. (default: auto)"
+    )
+
+    # Codec (FOURCC for OpenCV, encoder name for ffmpeg)
+    parser.add_argument("-codec", type=str,
+                        default=None,
+                        help="Codec: FOURCC for opencv (default: mp4v), encoder name for ffmpeg (default: libx264)")
+
+    # Frames per second
+    parser.add_argument("-fps", type=float,
+                        default=30,
+                        help="Video frame rate. (default: 30)")
+
+    # Quality (0-100)
+    parser.add_argument("-quality", type=int,
+                        default=90,
+                        help="Video quality 0-100, higher is better. (default: 90)")
+
+    # Orbit geometry reuse
+    parser.add_argument(
+        "--reuse_geometry",
+        action="store_true",
+        help="Integrate rays once and re-shade every frame with an azimuthal offset "
+             "(the orbit is symmetric about the z-axis)"
+    )
+
+    # Frame range
+    parser.add_argument("--start", type=int,
+                        default=0,
+                        help="First frame to render (default: 0)")
+    parser.add_argument("--end", type=int,
+                        default=None,
+                        help="Stop before this frame (default: number of frames)")
+
+    # Frame-parallel CPU rendering
+    parser.add_argument("-workers", type=int,
+                        default=0,
+                        help="Render frames in this many CPU worker processes (default: 0, render in this process)")
+    parser.add_argument("-threads_per_worker", type=int,
+                        default=None,
+                        help="cpu_max_num_threads of each worker (default: CPU count / workers)")
+
+    # Per-phase timing trace
+    parser.add_argument("--trace", type=str, nargs='?',
+                        default=None, const='trace.json', metavar='FILE',
+                        help="Time every pipeline phase, print a summary and write a Chrome/Perfetto trace (default file: trace.json)")
+
+    args = parser.parse_args()
+    tracer = Tracer(enabled=args.trace is not None)
+    if args.workers > 0 and args.reuse_geometry:
+        parser.error("--reuse_geometry already renders each frame as a cheap shading pass; do not combine it with -workers")
+
     # Camera parameters
     pov = [8, 3, 1]
     focal = 1.5
@@ -23,91 +252,91 @@ def main():
     ar1 = 2
     ar2 = 6
     num_frames = 600
-    ti.init(arch=ti.gpu)
 
     resol = np.array([3840, 2160])
 
-    print('Welcome to Math/CS714 Project')
+    params = {
+        'pov': pov, 'focal': focal, 'fov': fov, 'sky_texture': sky_texture,
+        'accretion_texture': accretion_texture, 'h': h, 'ar1': ar1, 'ar2': ar2,
+        'num_frames': num_frames, 'resolution': resol.tolist(), 'integrator': 'rk4',
+    }
 
-    # Orbit parameters
-    cam_init_pos = np.array(pov, dtype=np.float32)
-    radius = np.sqrt(cam_init_pos[0] ** 2 + cam_init_pos[1] ** 2)
-    cam_z = cam_init_pos[2]
-    look_at = np.array([0, 0, 0], dtype=np.float32)  # Assuming looking at the origin
-
-    # Set up scene and solver once.
-    scene = Scene(blackhole_r=ti.cast(1.0, ti.f32),
-                  accretion_r1=ti.cast(ar1, ti.f32),
-                  accretion_r2=ti.cast(ar2, ti.f32),
-                  accretion_temp=ti.cast(400., ti.f32),
-                  accretion_alpha=ti.cast(1, ti.f32),
-                  skymap=Skymap(sky_texture, r_max=10))
-    scene.set_accretion_disk_texture(accretion_texture)
-    my_solver = Solver(scene, h=ti.cast(h, ti.f32))
-
-    # Initialize the camera
-    my_camera = Camera(
-        pos=cam_init_pos,
-        focal_length=focal,
-        look_at=look_at,
-        img_res=resol,
-        fov=fov
-    )
+    print('Welcome to Math/CS714 Project')
 
-    # Ensure output directory exists
+    # Ensure output directory exists, or open the video stream
     output_dir = "frames"
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Determine the angle step for each frame
-    initial_angle = np.arctan2(cam_init_pos[1], cam_init_pos[0]) if radius > 0 else 0.0
-    d_angle = 2.0 * np.pi / num_frames
-
-    for frame_idx in range(num_frames):
-        angle = initial_angle + frame_idx * d_angle
-
-        # Update camera position
-        cam_x = radius * np.cos(angle)
-        cam_y = radius * np.sin(angle)
-        new_pos = np.array([cam_x, cam_y, cam_z], dtype=np.float32)
-        my_camera.pos[None] = new_pos
-
-        # Update camera vectors based on the new position
-        my_camera.update_camera()
+    frame_range = range(max(args.start, 0), min(args.end if args.end is not None else num_frames, num_frames))
+    video = None
+    manifest = None
+    if args.output_mode == 'video':
+        video = VideoWriter(args.video, resol[0], resol[1], fps=args.fps, codec=args.codec,
+                            quality=args.quality, backend=args.encoder)
+        print(f'Streaming frames to {args.video} ({video.backend}, codec {video.codec})')
+        pending = list(frame_range)
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+        # Frames already rendered with identical parameters are skipped on rerun
+        manifest = FrameManifest(output_dir, params)
+        pending = [frame_idx for frame_idx in frame_range
+                   if not manifest.is_done(frame_idx, f"{output_dir}/frame_{frame_idx:03d}.png")]
+        print(f'{len(frame_range) - len(pending)} of {len(frame_range)} frames already rendered')
 
-        print(f'Generating rays for frame {frame_idx}...')
-        my_camera.generate_rays()
-        positions, directions = my_camera.positions, my_camera.directions
-
-        # Initialize Taichi fields for colors (define once outside the loop)
-        if frame_idx == 0:
-            image_width = my_camera._image_width
-            image_height = my_camera._image_height
-            colors = ti.Vector.field(3, dtype=ti.f32, shape=(image_width, image_height))
+    if args.workers > 0:
+        num_threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+        render_parallel(params, pending, args.workers, num_threads, output_dir, manifest, video, tracer)
+    else:
+        with tracer.phase('ti.init', sync=False):
+            init_taichi()
+        my_camera, my_solver, colors = build_renderer(params, tracer)
 
-        colors.fill(0.0)
-
-        print(f'Solving ODE for frame {frame_idx}...')
-        my_solver.solve_rk4(positions, directions, colors)
+        # Every frame sees frame 0's ray geometry rotated about the z-axis, so trace it once.
+        gbuffer = None
+        if args.reuse_geometry and pending:
+            print('Tracing orbit geometry...')
+            my_camera.update_camera()
+            my_camera.generate_rays()
+            gbuffer = GBuffer(my_camera._image_width, my_camera._image_height)
+            with tracer.phase('trace_geometry'):
+                my_solver.trace_rk4(my_camera.positions, my_camera.directions, gbuffer)
 
-        print(f'Rendering frame {frame_idx}...')
-        img = my_camera.render(colors)
-        print('Image resolution: ', img.shape)
+        for frame_idx in pending:
+            with tracer.phase('frame', frame=frame_idx):
+                if gbuffer is not None:
+                    print(f'Shading frame {frame_idx}...')
+                    with tracer.phase('shade', frame=frame_idx):
+                        my_solver.shade_gbuffer(gbuffer, frame_idx * orbit_angle_step(params), colors)
+                    print(f'Rendering frame {frame_idx}...')
+                    with tracer.phase('render_scene', frame=frame_idx):
+                        my_camera.render_scene(colors)
+                    with tracer.phase('to_numpy', frame=frame_idx):
+                        img = my_camera.read_image()
+                else:
+                    img = render_frame(my_camera, my_solver, colors, params, frame_idx, tracer)
+                print('Image resolution: ', img.shape)
 
-        img_width, img_height = 3840, 2160
+                if video is not None:
+                    with tracer.phase('encode', frame=frame_idx):
+                        video.write(img)
+                    print(f'Frame {frame_idx} encoded')
+                    continue
 
-        # Plot and save the figure
-        plt.figure(figsize=(img_width / 100, img_height / 100), dpi=100)
-        plt.imshow(np.transpose(img, (1, 0, 2)))
-        plt.axis('off')
+                frame_filename = f"{output_dir}/frame_{frame_idx:03d}.png"
+                with tracer.phase('save', frame=frame_idx):
+                    save_frame(img, frame_filename)
+                manifest.mark_done(frame_idx)
+                print(f'Frame {frame_idx} saved as {frame_filename}')
 
-        frame_filename = f"{output_dir}/frame_{frame_idx:03d}.png"
-        # Save the figure with the appropriate resolution
-        plt.savefig(frame_filename, dpi=100, bbox_inches='tight', pad_inches=0)
-        plt.close()
-        print(f'Frame {frame_idx} saved as {frame_filename}')
+    if video is not None:
+        video.close()
+        print(f"All frames rendered. Video saved as {args.video}")
+    else:
+        print("All frames rendered. Use an external tool to compile images into a video.")
 
-    print("All frames rendered. Use an external tool to compile images into a video.")
+    if tracer.enabled:
+        print(tracer.summary())
+        tracer.save(args.trace)
+        print(f'Trace saved as {args.trace} (open in https://ui.perfetto.dev or chrome://tracing)')
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
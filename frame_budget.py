@@ -0,0 +1,245 @@
+# Frame-time budget mode for interactive previews: each frame is rendered at the best quality
+# level (internal resolution and step size) predicted to fit the budget, from the measured time
+# of the previous frames, and upscaled to the output resolution.
+#
+#   python frame_budget.py --cpu -budget_ms 100 -resolution fhd -frames 120
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from image_io import save_image
+from render_session import RESOLUTIONS, RenderSession, normalize_job, orbit_pov
+from runtime import DEFAULT_KERNEL_CACHE, init_taichi, warmup_kernels
+from solver import INTEGRATORS
+
+# (resolution scale, step size multiplier) from best to cheapest. Every level costs less than the
+# one before it; the cost of a level is taken as proportional to its ray count divided by h.
+QUALITY_LADDER = (
+    (1.0, 1.0),
+    (1.0, 1.5),
+    (0.75, 1.0),
+    (0.75, 1.5),
+    (0.5, 1.5),
+    (0.5, 2.0),
+    (0.375, 2.0),
+    (0.25, 2.0),
+    (0.25, 3.0),
+)
+
+
+class FrameBudget:
+    def __init__(self, budget, resolution, step_size, ladder=QUALITY_LADDER,
+                 headroom=0.9, raise_margin=0.7, smoothing=0.5):
+        """
+        Chooses the render resolution and step size of each frame so frames take about budget seconds.
+
+        After every frame the measured time is divided by the level's relative cost to estimate
+        the time of one unit of cost (smoothed over frames), which predicts every other level.
+        The controller drops to the best level predicted within headroom * budget as soon as the
+        current one is not, and only moves to a better level when that one is predicted within
+        raise_margin * budget, so it does not oscillate between two levels.
+
+        Parameters:
+        - budget: float, target frame time in seconds.
+        - resolution: (width, height), output resolution.
+        - step_size: float, step size of the best level.
+        - ladder: sequence of (resolution scale, step size multiplier), best level first.
+        - headroom: float, fraction of the budget a level may be predicted to use.
+        - raise_margin: float, fraction of the budget a better level must be predicted within.
+        - smoothing: float in (0, 1], weight of the newest measurement.
+        """
+        self.budget = budget
+        self.resolution = (int(resolution[0]), int(resolution[1]))
+        self.headroom = headroom
+        self.raise_margin = raise_margin
+        self.smoothing = smoothing
+
+        self.levels = []
+        for scale, step_scale in ladder:
+            # Even dimensions, at least 16 pixels
+            width = max(16, int(round(self.resolution[0] * scale / 2)) * 2)
+            height = max(16, int(round(self.resolution[1] * scale / 2)) * 2)
+            self.levels.append({'resolution': [width, height], 'step_size': step_size * step_scale,
+                                'cost': width * height / (self.resolution[0] * self.resolution[1] * step_scale)})
+        costs = [level['cost'] for level in self.levels]
+        if any(b >= a for a, b in zip(costs, costs[1:])):
+            raise ValueError("Every ladder level must cost less than the one before it")
+
+        # Start from the cheapest level; the first measurement tells how far up the ladder to go
+        self.level = len(self.levels) - 1
+        self.unit_seconds = None
+
+    def settings(self):
+        # Render settings of the current level
+        level = self.levels[self.level]
+        return {'resolution': list(level['resolution']), 'step_size': level['step_size']}
+
+    def predict(self, level):
+        # Predicted frame time of a level in seconds, or None before the first measurement
+        if self.unit_seconds is None:
+            return None
+        return self.unit_seconds * self.levels[level]['cost']
+
+    def update(self, seconds):
+        """
+        Records the measured time of a frame rendered at the current level and picks the next level.
+
+        Returns:
+        - level: int, index of the level for the next frame.
+        """
+        unit = seconds / self.levels[self.level]['cost']
+        if self.unit_seconds is None:
+            self.unit_seconds = unit
+        else:
+            self.unit_seconds += self.smoothing * (unit - self.unit_seconds)
+
+        fits = [self.predict(i) <= self.headroom * self.budget for i in range(len(self.levels))]
+        if not fits[self.level]:
+            # Over budget: the best level below that fits, or the cheapest
+            self.level = next((i for i in range(self.level, len(self.levels)) if fits[i]), len(self.levels) - 1)
+        else:
+            better = [i for i in range(self.level) if self.predict(i) <= self.raise_margin * self.budget]
+            if better:
+                self.level = better[0]
+        return self.level
+
+
+def upscale(img, resolution):
+    """
+    Bilinearly resizes a (width, height, 3) render to resolution = (width, height).
+    """
+    if img.shape[:2] == tuple(resolution):
+        return img
+    # OpenCV sizes are (columns, rows); the render's rows are x
+    return cv2.resize(img, (int(resolution[1]), int(resolution[0])), interpolation=cv2.INTER_LINEAR)
+
+
+def summarize(records, budget):
+    """
+    Returns a table of frames, resolution, step size and mean frame time per chosen level,
+    and the share of frames within budget.
+    """
+    lines = [f"{'level':>5s} {'resolution':>11s} {'h':>8s} {'frames':>6s} {'mean ms':>8s}"]
+    for level in sorted({r['level'] for r in records}):
+        chosen = [r for r in records if r['level'] == level]
+        resolution = 'x'.join(str(v) for v in chosen[0]['resolution'])
+        mean = 1000.0 * np.mean([r['seconds'] for r in chosen])
+        lines.append(f"{level:5d} {resolution:>11s} {chosen[0]['step_size']:8.4f} {len(chosen):6d} {mean:8.1f}")
+    seconds = np.array([r['seconds'] for r in records])
+    lines.append(f'{np.mean(seconds <= budget) * 100:.1f}% of {len(records)} frames within '
+                 f'{budget * 1000:.0f} ms (median {np.median(seconds) * 1000:.1f} ms, '
+                 f'p95 {np.percentile(seconds, 95) * 1000:.1f} ms)')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render an orbit preview within a frame-time budget.")
+
+    # Target frame time
+    parser.add_argument("-budget_ms", type=float,
+                        default=100,
+                        help="Target frame time in milliseconds, including upscaling. (default: 100)")
+
+    # Output resolution
+    parser.add_argument("-resolution", "-r", type=str,
+                        default='fhd',
+                        choices=list(RESOLUTIONS),
+                        help="Output resolution; frames are rendered at or below it and upscaled. (default: fhd)")
+
+    # Best-quality step size
+    parser.add_argument("-step_size", "-s", type=float,
+                        default=0.011,
+                        help="Step size of the best quality level; cheaper levels multiply it. (default: 0.011)")
+
+    # Integrator
+    parser.add_argument("-integrator", "-i", type=str,
+                        default='am4',
+                        choices=INTEGRATORS,
+                        help="Integrator. (default: am4)")
+
+    # Orbit
+    parser.add_argument("-pov", "-p", nargs=3, metavar=('x', 'y', 'z'), type=float,
+                        default=[6, 0, 0.5],
+                        help="Starting camera position; the camera orbits the z-axis. (default: [6, 0, 0.5])")
+    parser.add_argument("-frames", type=int,
+                        default=120,
+                        help="Number of preview frames. (default: 120)")
+    parser.add_argument("-orbit_frames", type=int,
+                        default=600,
+                        help="Frames per full orbit. (default: 600)")
+
+    # Outputs
+    parser.add_argument("-output_dir", type=str,
+                        default='',
+                        help="Write the upscaled frames here as PNG, '' to not save them. (default: '')")
+    parser.add_argument("-report", type=str,
+                        default=None,
+                        help="Write the chosen settings and time of every frame to this JSON file")
+
+    # GPU or CPU flag
+    parser.add_argument(
+        "--cpu",
+        action="store_true",
+        help="Use CPU for rendering (default: use GPU)"
+    )
+
+    # Compiled-kernel cache
+    parser.add_argument("-kernel_cache", type=str,
+                        default=DEFAULT_KERNEL_CACHE,
+                        help=f"Offline kernel cache directory, '' to disable. (default: {DEFAULT_KERNEL_CACHE})")
+
+    args = parser.parse_args()
+    budget = args.budget_ms / 1000.0
+    init_taichi(cpu=args.cpu, kernel_cache=args.kernel_cache)
+
+    base_job = normalize_job({'resolution': args.resolution, 'integrator': args.integrator,
+                              'step_size': args.step_size, 'pov': args.pov})
+    controller = FrameBudget(budget, base_job['resolution'], args.step_size)
+    session = RenderSession()
+
+    # Every level has its own resolution and step size, which are compiled into the kernels;
+    # compile them all up front so no frame is charged for compilation
+    print(f'Compiling kernels for {len(controller.levels)} quality levels...')
+    for level in controller.levels:
+        job = {**base_job, 'resolution': level['resolution'], 'step_size': level['step_size']}
+        my_solver, colors = session.solver(job)
+        warmup_kernels(session.camera(job['resolution']), my_solver, colors, integrators=(args.integrator,))
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    records = []
+    for frame_idx in range(args.frames):
+        level = controller.level
+        settings = controller.settings()
+        job = {**base_job, **settings, 'pov': orbit_pov(args.pov, frame_idx, args.orbit_frames)}
+
+        start = time.perf_counter()
+        img = upscale(session.render(job), base_job['resolution'])
+        seconds = time.perf_counter() - start
+        controller.update(seconds)
+        cheapest = len(controller.levels) - 1
+        if frame_idx == 0 and controller.predict(cheapest) > budget:
+            print(f'Warning: even the cheapest level is predicted to take '
+                  f'{controller.predict(cheapest) * 1000:.0f} ms, over the {args.budget_ms:.0f} ms budget')
+
+        records.append({'frame': frame_idx, 'level': level, **settings, 'seconds': seconds})
+        print(f"Frame {frame_idx}: {settings['resolution'][0]}x{settings['resolution'][1]} "
+              f"h={settings['step_size']:.4f} in {seconds * 1000:.1f} ms")
+        if args.output_dir:
+            save_image(img, os.path.join(args.output_dir, f'frame_{frame_idx:04d}.png'))
+
+    print(summarize(records, budget))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'budget_ms': args.budget_ms, 'output_resolution': base_job['resolution'],
+                       'integrator': args.integrator, 'frames': records}, f, indent=2)
+        print(f'Report saved as {args.report}')
+
+
+if __name__ == '__main__':
+    main()
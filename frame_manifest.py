@@ -0,0 +1,63 @@
+import json
+import os
+
+
+def atomic_save(path, save):
+    """
+    Writes a file so that it either appears complete or not at all.
+
+    Parameters:
+    - path: str, final file path.
+    - save: callable taking a temporary path in the same directory. The temporary name keeps
+      the file extension so writers that infer the format from it still work.
+    """
+    directory, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    tmp_path = os.path.join(directory, f'.{stem}.tmp{ext}')
+    try:
+        save(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class FrameManifest:
+    def __init__(self, output_dir, params, filename='manifest.json'):
+        """
+        Records the render parameters of a frame sequence and which frames are complete,
+        so an interrupted job can be resumed.
+
+        Parameters:
+        - output_dir: str, directory holding the frames and the manifest.
+        - params: dict, JSON-serialisable render parameters. Frames recorded under different
+          parameters are treated as missing.
+        """
+        self.path = os.path.join(output_dir, filename)
+        # Round-trip through JSON so comparisons see the same types as a reloaded manifest
+        self.params = json.loads(json.dumps(params))
+        self.completed = set()
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                manifest = json.load(f)
+            if manifest.get('params') == self.params:
+                self.completed = set(manifest.get('completed', []))
+            else:
+                print(f'Render parameters changed since {self.path} was written; re-rendering all frames')
+
+    def is_done(self, frame_idx, frame_path):
+        return frame_idx in self.completed and os.path.exists(frame_path)
+
+    def mark_done(self, frame_idx):
+        self.completed.add(int(frame_idx))
+        self.save()
+
+    def save(self):
+        manifest = {'params': self.params, 'completed': sorted(self.completed)}
+
+        def write(tmp_path):
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, indent=2)
+
+        atomic_save(self.path, write)
@@ -0,0 +1,40 @@
+import numpy as np
+import taichi as ti
+
+
+@ti.data_oriented
+class GBuffer:
+    def __init__(self, width, height, max_disk_hits=4):
+        """
+        Per-pixel ray geometry, independent of textures and of the camera's azimuth.
+
+        Parameters:
+        - width, height: int, image resolution.
+        - max_disk_hits: int, number of accretion disk crossings stored per ray. Crossings beyond
+          this are counted but not stored (they only matter for sub-pixel photon-ring orders).
+        """
+        self.width = int(width)
+        self.height = int(height)
+        self.max_disk_hits = int(max_disk_hits)
+
+        # Position where the ray left the scene (r > r_max); unused if it fell into the horizon
+        self.escape = ti.Vector.field(3, dtype=ti.f32, shape=(self.width, self.height))
+        # 1 if the ray crossed the event horizon
+        self.horizon = ti.field(dtype=ti.i32, shape=(self.width, self.height))
+        # Number of accretion disk crossings, and their (x, y) coordinates in the z = 0 plane
+        self.disk_count = ti.field(dtype=ti.i32, shape=(self.width, self.height))
+        self.disk_hits = ti.Vector.field(2, dtype=ti.f32, shape=(self.width, self.height, self.max_disk_hits))
+
+    def to_numpy(self):
+        return {
+            'escape': self.escape.to_numpy(),
+            'horizon': self.horizon.to_numpy(),
+            'disk_count': self.disk_count.to_numpy(),
+            'disk_hits': self.disk_hits.to_numpy(),
+        }
+
+    def from_numpy(self, arrays):
+        self.escape.from_numpy(np.ascontiguousarray(arrays['escape'], dtype=np.float32))
+        self.horizon.from_numpy(np.ascontiguousarray(arrays['horizon'], dtype=np.int32))
+        self.disk_count.from_numpy(np.ascontiguousarray(arrays['disk_count'], dtype=np.int32))
+        self.disk_hits.from_numpy(np.ascontiguousarray(arrays['disk_hits'], dtype=np.float32))
@@ -0,0 +1,98 @@
+import os
+
+# OpenEXR support in OpenCV is opt-in and must be enabled before the first EXR call
+os.environ.setdefault('OPENCV_IO_ENABLE_OPENEXR', '1')
+
+import cv2
+import numpy as np
+
+IMAGE_FORMATS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.exr', '.pfm', '.npy')
+
+
+def to_rows(img):
+    # Camera images are indexed [x, y]; files are row-major [y, x]
+    return np.ascontiguousarray(np.transpose(img, (1, 0, 2)))
+
+
+def to_uint8(img):
+    """
+    Converts a (width, height, 3) render, float in [0, 1] or already uint8, to a row-major
+    (height, width, 3) uint8 RGB array.
+    """
+    if img.dtype == np.uint8:
+        return to_rows(img)
+    return to_rows((np.clip(img, 0, 1) * 255.0 + 0.5).astype(np.uint8))
+
+
+def to_uint16(img):
+    return to_rows((np.clip(img, 0, 1) * 65535.0 + 0.5).astype(np.uint16))
+
+
+def save_image(img, path, bit_depth=8, jpeg_quality=95, png_compression=1):
+    """
+    Writes a render to disk with exact pixel dimensions, without a display.
+
+    Parameters:
+    - img: numpy.ndarray, (width, height, 3) float image in [0, 1] as returned by Camera.render.
+    - path: str, output file. The extension selects the format:
+      .png / .tif / .tiff (8 or 16 bit), .jpg / .jpeg (8 bit), .exr / .pfm (32-bit float)
+      and .npy (raw float32 array of shape (height, width, 3)).
+    - bit_depth: int, 8 or 16 for PNG and TIFF.
+    - jpeg_quality: int, 0-100.
+    - png_compression: int, 0-9. Low levels encode much faster at a modest size cost.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format '{ext}', use one of {IMAGE_FORMATS}")
+    if bit_depth not in (8, 16):
+        raise ValueError(f"bit_depth must be 8 or 16, got {bit_depth}")
+
+    if ext == '.npy':
+        np.save(path, to_rows(img.astype(np.float32)))
+        return
+
+    if ext in ('.exr', '.pfm'):
+        rgb = to_rows(img.astype(np.float32))
+        params = []
+    elif ext in ('.jpg', '.jpeg'):
+        rgb = to_uint8(img)
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)]
+    else:
+        rgb = to_uint16(img) if bit_depth == 16 else to_uint8(img)
+        params = [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)] if ext == '.png' else []
+
+    # OpenCV expects BGR channel order
+    try:
+        written = cv2.imwrite(path, np.ascontiguousarray(rgb[:, :, ::-1]), params)
+    except cv2.error as e:
+        hint = " (this OpenCV build may lack OpenEXR; use .pfm or .npy for float output)" if ext == '.exr' else ""
+        raise RuntimeError(f"OpenCV could not write {path}{hint}") from e
+    if not written:
+        raise RuntimeError(f"OpenCV could not write {path}")
+
+
+def encode_image(img, ext='.png', jpeg_quality=95, png_compression=1):
+    """
+    Encodes a (width, height, 3) render in [0, 1] as 8-bit PNG or JPEG bytes in memory.
+    """
+    ext = ext.lower()
+    if ext in ('.jpg', '.jpeg'):
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)]
+    elif ext == '.png':
+        params = [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+    else:
+        raise ValueError(f"Unsupported encoding '{ext}', use .png or .jpg")
+    ok, data = cv2.imencode(ext, np.ascontiguousarray(to_uint8(img)[:, :, ::-1]), params)
+    if not ok:
+        raise RuntimeError(f"OpenCV could not encode {ext}")
+    return data.tobytes()
+
+
+def show_image(img, title='Black hole'):
+    # Preview window, only imported and opened when asked for
+    import matplotlib.pyplot as plt
+
+    plt.figure(title)
+    plt.imshow(to_rows(img))
+    plt.axis('off')
+    plt.show()
@@ -6,18 +6,31 @@
 #   - Suenggwan Jo: sjo32@wisc.edu
 #   - Hyeong Kyu Choi: hyeongkyu.choi@wisc.edu
 import argparse
+import time
 import numpy as np
-import matplotlib.pyplot as plt
 
 from camera import Camera
-from solver import Solver
-from skymap import Skymap
+from solver import Solver, INTEGRATORS
+from skymap import Skymap, PROJECTIONS, FILTERS
+from cubemap import DEFAULT_CUBEMAP_CACHE
 from scene import Scene
+from runtime import DEFAULT_KERNEL_CACHE, init_taichi, warmup_kernels
+from image_io import IMAGE_FORMATS, save_image, show_image
+from tracing import Tracer
+from gbuffer import GBuffer
+from sparse_geometry import SparseTracer
+from traversal import ORDERS, Traversal, estimate_costs
+from postprocess import PostProcess, STAGES, parse_stages
+from trajectory import TrajectoryRecorder
+from startup import TextureLoader, decode_texture, load_sky, texture_shape
+from render_cache import DEFAULT_CACHE_SIZE_GB, DEFAULT_RENDER_CACHE, RenderCache, render_key
 
 import taichi as ti
 
 
 def main():
+    start_time = time.perf_counter()
+
     # Create an argument parser
     parser = argparse.ArgumentParser(description="Parse rendering parameters.")
 
@@ -51,6 +64,12 @@ def main():
         help="Resolution: '4k' or 'fhd' (default: 4k)"
     )
 
+    # Region of interest
+    parser.add_argument("-window", type=int, nargs=4,
+                        default=None, metavar=('x0', 'y0', 'w', 'h'),
+                        help="Render only this pixel region of the -resolution frame, with the same rays as the full "
+                             "render; the output is w x h (default: the whole frame)")
+
     # Texture file path (string)
     parser.add_argument("-texture", "-t", type=str,
                         default='texture/high_res/space_texture_high1.jpg',
@@ -61,13 +80,26 @@ def main():
                         default='texture/ad/adisk.jpg',
                         help="Accretion disk texture file path (string)")
 
+    # Skymap layout and filtering
+    parser.add_argument("-sky_projection", type=str,
+                        default='equirect',
+                        choices=PROJECTIONS,
+                        help="'cube' converts the sky texture to a cube map at load time, avoiding per-ray acos/atan2. (default: equirect)")
+    parser.add_argument("-sky_filter", type=str,
+                        default='nearest',
+                        choices=FILTERS,
+                        help="Cube map filtering. (default: nearest)")
+    parser.add_argument("-cubemap_cache", type=str,
+                        default=DEFAULT_CUBEMAP_CACHE,
+                        help=f"Directory of converted cube maps, '' to disable. (default: {DEFAULT_CUBEMAP_CACHE})")
+
     # Integrator (string: 'euler' or 'rk4')
     parser.add_argument(
         "-integrator", "-i",
         type=str,
-        default='am4',
-        choices=["euler", "rk4", "leapfrog", "ab2", "am4"],
-        help="Integrators: 'euler', 'rk4', 'leapfrog'. (default: am4)"
+        default=None,
+        choices=INTEGRATORS,
+        help="Integrators: 'euler', 'rk4', 'leapfrog'. (default: am4, or rk4 with --sparse)"
     )
 
     # GPU or CPU flag (use '--gpu' for GPU, default is CPU)
@@ -80,7 +112,20 @@ def main():
     # Texture file path (string)
     parser.add_argument("-output", "-o", type=str,
                         default='result.png',
-                        help="Output file name. (default: result.png)")
+                        help=f"Output file name; the extension selects the format {IMAGE_FORMATS}. (default: result.png)")
+
+    # Bits per channel for PNG/TIFF output
+    parser.add_argument("-bit_depth", type=int,
+                        default=8,
+                        choices=[8, 16],
+                        help="Bits per channel for PNG and TIFF output. (default: 8)")
+
+    # Preview window
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="Show the rendered image in a window after saving"
+    )
 
     # time step size
     parser.add_argument("-step_size", "-s", type=float,
@@ -96,72 +141,302 @@ def main():
                         default=3.5,
                         help="outer radius of accretion disk (default: 6)")
 
+    # Compiled-kernel cache
+    parser.add_argument("-kernel_cache", type=str,
+                        default=DEFAULT_KERNEL_CACHE,
+                        help=f"Offline kernel cache directory, '' to disable. (default: {DEFAULT_KERNEL_CACHE})")
+
+    # Overlapped startup
+    parser.add_argument(
+        "--overlap_startup",
+        action="store_true",
+        help="Decode textures on background threads while Taichi initializes, rays are generated and kernels "
+             "compile, and report the time saved"
+    )
+
+    # Precompile and exit
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="Compile every integrator for this arch and configuration into the kernel cache, then exit"
+    )
+
+    # Sparse geometry sampling
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Integrate rays (with rk4) on a coarse grid refined only near edges and interpolate the rest"
+    )
+    parser.add_argument("-sparse_cell", type=int,
+                        default=8,
+                        help="Initial cell size in pixels for --sparse. (default: 8)")
+    parser.add_argument("-sparse_tolerance", type=float,
+                        default=0.001,
+                        help="Largest escape direction error in radians interpolated by --sparse. (default: 0.001)")
+
+    # Ray traversal order
+    parser.add_argument("-traversal", type=str,
+                        default='native',
+                        choices=['native'] + list(ORDERS),
+                        help="Order rays are generated, solved and shaded in: the field's native order, image rows, "
+                             "Morton/Hilbert curves over tiles, or tiles balanced over the CPU threads by estimated "
+                             "cost, most expensive first. (default: native)")
+    parser.add_argument("-traversal_tile", type=int,
+                        default=8,
+                        help="Tile edge in pixels for -traversal morton/hilbert/cost. (default: 8)")
+
+    # On-device post-processing
+    parser.add_argument("-supersample", type=int,
+                        default=1,
+                        help="Trace this many rays per pixel along each axis and box-filter them on the device. (default: 1)")
+    parser.add_argument("-post", type=str, nargs='+',
+                        default=None, metavar='STAGE',
+                        help=f"Post-processing stages run on the device in order, as name or name:param,...; "
+                             f"one of {list(STAGES)} (e.g. exposure:1.4 bloom:0.8,0.5,4 tonemap:aces gamma:2.2)")
+
+    # Ray path recording for selected pixels
+    parser.add_argument("-trajectory", type=int, nargs='+',
+                        default=None, metavar='I J',
+                        help="Record the paths of these pixels' rays (pairs of column and row in the traced image, "
+                             "i.e. relative to -window and times -supersample) and save them as -trajectory_output")
+    parser.add_argument("-trajectory_every", type=int,
+                        default=1,
+                        help="Record one position every this many integration steps. (default: 1)")
+    parser.add_argument("-trajectory_capacity", type=int,
+                        default=4096,
+                        help="Positions kept per ray; longer paths keep their most recent points. (default: 4096)")
+    parser.add_argument("-trajectory_output", type=str,
+                        default='trajectories.npy',
+                        help="File the recorded paths are saved to, as a structured .npy array. (default: trajectories.npy)")
+
+    # Render result cache
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse the stored image of an identical earlier render (same settings, texture contents and code) "
+             "and store new renders"
+    )
+    parser.add_argument("-cache_dir", type=str,
+                        default=DEFAULT_RENDER_CACHE,
+                        help=f"Render cache directory for --cache. (default: {DEFAULT_RENDER_CACHE})")
+    parser.add_argument("-cache_size_gb", type=float,
+                        default=DEFAULT_CACHE_SIZE_GB,
+                        help=f"Render cache size limit; least recently used images are evicted. (default: {DEFAULT_CACHE_SIZE_GB:g})")
+
+    # Per-phase timing trace
+    parser.add_argument("--trace", type=str, nargs='?',
+                        default=None, const='trace.json', metavar='FILE',
+                        help="Time every pipeline phase, print a summary and write a Chrome/Perfetto trace (default file: trace.json)")
+
     args = parser.parse_args()
-    if args.cpu:
-        ti.init(arch=ti.cpu)  # Use CPU for acceleration.
-    else:
-        ti.init(arch=ti.gpu)  # Use GPU for acceleration.
+    if args.sparse:
+        if args.traversal != 'native':
+            parser.error("--sparse picks its own ray batches; do not combine it with -traversal")
+        # SparseTracer always integrates with RK4, so the cache key and the trace must say so
+        if args.integrator not in (None, 'rk4'):
+            parser.error(f"--sparse integrates with rk4; do not combine it with -integrator {args.integrator}")
+        args.integrator = 'rk4'
+    elif args.integrator is None:
+        args.integrator = 'am4'
+    if args.trajectory is not None:
+        if len(args.trajectory) % 2:
+            parser.error("-trajectory takes pairs of pixel coordinates I J")
+        if args.sparse or args.traversal != 'native':
+            parser.error("-trajectory records rays by pixel; do not combine it with --sparse or -traversal")
+        if args.cache:
+            parser.error("-trajectory needs the rays integrated; do not combine it with --cache")
+    frame_width, frame_height = (3840, 2160) if args.resolution == '4k' else (1920, 1080)
+    if args.window is not None:
+        x0, y0, w, h = args.window
+        if x0 < 0 or y0 < 0 or w < 1 or h < 1 or x0 + w > frame_width or y0 + h > frame_height:
+            parser.error(f"-window {x0} {y0} {w} {h} does not fit in the {frame_width}x{frame_height} frame")
+    post_stages = None
+    if args.post is not None or args.supersample > 1:
+        try:
+            post_stages = parse_stages(args.post or [])
+        except ValueError as e:
+            parser.error(str(e))
+        if args.supersample < 1:
+            parser.error("-supersample must be at least 1")
+        if args.bit_depth != 8 or not args.output.lower().endswith(('.png', '.jpg', '.jpeg', '.tif', '.tiff')):
+            parser.error("-post and -supersample produce 8-bit images; use a .png, .jpg or .tif output with -bit_depth 8")
+    tracer = Tracer(enabled=args.trace is not None)
 
-    if args.resolution == '4k':
-        resol = np.array([3840, 2160])
-    else:
-        resol = np.array([1920, 1080])
+    cache_key = None
+    if args.cache:
+        # Every setting that changes pixels; the traversal order does not
+        settings = {name: getattr(args, name) for name in (
+            'pov', 'focal', 'fov', 'resolution', 'sky_projection', 'sky_filter', 'integrator', 'step_size',
+            'ar1', 'ar2', 'window', 'sparse', 'sparse_cell', 'sparse_tolerance', 'supersample', 'post', 'cpu')}
+        render_cache = RenderCache(args.cache_dir, args.cache_size_gb)
+        with tracer.phase('cache_lookup', sync=False):
+            # main.py wraps the fov, scales the window and wires post-processing itself
+            cache_key = render_key(settings, {'texture': args.texture, 'at': args.at}, sources=(__file__,))
+            entry = render_cache.get(cache_key)
+        if entry is not None:
+            img = entry['image']
+            print(f'Render cache hit {cache_key[:12]}')
+            with tracer.phase('save', sync=False, path=args.output):
+                save_image(img, args.output, bit_depth=args.bit_depth)
+            print(f'Saved {args.output} in {time.perf_counter() - start_time:.3f} s')
+            if tracer.enabled:
+                print(tracer.summary())
+                tracer.save(args.trace)
+            if args.preview:
+                show_image(img)
+            return
+
+    loader = None
+    if args.overlap_startup and not args.warmup:
+        # Textures decode while the main thread initializes Taichi and compiles; joined before the solve
+        overlap_start = time.perf_counter()
+        cubemap_cache = args.cubemap_cache or None
+        loader = TextureLoader({
+            'sky': lambda: load_sky(args.texture, args.sky_projection, cache_dir=cubemap_cache),
+            'disk': lambda: decode_texture(args.at),
+        })
+
+    with tracer.phase('ti.init', sync=False):
+        init_taichi(cpu=args.cpu, kernel_cache=args.kernel_cache)  # Use CPU or GPU for acceleration.
+
+    resol = np.array([frame_width, frame_height])
+    window = np.array(args.window if args.window is not None else [0, 0, resol[0], resol[1]])
+    output_resol = window[2:]
+    if post_stages is not None:
+        # Rays are traced at the supersampled resolution and filtered down on the device
+        resol = resol * args.supersample
+        window = window * args.supersample
 
     print('Welcome to Math/CS714 Project')
 
     # Ensure that position and look_at are float32
     my_camera = Camera(np.array(args.pov, dtype=np.float32), np.float32(args.focal),
-                       np.array([0, 0, 0], dtype=np.float32), resol, fov=np.float32(args.fov % 180))
-    print('Generating rays...')
-    positions, directions = my_camera.get_all_rays()
+                       np.array([0, 0, 0], dtype=np.float32), resol, fov=np.float32(args.fov % 180),
+                       window=window)
 
     # Initialize the Scene
-    scene = Scene(blackhole_r=ti.cast(1.0, ti.f32), accretion_r1=ti.cast(args.ar1, ti.f32),
-                  accretion_r2=ti.cast(args.ar2, ti.f32), accretion_temp=ti.cast(400., ti.f32),
-                  accretion_alpha=ti.cast(1, ti.f32),
-                  skymap=Skymap(args.texture, r_max=10))
-    scene.set_accretion_disk_texture(args.at)
-    my_solver = Solver(scene, h=ti.cast(args.step_size, ti.f32))
+    with tracer.phase('texture_load', deferred=loader is not None):
+        # With --overlap_startup only the texture fields are allocated here, from the image headers
+        scene = Scene(blackhole_r=1.0, accretion_r1=float(args.ar1),
+                      accretion_r2=float(args.ar2), accretion_temp=400.0,
+                      accretion_alpha=1.0,
+                      skymap=Skymap(args.texture, r_max=10, projection=args.sky_projection,
+                                    filtering=args.sky_filter, cache_dir=args.cubemap_cache or None,
+                                    deferred=loader is not None))
+        disk_field = None
+        if loader is not None:
+            disk_field = ti.Vector.field(3, dtype=ti.f32, shape=texture_shape(args.at))
+        scene.set_accretion_disk_texture(args.at, texture_field=disk_field)
 
     # Initialize Taichi fields
-    image_width = my_camera._image_width
-    image_height = my_camera._image_height
+    # Traced rays: the -window region of the frame (times -supersample), or the whole frame
+    image_width = my_camera._window_width
+    image_height = my_camera._window_height
+
+    trajectory = None
+    if args.trajectory is not None:
+        trajectory = TrajectoryRecorder(image_width, image_height, np.reshape(args.trajectory, (-1, 2)),
+                                        every=args.trajectory_every, capacity=args.trajectory_capacity)
+    my_solver = Solver(scene, h=float(args.step_size), trajectory=trajectory)
 
     colors = ti.Vector.field(3, dtype=ti.f32, shape=(image_width, image_height))
+
+    if args.warmup:
+        print('Compiling kernels...')
+        for kernel, seconds in warmup_kernels(my_camera, my_solver, colors).items():
+            print(f'  {kernel}: {seconds:.2f} s')
+        print(f'Kernel cache ready in {time.perf_counter() - start_time:.2f} s')
+        return
+
+    if (tracer.enabled or loader is not None) and not args.sparse and args.traversal == 'native':
+        # Compile in its own phase so the phases below measure execution only. With
+        # --overlap_startup this also runs while the textures are still decoding.
+        with tracer.phase('compile'):
+            warmup_kernels(my_camera, my_solver, colors, integrators=(args.integrator,))
+
+    print('Generating rays...')
+    with tracer.phase('generate_rays', traversal=args.traversal):
+        if args.traversal == 'native':
+            positions, directions = my_camera.get_all_rays()
+        else:
+            costs = None
+            if args.traversal == 'cost':
+                # Estimate every ray's cost from its impact parameter before ordering them
+                positions, directions = my_camera.get_all_rays()
+                costs = estimate_costs(positions.to_numpy(), directions.to_numpy(), scene.skymap.r_max)
+            threads = ti.cfg.cpu_max_num_threads if args.cpu else 1
+            traversal = Traversal(image_width, image_height, args.traversal, args.traversal_tile,
+                                  costs=costs, threads=threads)
+            traversal.generate_rays(my_camera)
+
+    if loader is not None:
+        main_seconds = time.perf_counter() - overlap_start
+        with tracer.phase('texture_wait'):
+            sky, disk = loader.result('sky'), loader.result('disk')
+        with tracer.phase('texture_upload'):
+            scene.skymap.upload(sky)
+            disk_field.from_numpy(disk)
+        loader.close()
+        print(loader.report(main_seconds))
+
     colors.fill(0.0)
+    if trajectory is not None:
+        # Drop anything recorded while compiling
+        trajectory.reset()
 
-    print('Solving ODE...')
-    if args.integrator == "euler":
-        my_solver.solve_forward_euler(positions, directions, colors)
-    elif args.integrator == 'rk4':
-        my_solver.solve_rk4(positions, directions, colors)
-    elif args.integrator == 'leapfrog':
-        my_solver.solve_leapfrog(positions, directions, colors)
-    elif args.integrator == 'ab2':
-        my_solver.solve_ab2(positions, directions, colors)
-    elif args.integrator == 'am4':
-        my_solver.solve_am4(positions, directions, colors)
+    if args.sparse:
+        print('Solving ODE on a sparse grid...')
+        with tracer.phase('solve', integrator='rk4', sparse=True):
+            gbuffer = GBuffer(image_width, image_height)
+            sparse_tracer = SparseTracer(my_solver, max_cell=args.sparse_cell,
+                                         direction_tolerance=args.sparse_tolerance)
+            stats = sparse_tracer.trace(positions, directions, gbuffer)
+            my_solver.shade_gbuffer(gbuffer, 0.0, colors)
+            ti.sync()
+        print(f"Integrated {stats['traced_rays']} rays ({stats['traced_fraction'] * 100:.1f}% of pixels)")
+    else:
+        print('Solving ODE...')
+        with tracer.phase('solve', integrator=args.integrator, traversal=args.traversal):
+            if args.traversal == 'native':
+                my_solver.solve(args.integrator, positions, directions, colors)
+            else:
+                traversal.solve(my_solver, args.integrator, colors)
+            ti.sync()
+    print(f'Time to first pixel: {time.perf_counter() - start_time:.2f} s')
+    if trajectory is not None:
+        trajectory.save(args.trajectory_output)
+        print(f'Saved {len(trajectory.pixels)} ray paths to {args.trajectory_output}')
 
     # Rendering the image from the rays
     print('Rendering...')
-    img = my_camera.render(colors)
+    if post_stages is not None:
+        # Only the final 8-bit image leaves the device
+        with tracer.phase('postprocess', stages=[name for name, _ in post_stages]):
+            post = PostProcess(output_resol[0], output_resol[1], post_stages, supersample=args.supersample)
+            img = post.run(colors)
+    else:
+        with tracer.phase('render_scene'):
+            my_camera.render_scene(colors)
+        with tracer.phase('to_numpy'):
+            img = my_camera.read_image()
     print('Image resolution: ', img.shape)
-    if args.resolution == '4k':
-        img_width, img_height = 3840, 2160  # 4K resolution
-    else:  # 'fhd'
-        img_width, img_height = 1920, 1080  # Full HD resolution
-
-    # Plot and save the figure
-    plt.figure(figsize=(img_width / 100, img_height / 100), dpi=100)
-    plt.imshow(np.transpose(img, (1, 0, 2)))
-    plt.axis('off')
+    if cache_key is not None:
+        with tracer.phase('cache_store', sync=False):
+            render_cache.put(cache_key, img)
 
-    # Save the figure with the appropriate resolution
-    plt.savefig(args.output, dpi=100, bbox_inches='tight', pad_inches=0)
-    plt.show()
-    plt.close()
+    # Write the render buffer straight to disk with exact pixel dimensions
+    save_start = time.perf_counter()
+    with tracer.phase('save', path=args.output):
+        save_image(img, args.output, bit_depth=args.bit_depth)
+    print(f'Saved {args.output} in {time.perf_counter() - save_start:.3f} s')
 
+    if tracer.enabled:
+        print(tracer.summary())
+        tracer.save(args.trace)
+        print(f'Trace saved as {args.trace} (open in https://ui.perfetto.dev or chrome://tracing)')
 
+    if args.preview:
+        show_image(img)
 
 
 if __name__ == '__main__':
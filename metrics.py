@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+
+
+def psnr(img, reference):
+    """
+    Peak signal-to-noise ratio in dB of two images in [0, 1]. Identical images give inf.
+    """
+    mse = np.mean((img.astype(np.float64) - reference.astype(np.float64)) ** 2)
+    if mse == 0:
+        return float('inf')
+    return float(10.0 * np.log10(1.0 / mse))
+
+
+def ssim(img, reference):
+    """
+    Structural similarity (Wang et al. 2004, 11x11 Gaussian window, sigma 1.5) of two images
+    in [0, 1], averaged over pixels and channels.
+    """
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+    x = img.astype(np.float64)
+    y = reference.astype(np.float64)
+
+    def blur(a):
+        return cv2.GaussianBlur(a, (11, 11), 1.5)
+
+    mu_x, mu_y = blur(x), blur(y)
+    sigma_x = blur(x * x) - mu_x ** 2
+    sigma_y = blur(y * y) - mu_y ** 2
+    sigma_xy = blur(x * y) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (sigma_x + sigma_y + c2))
+    return float(ssim_map.mean())
+
+
+def shadow_edge_radii(horizon, center, num_bins=180):
+    """
+    Outer radius (in pixels) of the black hole shadow in each angular bin around center.
+
+    Parameters:
+    - horizon: numpy.ndarray, (width, height) mask of rays that fell into the horizon.
+    - center: (x, y) pixel coordinates of the shadow center.
+
+    Returns:
+    - radii: numpy.ndarray, (num_bins,) radius per bin, NaN where the bin has no shadow pixels.
+    """
+    xs, ys = np.nonzero(horizon)
+    radii = np.full(num_bins, np.nan)
+    if xs.size == 0:
+        return radii
+    dx, dy = xs - center[0], ys - center[1]
+    r = np.hypot(dx, dy)
+    bins = ((np.arctan2(dy, dx) + np.pi) / (2 * np.pi) * num_bins).astype(np.int64) % num_bins
+    edge = np.zeros(num_bins)
+    np.maximum.at(edge, bins, r)
+    present = np.bincount(bins, minlength=num_bins) > 0
+    radii[present] = edge[present]
+    return radii
+
+
+def photon_ring_error(horizon, reference_horizon, num_bins=180):
+    """
+    Mean absolute displacement, in pixels, of the shadow boundary (the inner edge of the photon
+    ring) against a reference, measured along rays from the reference shadow's centroid.
+    Returns inf if either image has no shadow.
+    """
+    xs, ys = np.nonzero(reference_horizon)
+    if xs.size == 0:
+        return float('inf')
+    center = (xs.mean(), ys.mean())
+    ref = shadow_edge_radii(reference_horizon, center, num_bins)
+    cand = shadow_edge_radii(horizon, center, num_bins)
+    both = ~np.isnan(ref) & ~np.isnan(cand)
+    if not both.any():
+        return float('inf')
+    # Bins where only one of the two has shadow count as missing the whole radius
+    only_one = np.isnan(ref) != np.isnan(cand)
+    errors = np.abs(ref[both] - cand[both])
+    missing = np.fmax(ref, cand)[only_one]
+    return float(np.concatenate([errors, missing]).mean())
+
+
+def pareto_front(points, cost_key, quality_key, higher_is_better=True):
+    """
+    Points not dominated by a cheaper-or-equal point of better-or-equal quality, cheapest first.
+
+    Parameters:
+    - points: list of dicts.
+    - cost_key, quality_key: str, keys of the cost (lower is better) and quality values.
+    """
+    sign = 1.0 if higher_is_better else -1.0
+    front = []
+    best = -np.inf
+    for point in sorted(points, key=lambda p: (p[cost_key], -sign * p[quality_key])):
+        quality = sign * point[quality_key]
+        if quality > best:
+            front.append(point)
+            best = quality
+    return front
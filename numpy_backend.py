@@ -0,0 +1,379 @@
+# Pure-NumPy implementation of the camera, skymap/disk sampling and Solver integrators.
+#
+# Needs no Taichi, so it runs where kernels cannot be JIT-compiled, and as an independent
+# implementation it serves as a correctness oracle for the Taichi kernels at low resolution.
+# Rays are (N, 3) float32 arrays; every step advances only the active rays and finished rays
+# are compacted away periodically so they stop costing work.
+#
+#   python numpy_backend.py -resolution 320x180 -integrator rk4 -o numpy_rk4.png
+#   python numpy_backend.py -resolution 160x90 -integrator am4 --compare
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+from image_io import IMAGE_FORMATS, save_image
+
+INTEGRATORS = ("euler", "rk4", "leapfrog", "ab2", "am4")
+
+
+def load_texture(image_path):
+    """
+    Loads an image as a float32 (height, width, 3) RGB array in [0, 1], like Skymap.load_texture.
+    """
+    image = Image.open(image_path).convert('RGB')
+    texture = np.array(image).astype(np.float32) / 255.0
+    print(f"Loaded texture with shape: {texture.shape}")
+    return texture
+
+
+def normalize(v):
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+def generate_rays(pos, focal_length, look_at, img_res, fov, up=(0, 0, 1)):
+    """
+    Pinhole rays, identical to Camera.generate_rays.
+
+    Returns:
+    - positions, directions: numpy.ndarray, (width * height, 3) float32, pixel (i, j) at row
+      i * height + j so that reshaping to (width, height, 3) gives the Camera image layout.
+    """
+    width, height = int(img_res[0]), int(img_res[1])
+    pos = np.asarray(pos, dtype=np.float32)
+    forward = normalize(np.asarray(look_at, dtype=np.float32) - pos)
+    right = normalize(np.cross(forward, np.asarray(up, dtype=np.float32)))
+    up = normalize(np.cross(right, forward))
+
+    fov_radians = (np.float32(fov) / 2.0) * (np.pi / 180.0)
+    image_plane_height = 2.0 * focal_length * np.tan(fov_radians)
+    image_plane_width = image_plane_height * (width / height)
+    pixel_width = image_plane_width / width
+    pixel_height = image_plane_height / height
+    top_left = pos + forward * focal_length - (image_plane_width / 2.0) * right + (image_plane_height / 2.0) * up
+
+    i, j = np.meshgrid(np.arange(width), np.arange(height), indexing='ij')
+    pixel_pos = (top_left
+                 + ((i.reshape(-1, 1) + 0.5) * pixel_width) * right
+                 - ((j.reshape(-1, 1) + 0.5) * pixel_height) * up)
+    directions = normalize(pixel_pos - pos).astype(np.float32)
+    positions = np.broadcast_to(pos, directions.shape).astype(np.float32)
+    return positions, directions
+
+
+def sample_sky(texture, D):
+    """
+    Equirectangular skymap lookup for (N, 3) directions, as Skymap.get_color_from_ray_ti.
+    """
+    img_height, img_width, _ = texture.shape
+    D = normalize(D)
+    theta = np.arccos(np.clip(D[:, 2], -1.0, 1.0))
+    phi = np.arctan2(D[:, 1], D[:, 0])
+    phi = np.where(phi < 0, phi + 2 * np.pi, phi)
+    tex_u = np.clip((phi / (2 * np.pi) * (img_width - 1)).astype(np.int32), 0, img_width - 1)
+    tex_v = np.clip((theta / np.pi * (img_height - 1)).astype(np.int32), 0, img_height - 1)
+    return texture[tex_v, tex_u]
+
+
+def sample_disk(texture, x, y, r1, r2):
+    """
+    Accretion disk lookup at (N,) disk-plane hit coordinates, as Scene.get_accretion_disk_color_ti.
+    Black outside r1 < r < r2; white everywhere when there is no texture.
+    """
+    if texture is None:
+        return np.ones((x.shape[0], 3), dtype=np.float32)
+    img_height, img_width, _ = texture.shape
+    r = np.sqrt(x ** 2 + y ** 2)
+    phi = np.arctan2(y, x)
+    phi = np.where(phi < 0, phi + 2 * np.pi, phi)
+    tex_u = np.clip((phi / (2 * np.pi) * (img_width - 1)).astype(np.int32), 0, img_width - 1)
+    tex_v = np.clip(((r - r1) / (r2 - r1) * (img_height - 1)).astype(np.int32), 0, img_height - 1)
+    inside = (r1 < r) & (r < r2)
+    return np.where(inside[:, None], texture[tex_v, tex_u], np.float32(0.0))
+
+
+class NumpyScene:
+    def __init__(self, blackhole_r, accretion_r1, accretion_r2, accretion_alpha, sky_texture, r_max,
+                 disk_texture=None):
+        """
+        Scene parameters and textures, mirroring Scene and Skymap.
+
+        Parameters:
+        - sky_texture, disk_texture: numpy.ndarray, (height, width, 3) float32 textures as
+          returned by load_texture; disk_texture None draws a white disk.
+        """
+        self.blackhole_r = blackhole_r
+        self.accretion_r1 = accretion_r1
+        self.accretion_r2 = accretion_r2
+        self.accretion_alpha = accretion_alpha
+        self.sky_texture = sky_texture
+        self.r_max = r_max
+        self.disk_texture = disk_texture
+
+
+def force(pos, L_square):
+    # Same right-hand side as Solver.rk4_f, for (N, 3) positions and (N,) L^2
+    r = np.linalg.norm(pos, axis=1, keepdims=True)
+    return -(L_square[:, None] * pos * 1.5) / r ** 5
+
+
+class NumpySolver:
+    def __init__(self, scene, h, compact_every=16, max_steps=1_000_000):
+        """
+        Vectorized counterpart of Solver.
+
+        Parameters:
+        - scene: NumpyScene.
+        - h: float, step size.
+        - compact_every: int, drop finished rays from the working arrays every this many steps.
+        - max_steps: int, rays still running after this many steps (e.g. NaN states, which
+          never terminate in the Taichi kernels) are stopped and shaded as escaped.
+        """
+        self.scene = scene
+        self.h = np.float32(h)
+        self.compact_every = compact_every
+        self.max_steps = max_steps
+        self.step_counts = None
+        self.horizon_hits = None
+
+    def solve(self, integrator, positions, directions):
+        """
+        Integrates every ray and shades it.
+
+        Parameters:
+        - integrator: str, one of INTEGRATORS.
+        - positions, directions: numpy.ndarray, (N, 3) ray origins and directions.
+
+        Returns:
+        - colors: numpy.ndarray, (N, 3) float32 in [0, 1]. Per-ray step counts and horizon hits
+          are left in self.step_counts and self.horizon_hits.
+        """
+        if integrator not in INTEGRATORS:
+            raise ValueError(f"Unknown integrator: {integrator}")
+        scene, h = self.scene, self.h
+        num_rays = positions.shape[0]
+        pos = positions.astype(np.float32)
+        dir_ = directions.astype(np.float32)
+        if integrator == 'euler':
+            dir_ = normalize(dir_)
+        L_square = np.sum(np.cross(dir_, pos) ** 2, axis=1)
+
+        # Integrator history, one row per ray so it is compacted together with pos/dir_
+        state = {}
+        if integrator == 'leapfrog':
+            dir_ = dir_ + 0.5 * h * force(pos, L_square)
+        elif integrator == 'ab2':
+            state['f_pos_prev'] = dir_
+            state['f_dir_prev'] = force(pos, L_square)
+        elif integrator == 'am4':
+            pos, dir_, state = self._am4_start(pos, dir_, L_square)
+
+        colors = np.zeros((num_rays, 3), dtype=np.float32)
+        disk = np.zeros((num_rays, 3), dtype=np.float32)
+        exit_pos = np.zeros((num_rays, 3), dtype=np.float32)
+        steps = np.zeros(num_rays, dtype=np.int32)
+        horizon = np.zeros(num_rays, dtype=bool)
+
+        index = np.arange(num_rays)
+        active = np.ones(num_rays, dtype=bool)
+        step = 0
+        while index.size:
+            step += 1
+            steps[index[active]] += 1
+            new_pos, new_dir, r, stop_pos, state_new = self._step(integrator, pos, dir_, L_square, state)
+
+            # Disk plane crossing between pos and new_pos
+            crossing = active & (pos[:, 2] * new_pos[:, 2] < 0)
+            if crossing.any():
+                t = -pos[crossing, 2] / (new_pos[crossing, 2] - pos[crossing, 2])
+                hit = pos[crossing, :2] + t[:, None] * (new_pos[crossing, :2] - pos[crossing, :2])
+                radius = np.linalg.norm(hit, axis=1)
+                on_disk = (scene.accretion_r2 >= radius) & (radius >= scene.accretion_r1)
+                rows = np.nonzero(crossing)[0][on_disk]
+                disk[index[rows]] += sample_disk(scene.disk_texture, hit[on_disk, 0], hit[on_disk, 1],
+                                                 scene.accretion_r1, scene.accretion_r2)
+
+            fell_in = active & (r < scene.blackhole_r)
+            escaped = active & ~fell_in & ((r > scene.r_max) | (step >= self.max_steps))
+            done = fell_in | escaped
+            horizon[index[fell_in]] = True
+            exit_pos[index[done]] = stop_pos[done]
+
+            pos, dir_, state = new_pos, new_dir, state_new
+            active &= ~done
+            if step % self.compact_every == 0 or not active.any():
+                index, pos, dir_, L_square = index[active], pos[active], dir_[active], L_square[active]
+                state = {key: value[active] for key, value in state.items()}
+                active = np.ones(index.size, dtype=bool)
+
+        alpha = np.float32(scene.accretion_alpha)
+        escaped = ~horizon
+        colors[horizon] = alpha * disk[horizon]
+        colors[escaped] = sample_sky(scene.sky_texture, exit_pos[escaped]) + alpha * disk[escaped]
+        self.step_counts = steps
+        self.horizon_hits = horizon.astype(np.int32)
+        return np.clip(colors, 0.0, 1.0)
+
+    def _step(self, integrator, pos, dir_, L_square, state):
+        """
+        One step of the named integrator, reproducing the Taichi kernel's update and the point
+        at which it tests termination.
+
+        Returns:
+        - new_pos, new_dir: the advanced state.
+        - r: radius compared against the horizon and r_max.
+        - stop_pos: position used for the sky lookup if the ray stops at this step.
+        - state: updated integrator history.
+        """
+        h = self.h
+        if integrator in ('euler', 'leapfrog'):
+            new_pos = pos + h * dir_
+            r = np.linalg.norm(new_pos, axis=1)
+            constant = -(L_square * 1.5) / r ** 5
+            new_dir = dir_ + h * constant[:, None] * pos
+            return new_pos, new_dir, r, new_pos, state
+
+        if integrator == 'rk4':
+            k1_pos = h * dir_
+            k1_dir = h * force(pos, L_square)
+            k2_pos = h * (dir_ + 0.5 * k1_dir)
+            k2_dir = h * force(pos + 0.5 * k1_pos, L_square)
+            k3_pos = h * (dir_ + 0.5 * k2_dir)
+            k3_dir = h * force(pos + 0.5 * k2_pos, L_square)
+            k4_pos = h * (dir_ + k3_dir)
+            k4_dir = h * force(pos + k3_pos, L_square)
+            new_pos = pos + (k1_pos + 2 * k2_pos + 2 * k3_pos + k4_pos) / 6
+            new_dir = dir_ + (k1_dir + 2 * k2_dir + 2 * k3_dir + k4_dir) / 6
+            # RK4 tests the radius before advancing, so a stopping ray keeps its old position
+            return new_pos, new_dir, np.linalg.norm(pos, axis=1), pos, state
+
+        if integrator == 'ab2':
+            r = np.linalg.norm(pos, axis=1)
+            f_pos_n = dir_
+            f_dir_n = (-(L_square * 1.5) / r ** 5)[:, None] * pos
+            new_pos = pos + h * (1.5 * f_pos_n - 0.5 * state['f_pos_prev'])
+            new_dir = dir_ + h * (1.5 * f_dir_n - 0.5 * state['f_dir_prev'])
+            return new_pos, new_dir, r, new_pos, {'f_pos_prev': f_pos_n, 'f_dir_prev': f_dir_n}
+
+        # am4: Adams-Bashforth 4 predictor, Adams-Moulton corrector; history[:, 0] is the newest
+        f_pos_prev, f_dir_prev = state['f_pos_prev'], state['f_dir_prev']
+        ab = (9 / 24.0, -19 / 24.0, 5 / 24.0, 1 / 24.0)
+        am = (9 / 24.0, 19 / 24.0, -5 / 24.0, -1 / 24.0)
+        f_pos_predictor = sum(ab[k] * f_pos_prev[:, 3 - k] for k in range(4))
+        f_dir_predictor = sum(ab[k] * f_dir_prev[:, 3 - k] for k in range(4))
+        pos_predictor = pos + h * f_pos_predictor
+        dir_predictor = dir_ + h * f_dir_predictor
+        f_pos_update = sum(am[k] * f_pos_prev[:, 3 - k] for k in range(3)) + am[3] * dir_predictor
+        f_dir_update = sum(am[k] * f_dir_prev[:, 3 - k] for k in range(3)) + am[3] * force(pos_predictor, L_square)
+        new_pos = pos + h * f_pos_update
+        new_dir = dir_ + h * f_dir_update
+        state = {
+            'f_pos_prev': np.concatenate([new_dir[:, None], f_pos_prev[:, :3]], axis=1),
+            'f_dir_prev': np.concatenate([force(new_pos, L_square)[:, None], f_dir_prev[:, :3]], axis=1),
+        }
+        return new_pos, new_dir, np.linalg.norm(new_pos, axis=1), new_pos, state
+
+    def _am4_start(self, pos, dir_, L_square):
+        # Euler, AB2 and AB3 bootstrap steps of Solver.solve_am4 (no disk or termination checks)
+        h = self.h
+        f_pos = [dir_]
+        f_dir = [force(pos, L_square)]
+        pos = pos + h * f_pos[0]
+        dir_ = dir_ + h * f_dir[0]
+
+        f_pos.append(dir_)
+        f_dir.append(force(pos, L_square))
+        pos = pos + h * (1.5 * f_pos[1] - 0.5 * f_pos[0])
+        dir_ = dir_ + h * (1.5 * f_dir[1] - 0.5 * f_dir[0])
+
+        f_pos.append(dir_)
+        f_dir.append(force(pos, L_square))
+        pos = pos + h * (23 / 12.0 * f_pos[2] - 16 / 12.0 * f_pos[1] + 5 / 12.0 * f_pos[0])
+        dir_ = dir_ + h * (23 / 12.0 * f_dir[2] - 16 / 12.0 * f_dir[1] + 5 / 12.0 * f_dir[0])
+
+        # The kernel enters its loop with slots 0-2 filled in bootstrap order and slot 3 zero
+        zero = np.zeros_like(pos)
+        state = {
+            'f_pos_prev': np.stack([f_pos[0], f_pos[1], f_pos[2], zero], axis=1),
+            'f_dir_prev': np.stack([f_dir[0], f_dir[1], f_dir[2], zero], axis=1),
+        }
+        return pos, dir_, state
+
+
+def render_taichi(args, width, height):
+    # The Taichi path with the same settings, for --compare
+    import taichi as ti
+
+    from camera import Camera
+    from runtime import init_taichi
+    from scene import Scene
+    from skymap import Skymap
+    from solver import Solver
+
+    init_taichi(cpu=True)
+    my_camera = Camera(np.array(args.pov, dtype=np.float32), np.float32(args.focal),
+                       np.array([0, 0, 0], dtype=np.float32), np.array([width, height]), fov=np.float32(args.fov % 180))
+    positions, directions = my_camera.get_all_rays()
+    scene = Scene(blackhole_r=1.0, accretion_r1=float(args.ar1), accretion_r2=float(args.ar2),
+                  accretion_temp=400.0, accretion_alpha=1.0, skymap=Skymap(args.texture, r_max=10))
+    scene.set_accretion_disk_texture(args.at)
+    my_solver = Solver(scene, h=float(args.step_size), diagnostics_shape=(width, height))
+    colors = ti.Vector.field(3, dtype=ti.f32, shape=(width, height))
+    colors.fill(0.0)
+    my_solver.solve(args.integrator, positions, directions, colors)
+    return my_camera.render(colors), my_solver.step_counts.to_numpy(), my_solver.horizon_hits.to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render with the pure-NumPy reference backend (no Taichi).")
+    parser.add_argument("-resolution", "-r", type=str, default='320x180',
+                        help="Resolution as WIDTHxHEIGHT (default: 320x180)")
+    parser.add_argument("-integrator", "-i", type=str, default='rk4', choices=INTEGRATORS,
+                        help="Integrator (default: rk4)")
+    parser.add_argument("-step_size", "-s", type=float, default=0.011, help="Time step size (default: 0.011)")
+    parser.add_argument("-pov", "-p", nargs=3, type=float, default=[6, 0, 0.5], metavar=('x', 'y', 'z'),
+                        help="Camera position (default: 6 0 0.5)")
+    parser.add_argument("-focal", "-f", type=float, default=1.8, help="Focal length (default: 1.8)")
+    parser.add_argument("-fov", type=float, default=60, help="Field of view in degrees (default: 60)")
+    parser.add_argument("-texture", "-t", type=str, default='texture/high_res/space_texture_high1.jpg',
+                        help="Sky texture")
+    parser.add_argument("-at", type=str, default='texture/ad/adisk.jpg', help="Accretion disk texture")
+    parser.add_argument("-ar1", type=float, default=2, help="Inner disk radius (default: 2)")
+    parser.add_argument("-ar2", type=float, default=3.5, help="Outer disk radius (default: 3.5)")
+    parser.add_argument("-compact_every", type=int, default=16,
+                        help="Steps between removals of finished rays (default: 16)")
+    parser.add_argument("-output", "-o", type=str, default='numpy_result.png',
+                        help=f"Output file; the extension selects the format {IMAGE_FORMATS}")
+    parser.add_argument("--compare", action="store_true",
+                        help="Also render with the Taichi solver on CPU and report the differences")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.resolution.lower().split('x'))
+    scene = NumpyScene(blackhole_r=1.0, accretion_r1=args.ar1, accretion_r2=args.ar2, accretion_alpha=1.0,
+                       sky_texture=load_texture(args.texture), r_max=10, disk_texture=load_texture(args.at))
+    positions, directions = generate_rays(args.pov, args.focal, [0, 0, 0], (width, height), args.fov % 180)
+    my_solver = NumpySolver(scene, args.step_size, compact_every=args.compact_every)
+
+    print(f'Solving {width * height} rays with {args.integrator}...')
+    start = time.perf_counter()
+    img = my_solver.solve(args.integrator, positions, directions).reshape(width, height, 3)
+    print(f'Solved in {time.perf_counter() - start:.2f} s, '
+          f'{my_solver.step_counts.mean():.0f} steps per ray on average')
+    save_image(img, args.output)
+    print(f'Saved {args.output}')
+
+    if args.compare:
+        from metrics import psnr, ssim
+
+        reference, step_counts, horizon_hits = render_taichi(args, width, height)
+        steps = my_solver.step_counts.reshape(width, height)
+        horizon = my_solver.horizon_hits.reshape(width, height)
+        print(f'Taichi vs NumPy: PSNR {psnr(img, reference):.2f} dB, SSIM {ssim(img, reference):.4f}')
+        print(f'  step counts equal for {np.mean(steps == step_counts) * 100:.2f}% of rays '
+              f'(max difference {np.abs(steps - step_counts).max()})')
+        print(f'  horizon classification equal for {np.mean(horizon == horizon_hits) * 100:.2f}% of rays')
+
+
+if __name__ == '__main__':
+    main()
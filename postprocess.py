@@ -0,0 +1,184 @@
+import numpy as np
+import taichi as ti
+
+# Stage name -> default parameters, in the order they are given on the command line
+STAGES = {
+    'exposure': (1.0,),  # scale
+    'tonemap': ('reinhard',),  # operator: reinhard or aces
+    'gamma': (2.2,),  # gamma; colors are raised to 1 / gamma
+    'bloom': (0.8, 0.5, 4.0),  # luminance threshold, strength, blur sigma in pixels
+    'downsample': (),  # box filter from the supersampled to the output resolution
+}
+TONEMAPS = ('reinhard', 'aces')
+
+
+def parse_stages(specs):
+    """
+    Parses stage descriptions such as ['exposure:1.5', 'bloom:0.7,0.4,6', 'tonemap:aces', 'gamma'].
+
+    Parameters:
+    - specs: list of str, 'name' or 'name:param,param,...'; omitted parameters keep their defaults.
+
+    Returns:
+    - stages: list of (name, params) tuples.
+    """
+    stages = []
+    for spec in specs:
+        name, _, values = spec.partition(':')
+        if name not in STAGES:
+            raise ValueError(f"Unknown post-processing stage '{name}', use one of {list(STAGES)}")
+        defaults = STAGES[name]
+        values = [v for v in values.split(',') if v] if values else []
+        if len(values) > len(defaults):
+            raise ValueError(f"Stage '{name}' takes at most {len(defaults)} parameters, got '{spec}'")
+        params = list(defaults)
+        for k, value in enumerate(values):
+            params[k] = value if isinstance(defaults[k], str) else float(value)
+        if name == 'tonemap' and params[0] not in TONEMAPS:
+            raise ValueError(f"Unknown tone mapping operator '{params[0]}', use one of {TONEMAPS}")
+        stages.append((name, tuple(params)))
+    return stages
+
+
+@ti.data_oriented
+class PostProcess:
+    def __init__(self, width, height, stages, supersample=1):
+        """
+        Chain of post-processing kernels run on the device, ending in an 8-bit image, so only
+        the final output is copied to the host.
+
+        Stages run in the given order. Before 'downsample' they work at the supersampled
+        resolution, after it at the output resolution; with supersample > 1 and no 'downsample'
+        stage, downsampling runs first. Colors enter clamped to [0, 1] by the solvers and are
+        clamped again when quantized to 8 bits.
+
+        Parameters:
+        - width, height: int, output resolution.
+        - stages: list of (name, params) from parse_stages.
+        - supersample: int, the colors field is supersample times larger in each dimension.
+        """
+        self.width = int(width)
+        self.height = int(height)
+        self.supersample = int(supersample)
+        if self.supersample < 1:
+            raise ValueError(f"supersample must be at least 1, got {supersample}")
+        self.stages = list(stages)
+        if self.supersample > 1 and 'downsample' not in [name for name, _ in self.stages]:
+            self.stages.insert(0, ('downsample', ()))
+
+        # Output-resolution colors after downsampling
+        self.color = ti.Vector.field(3, dtype=ti.f32, shape=(self.width, self.height)) if self.supersample > 1 else None
+        self.output = ti.Vector.field(3, dtype=ti.u8, shape=(self.width, self.height))
+
+        # Bright-pass and blur buffers per bloom stage, at the resolution the stage runs at
+        self._bloom = []
+        scale = self.supersample
+        for name, params in self.stages:
+            if name == 'downsample':
+                scale = 1
+            elif name == 'bloom':
+                shape = (self.width * scale, self.height * scale)
+                radius = max(1, int(np.ceil(3.0 * params[2])))
+                weights = np.exp(-0.5 * (np.arange(-radius, radius + 1) / params[2]) ** 2)
+                kernel = ti.field(dtype=ti.f32, shape=2 * radius + 1)
+                kernel.from_numpy((weights / weights.sum()).astype(np.float32))
+                self._bloom.append((ti.Vector.field(3, dtype=ti.f32, shape=shape),
+                                    ti.Vector.field(3, dtype=ti.f32, shape=shape), kernel, radius))
+
+    def run(self, colors):
+        """
+        Applies the stages to colors and reads back the result.
+
+        Parameters:
+        - colors: Taichi field of shape (width * supersample, height * supersample), e.g. the
+          solver output. Stages before 'downsample' (all of them without supersampling)
+          modify it in place.
+
+        Returns:
+        - img: numpy.ndarray, (width, height, 3) uint8 image, as accepted by save_image.
+        """
+        if colors.shape != (self.width * self.supersample, self.height * self.supersample):
+            raise ValueError(f"colors has shape {colors.shape}, expected "
+                             f"{(self.width * self.supersample, self.height * self.supersample)}")
+        field = colors
+        blooms = iter(self._bloom)
+        for name, params in self.stages:
+            if name == 'exposure':
+                self.exposure(field, params[0])
+            elif name == 'tonemap':
+                self.tonemap(field, TONEMAPS.index(params[0]))
+            elif name == 'gamma':
+                self.gamma(field, 1.0 / params[0])
+            elif name == 'bloom':
+                bright, blurred, kernel, radius = next(blooms)
+                self.bright_pass(field, bright, params[0])
+                self.blur(bright, blurred, kernel, radius, 1, 0)
+                self.blur(blurred, bright, kernel, radius, 0, 1)
+                self.add_scaled(field, bright, params[1])
+            elif name == 'downsample' and self.supersample > 1:
+                self.downsample(field, self.color, self.supersample)
+                field = self.color
+        self.quantize(field, self.output)
+        return self.output.to_numpy()
+
+    @ti.kernel
+    def exposure(self, field: ti.template(), scale: ti.f32):
+        for i, j in field:
+            field[i, j] *= scale
+
+    @ti.kernel
+    def tonemap(self, field: ti.template(), operator: ti.i32):
+        for i, j in field:
+            c = field[i, j]
+            if operator == 0:
+                # Reinhard
+                c = c / (1.0 + c)
+            else:
+                # Narkowicz's fit of the ACES filmic curve
+                c = (c * (2.51 * c + 0.03)) / (c * (2.43 * c + 0.59) + 0.14)
+            field[i, j] = ti.math.clamp(c, 0.0, 1.0)
+
+    @ti.kernel
+    def gamma(self, field: ti.template(), exponent: ti.f32):
+        for i, j in field:
+            field[i, j] = ti.pow(ti.max(field[i, j], 0.0), exponent)
+
+    @ti.kernel
+    def bright_pass(self, src: ti.template(), dst: ti.template(), threshold: ti.f32):
+        # Keep the part of each pixel above the luminance threshold
+        for i, j in src:
+            c = src[i, j]
+            luminance = 0.2126 * c[0] + 0.7152 * c[1] + 0.0722 * c[2]
+            dst[i, j] = c * ti.max(luminance - threshold, 0.0) / ti.max(luminance, 1e-6)
+
+    @ti.kernel
+    def blur(self, src: ti.template(), dst: ti.template(), kernel: ti.template(), radius: ti.i32,
+             dx: ti.i32, dy: ti.i32):
+        # One direction of a separable Gaussian blur, clamping at the image border
+        width, height = src.shape
+        for i, j in dst:
+            acc = ti.Vector([0.0, 0.0, 0.0])
+            for k in range(-radius, radius + 1):
+                x = ti.min(ti.max(i + k * dx, 0), width - 1)
+                y = ti.min(ti.max(j + k * dy, 0), height - 1)
+                acc += kernel[k + radius] * src[x, y]
+            dst[i, j] = acc
+
+    @ti.kernel
+    def add_scaled(self, field: ti.template(), other: ti.template(), strength: ti.f32):
+        for i, j in field:
+            field[i, j] += strength * other[i, j]
+
+    @ti.kernel
+    def downsample(self, src: ti.template(), dst: ti.template(), factor: ti.i32):
+        # Box filter over factor x factor blocks
+        for i, j in dst:
+            acc = ti.Vector([0.0, 0.0, 0.0])
+            for a, b in ti.ndrange(factor, factor):
+                acc += src[i * factor + a, j * factor + b]
+            dst[i, j] = acc / (factor * factor)
+
+    @ti.kernel
+    def quantize(self, src: ti.template(), dst: ti.template()):
+        for i, j in dst:
+            dst[i, j] = ti.cast(ti.math.clamp(src[i, j], 0.0, 1.0) * 255.0 + 0.5, ti.u8)
@@ -0,0 +1,148 @@
+# Content-addressed cache of rendered images on local disk, in NumPy only (no Taichi).
+#
+# An entry's key hashes every input of a render: the settings dict the caller passes (camera,
+# integrator, step size, scene parameters, resolution, arch, ...), the content of its texture
+# files and the code version (the source of the modules that compute pixels, including the
+# calling script, and the Taichi version). Identical renders therefore hit even across processes
+# and renamed textures, and any change to the renderer misses. Entries are .npz files holding the
+# image; the least recently used ones are evicted past a size limit.
+import hashlib
+import json
+import os
+
+import numpy as np
+
+CACHE_VERSION = 1
+
+# Rendered images, next to the compiled-kernel and cube map caches
+DEFAULT_RENDER_CACHE = os.environ.get(
+    'BLACKHOLE_RENDER_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'blackhole_rendering', 'renders'))
+DEFAULT_CACHE_SIZE_GB = 4.0
+
+# Modules whose source changes rendered pixels; scripts that compute pixels themselves add their
+# own source (render_key's sources)
+RENDER_MODULES = ('camera.py', 'scene.py', 'skymap.py', 'cubemap.py', 'startup.py', 'solver.py', 'gbuffer.py',
+                  'sparse_geometry.py', 'traversal.py', 'postprocess.py', 'runtime.py', 'render_session.py')
+
+_file_hashes = {}
+_code_versions = {}
+
+
+def file_hash(path):
+    """
+    sha1 of a file's content, remembered per (path, size, modification time).
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def code_version(sources=()):
+    """
+    Hash of the rendering modules' source, the given source files and the Taichi version.
+    """
+    sources = tuple(os.path.abspath(path) for path in sources)
+    if sources not in _code_versions:
+        import taichi
+        digest = hashlib.sha1(f'v{CACHE_VERSION} taichi {taichi.__version__}'.encode())
+        root = os.path.dirname(os.path.abspath(__file__))
+        for path in [os.path.join(root, name) for name in RENDER_MODULES] + list(sources):
+            digest.update(os.path.basename(path).encode())
+            digest.update(file_hash(path).encode())
+        _code_versions[sources] = digest.hexdigest()
+    return _code_versions[sources]
+
+
+def render_key(settings, textures, sources=()):
+    """
+    Cache key of one render.
+
+    Parameters:
+    - settings: dict, every JSON-serializable setting that affects the pixels.
+    - textures: dict, role -> path of every texture file read; hashed by content.
+    - sources: paths of further source files that affect the pixels, such as the calling
+      script (__file__) when it sets up or post-processes the render itself.
+
+    Returns:
+    - key: str, hex sha256.
+    """
+    description = {
+        'settings': settings,
+        'textures': {role: file_hash(path) for role, path in textures.items()},
+        'code': code_version(sources),
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class RenderCache:
+    def __init__(self, cache_dir=DEFAULT_RENDER_CACHE, max_gb=DEFAULT_CACHE_SIZE_GB):
+        """
+        Stores rendered images by key on local disk.
+
+        Parameters:
+        - cache_dir: str, directory of the .npz entries.
+        - max_gb: float, size limit; least recently used entries are deleted beyond it.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_gb * (1 << 30))
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def get(self, key):
+        """
+        Returns the arrays stored under key (at least 'image'), or None.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+            # Modification time orders entries for eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def put(self, key, image, **extras):
+        """
+        Stores an image under key, then evicts old entries. Extra keyword arrays are stored
+        alongside it and returned by get.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        # Write then rename, so a concurrent reader never sees a partial file
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, image=image, **extras)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        # Deletes least recently used entries until the cache fits in max_bytes
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
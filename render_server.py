@@ -0,0 +1,283 @@
+# Long-running local render server: Taichi stays initialized, textures resident and kernels
+# compiled, so a preview costs roughly one solve instead of a fresh process.
+#
+#   python render_server.py --cpu --warmup
+#   curl -s -X POST localhost:8714/render -d '{"pov": [6, 0, 1], "resolution": "fhd"}' -o preview.png -D -
+#
+# POST /render takes a JSON job (any DEFAULT_JOB keys from render_session.py, plus "format":
+# "png" or "jpg" and "quality") and returns the encoded image. Per-request timings are in the
+# X-Render-Timing header as JSON. Identical requests waiting in the queue, or being rendered,
+# are coalesced into one render. GET /status reports the queue and counters.
+#
+# Requests may only render up to -max_pixels pixels and read textures from -texture_dir. Browser
+# requests from other origins than -allow_origin are refused, and without it no cross-origin
+# header is sent.
+import argparse
+import collections
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from image_io import encode_image
+from render_session import DEFAULT_JOB, RenderSession, normalize_job, window_size
+from runtime import DEFAULT_KERNEL_CACHE, init_taichi, warmup_kernels
+from tracing import Tracer
+
+IMAGE_TYPES = {'png': ('.png', 'image/png'), 'jpg': ('.jpg', 'image/jpeg')}
+DEFAULT_MAX_PIXELS = 3840 * 2160
+
+
+def check_job(job, max_pixels=DEFAULT_MAX_PIXELS, texture_dir='texture'):
+    """
+    Rejects a normalized job the server should not run for a client.
+
+    Parameters:
+    - job: dict, normalized job (see normalize_job).
+    - max_pixels: int, largest rendered width x height (the window, or the whole frame).
+    - texture_dir: str, directory every texture file must lie in.
+
+    Raises:
+    - ValueError: with a message that reveals nothing about files outside texture_dir.
+    """
+    width, height = window_size(job)
+    if width * height > max_pixels:
+        raise ValueError(f'{width}x{height} is over the server limit of {max_pixels} pixels')
+    root = os.path.realpath(texture_dir)
+    for key in ('texture', 'at'):
+        path = os.path.realpath(job[key])
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            raise ValueError(f"'{key}' must be an image file in the server's texture directory")
+
+
+class RenderRequest:
+    def __init__(self, job, fmt, quality):
+        self.job = job
+        self.fmt = fmt
+        self.quality = quality
+        self.created = time.perf_counter()
+        self.started = None
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+        self.timing = {}
+
+
+class RenderQueue:
+    def __init__(self, max_pending=32):
+        """
+        FIFO of render requests with coalescing, consumed by one render thread.
+
+        Parameters:
+        - max_pending: int, queued (not yet started) requests before submit refuses more.
+        """
+        self.max_pending = max_pending
+        self._condition = threading.Condition()
+        self._pending = collections.deque()
+        # Requests queued or rendering, by key, so identical submissions share one render
+        self._active = {}
+        self.stats = {'submitted': 0, 'coalesced': 0, 'rendered': 0, 'failed': 0}
+
+    def submit(self, job, fmt, quality):
+        """
+        Queues a job, or joins an identical one that is queued or rendering.
+
+        Returns:
+        - request, coalesced: the RenderRequest to wait on and whether it was shared.
+        """
+        key = json.dumps([job, fmt, quality], sort_keys=True)
+        with self._condition:
+            self.stats['submitted'] += 1
+            request = self._active.get(key)
+            if request is not None:
+                self.stats['coalesced'] += 1
+                return request, True
+            if len(self._pending) >= self.max_pending:
+                raise OverflowError(f'{len(self._pending)} renders already queued')
+            request = RenderRequest(job, fmt, quality)
+            self._active[key] = request
+            self._pending.append((key, request))
+            self._condition.notify()
+            return request, False
+
+    def next(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            return self._pending.popleft()
+
+    def finish(self, key, request, error=None):
+        with self._condition:
+            del self._active[key]
+            self.stats['failed' if error else 'rendered'] += 1
+        request.error = error
+        request.done.set()
+
+    def status(self):
+        with self._condition:
+            return {'queued': len(self._pending), 'active': len(self._active), **self.stats}
+
+
+def render_loop(render_queue, args, warmup_job, ready):
+    # The only thread that touches Taichi: it initializes the runtime and runs every render
+    init_taichi(cpu=args.cpu, kernel_cache=args.kernel_cache)
+    session = RenderSession(max_solvers=args.max_solvers)
+    if warmup_job is not None:
+        print(f"Compiling kernels for {warmup_job['resolution'][0]}x{warmup_job['resolution'][1]}...")
+        my_solver, colors = session.solver(warmup_job)
+        warmup_kernels(session.camera(warmup_job['resolution']), my_solver, colors,
+                       integrators=(warmup_job['integrator'],))
+    ready.set()
+
+    while True:
+        key, request = render_queue.next()
+        request.started = time.perf_counter()
+        tracer = Tracer()
+        try:
+            img = session.render(request.job, tracer)
+            extension = IMAGE_TYPES[request.fmt][0]
+            with tracer.phase('encode', sync=False):
+                request.data = encode_image(img, extension, jpeg_quality=request.quality)
+            request.timing = {name: total for name, (calls, total) in tracer.totals().items()}
+            request.timing['queue_wait'] = request.started - request.created
+            request.timing['render_total'] = time.perf_counter() - request.started
+            render_queue.finish(key, request)
+        except Exception as e:
+            render_queue.finish(key, request, error=e)
+
+
+def make_handler(render_queue, max_pixels=DEFAULT_MAX_PIXELS, texture_dir='texture', allow_origin=None):
+    class RenderHandler(BaseHTTPRequestHandler):
+        def send_cors_headers(self):
+            # Without an allowed origin, browsers keep other sites' pages from reading responses
+            if allow_origin:
+                self.send_header('Access-Control-Allow-Origin', allow_origin)
+                self.send_header('Vary', 'Origin')
+
+        def send_json(self, code, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_cors_headers()
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/status':
+                self.send_json(200, render_queue.status())
+            else:
+                self.send_json(404, {'error': f'Unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/render':
+                self.send_json(404, {'error': f'Unknown path {self.path}'})
+                return
+            origin = self.headers.get('Origin')
+            if origin is not None and origin != allow_origin:
+                # A page on another site; without this it could still queue renders blind
+                self.send_json(403, {'error': f'Origin {origin} is not allowed'})
+                return
+            received = time.perf_counter()
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if not isinstance(body, dict):
+                    raise TypeError(f'Request body must be a JSON object, not {type(body).__name__}')
+                fmt = body.pop('format', 'png')
+                quality = int(body.pop('quality', 90))
+                if fmt not in IMAGE_TYPES:
+                    raise ValueError(f"Unknown format '{fmt}', use one of {list(IMAGE_TYPES)}")
+                job = normalize_job(body)
+                check_job(job, max_pixels, texture_dir)
+            except (ValueError, TypeError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+
+            try:
+                request, coalesced = render_queue.submit(job, fmt, quality)
+            except OverflowError as e:
+                self.send_json(503, {'error': str(e)})
+                return
+            request.done.wait()
+            if request.error is not None:
+                self.send_json(500, {'error': f'{type(request.error).__name__}: {request.error}'})
+                return
+
+            timing = {**request.timing, 'coalesced': coalesced, 'total': time.perf_counter() - received}
+            self.send_response(200)
+            self.send_header('Content-Type', IMAGE_TYPES[fmt][1])
+            self.send_header('Content-Length', str(len(request.data)))
+            self.send_header('X-Render-Timing', json.dumps(timing))
+            self.send_cors_headers()
+            if allow_origin:
+                self.send_header('Access-Control-Expose-Headers', 'X-Render-Timing')
+            self.end_headers()
+            self.wfile.write(request.data)
+
+        def log_message(self, format, *args):
+            print(f'{self.address_string()} {format % args}')
+
+    return RenderHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve renders over HTTP from a warm Taichi runtime.")
+    parser.add_argument("-host", type=str, default='127.0.0.1', help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("-port", type=int, default=8714, help="Port to listen on (default: 8714)")
+    parser.add_argument(
+        "--cpu",
+        action="store_true",
+        help="Use CPU for rendering (default: use GPU)"
+    )
+    parser.add_argument("-kernel_cache", type=str, default=DEFAULT_KERNEL_CACHE,
+                        help=f"Offline kernel cache directory, '' to disable. (default: {DEFAULT_KERNEL_CACHE})")
+    parser.add_argument("--warmup", type=str, nargs='?', default=None, const='fhd', metavar='RESOLUTION',
+                        help="Compile the default job's kernels at this resolution (4k, fhd or WIDTHxHEIGHT) "
+                             "before serving (default: fhd)")
+    parser.add_argument("-max_queue", type=int, default=32,
+                        help="Queued renders before new requests get 503 (default: 32)")
+    parser.add_argument("-max_solvers", type=int, default=4,
+                        help="Solvers (distinct resolution, window size, integrator, step size, textures and disk "
+                             "radii) kept compiled; the least recently used one and the buffers and textures only it "
+                             "uses are freed beyond it (default: 4)")
+    parser.add_argument("-max_pixels", type=int, default=DEFAULT_MAX_PIXELS,
+                        help=f"Largest rendered width x height a request may ask for (default: {DEFAULT_MAX_PIXELS}, 4k)")
+    parser.add_argument("-texture_dir", type=str, default='texture',
+                        help="Directory requests may read 'texture' and 'at' images from (default: texture)")
+    parser.add_argument("-allow_origin", type=str, default=None,
+                        help="Origin (e.g. http://localhost:3000) whose pages may call the server from a browser; "
+                             "without it no cross-origin header is sent (default: none)")
+    args = parser.parse_args()
+    if args.max_solvers < 1:
+        parser.error("-max_solvers must be at least 1")
+
+    warmup_job = None
+    if args.warmup:
+        resolution = args.warmup
+        if 'x' in resolution:
+            resolution = [int(v) for v in resolution.lower().split('x')]
+        warmup_job = normalize_job({'resolution': resolution})
+
+    render_queue = RenderQueue(max_pending=args.max_queue)
+    ready = threading.Event()
+    render_thread = threading.Thread(target=render_loop, args=(render_queue, args, warmup_job, ready), daemon=True)
+    render_thread.start()
+    while not ready.wait(timeout=1.0):
+        if not render_thread.is_alive():
+            raise SystemExit('Render thread failed to start')
+
+    handler = make_handler(render_queue, max_pixels=args.max_pixels, texture_dir=args.texture_dir,
+                           allow_origin=args.allow_origin)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f'Serving renders on http://{args.host}:{args.port}/render (default job: {DEFAULT_JOB})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+import collections
+
+import numpy as np
+import taichi as ti
+
+from camera import Camera
+from render_cache import render_key
+from runtime import field_trees, free_fields
+from scene import Scene
+from skymap import Skymap
+from solver import Solver, INTEGRATORS
+from startup import decode_texture
+from tracing import NULL_TRACER
+
+RESOLUTIONS = {'4k': (3840, 2160), 'fhd': (1920, 1080)}
+
+# Same defaults as main.py
+DEFAULT_JOB = {
+    'pov': [6, 0, 0.5],
+    'focal': 1.8,
+    'fov': 60,
+    'look_at': [0, 0, 0],
+    'resolution': '4k',
+    'texture': 'texture/high_res/space_texture_high1.jpg',
+    'at': 'texture/ad/adisk.jpg',
+    'integrator': 'am4',
+    'step_size': 0.011,
+    'ar1': 2,
+    'ar2': 3.5,
+    # Optional crop (x0, y0, width, height) of the resolution-sized frame
+    'window': None,
+}
+
+
+def normalize_job(job):
+    """
+    Fills in defaults and validates one render description.
+
+    Parameters:
+    - job: dict, any subset of DEFAULT_JOB keys plus an optional 'output'.
+
+    Returns:
+    - job: dict, a new dict with every DEFAULT_JOB key present, 'resolution' as [width, height]
+      and 'window' as None or [x0, y0, width, height].
+    """
+    unknown = set(job) - set(DEFAULT_JOB) - {'output'}
+    if unknown:
+        raise ValueError(f"Unknown render settings: {sorted(unknown)}")
+    job = {**DEFAULT_JOB, **job}
+    if isinstance(job['resolution'], str):
+        if job['resolution'] not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution '{job['resolution']}', use one of {list(RESOLUTIONS)} or [width, height]")
+        job['resolution'] = list(RESOLUTIONS[job['resolution']])
+    job['resolution'] = [int(job['resolution'][0]), int(job['resolution'][1])]
+    if job['window'] is not None:
+        x0, y0, width, height = (int(v) for v in job['window'])
+        if x0 < 0 or y0 < 0 or width < 1 or height < 1 or x0 + width > job['resolution'][0] \
+                or y0 + height > job['resolution'][1]:
+            raise ValueError(f"Window {job['window']} does not fit in the {job['resolution'][0]}x{job['resolution'][1]} frame")
+        job['window'] = [x0, y0, width, height]
+    if job['integrator'] not in INTEGRATORS:
+        raise ValueError(f"Unknown integrator '{job['integrator']}', use one of {list(INTEGRATORS)}")
+    job['fov'] = job['fov'] % 180
+    return job
+
+
+def compile_key(job):
+    """
+    Settings baked into compiled kernels as constants. Jobs sharing a key reuse the same
+    solver kernel; everything else (camera pose, focal length, FoV, window offset) lives in
+    Taichi fields.
+    """
+    return (tuple(job['resolution']), window_size(job), job['integrator'], float(job['step_size']),
+            job['texture'], job['at'], float(job['ar1']), float(job['ar2']))
+
+
+def orbit_pov(pov, frame_idx, num_frames):
+    # Camera position on a circle around the z-axis through pov, as in export_animation.py
+    radius = np.hypot(pov[0], pov[1])
+    angle = np.arctan2(pov[1], pov[0]) + 2.0 * np.pi * frame_idx / num_frames
+    return [float(radius * np.cos(angle)), float(radius * np.sin(angle)), float(pov[2])]
+
+
+def cache_key(job):
+    # Render cache key of a normalized job on the current Taichi arch
+    settings = {k: job[k] for k in DEFAULT_JOB if k not in ('texture', 'at')}
+    settings['arch'] = str(ti.cfg.arch)
+    return render_key(settings, {'texture': job['texture'], 'at': job['at']})
+
+
+def window_size(job):
+    # Size of the rendered region: the window, or the whole frame
+    return tuple(job['window'][2:]) if job['window'] is not None else tuple(job['resolution'])
+
+
+class RenderSession:
+    def __init__(self, cache=None, max_solvers=None):
+        """
+        Renders many images in one Taichi runtime. Textures are decoded and uploaded once,
+        and cameras, solvers and color buffers are kept so their kernels compile once. Color
+        buffers only depend on the rendered size, so solvers of the same size share one.
+        ti.init must be called before creating the session.
+
+        Parameters:
+        - cache: RenderCache or None, returns stored images for renders done before.
+        - max_solvers: int or None, solvers (distinct compile_key values) kept. Beyond it the
+          least recently used one is dropped, together with the cameras, sky maps, disk
+          textures and color buffers no kept solver uses, and their memory is freed. None
+          keeps everything.
+        """
+        self.cache = cache
+        self.max_solvers = max_solvers
+        self._skymaps = {}
+        self._disk_textures = {}
+        self._cameras = {}
+        self._solvers = collections.OrderedDict()
+        self._colors = {}
+        # SNode trees holding the fields of each kept object, by (kind, key)
+        self._trees = {}
+
+    def skymap(self, image_path):
+        if image_path not in self._skymaps:
+            with field_trees() as trees:
+                self._skymaps[image_path] = Skymap(image_path, r_max=10)
+            self._trees['skymap', image_path] = trees
+        return self._skymaps[image_path]
+
+    def disk_texture(self, image_path):
+        # Accretion disk texture field, shared by every scene using the image
+        if image_path not in self._disk_textures:
+            texture = decode_texture(image_path)
+            with field_trees() as trees:
+                field = ti.Vector.field(3, dtype=ti.f32, shape=texture.shape[:2])
+                field.from_numpy(texture)
+            self._disk_textures[image_path] = field
+            self._trees['disk', image_path] = trees
+        return self._disk_textures[image_path]
+
+    def camera(self, resolution, size=None):
+        # One camera per frame resolution and rendered region size (default: the whole frame)
+        key = (tuple(resolution), tuple(size or resolution))
+        if key not in self._cameras:
+            with field_trees() as trees:
+                self._cameras[key] = Camera(np.array(DEFAULT_JOB['pov'], dtype=np.float32), np.float32(1.0),
+                                            np.array([0, 0, 0], dtype=np.float32), np.array(resolution),
+                                            window=(0, 0) + key[1])
+            self._trees['camera', key] = trees
+        return self._cameras[key]
+
+    def solver(self, job):
+        key = compile_key(job)
+        if key in self._solvers:
+            self._solvers.move_to_end(key)
+        else:
+            skymap = self.skymap(job['texture'])
+            disk_texture = self.disk_texture(job['at'])
+            with field_trees() as trees:
+                scene = Scene(blackhole_r=1.0, accretion_r1=float(job['ar1']),
+                              accretion_r2=float(job['ar2']), accretion_temp=400.0,
+                              accretion_alpha=1.0,
+                              skymap=skymap)
+                scene.set_accretion_disk_texture(job['at'], texture_field=disk_texture)
+                self._solvers[key] = Solver(scene, h=float(job['step_size']))
+            self._trees['solver', key] = trees
+            self.evict()
+        return self._solvers[key], self.colors(window_size(job))
+
+    def colors(self, size):
+        # One color buffer per rendered region size, shared by every solver rendering it
+        if size not in self._colors:
+            with field_trees() as trees:
+                self._colors[size] = ti.Vector.field(3, dtype=ti.f32, shape=size)
+            self._trees['colors', size] = trees
+        return self._colors[size]
+
+    def evict(self):
+        # Drops least recently used solvers beyond max_solvers, then everything only they used
+        if self.max_solvers is None or len(self._solvers) <= self.max_solvers:
+            return
+        while len(self._solvers) > self.max_solvers:
+            key, _ = self._solvers.popitem(last=False)
+            free_fields(self._trees.pop(('solver', key)))
+        # compile_key is (resolution, window size, integrator, step size, texture, at, ar1, ar2)
+        in_use = {'camera': {key[:2] for key in self._solvers}, 'colors': {key[1] for key in self._solvers},
+                  'skymap': {key[4] for key in self._solvers}, 'disk': {key[5] for key in self._solvers}}
+        for kind, objects in (('camera', self._cameras), ('colors', self._colors),
+                              ('skymap', self._skymaps), ('disk', self._disk_textures)):
+            for key in [key for key in objects if key not in in_use[kind]]:
+                del objects[key]
+                free_fields(self._trees.pop((kind, key)))
+
+    def render(self, job, tracer=NULL_TRACER):
+        """
+        Renders one job.
+
+        Parameters:
+        - job: dict, render settings (see normalize_job).
+        - tracer: Tracer timing the generate_rays, solve, render_scene and to_numpy phases
+          (and cache_lookup, cache_store with a cache).
+
+        Returns:
+        - img: numpy.ndarray, (width, height, 3) image in [0, 1], as Camera.render; only the
+          window when the job has one. Cached images are returned as stored.
+        """
+        job = normalize_job(job)
+        key = None
+        if self.cache is not None:
+            with tracer.phase('cache_lookup'):
+                key = cache_key(job)
+                entry = self.cache.get(key)
+            if entry is not None:
+                return entry['image']
+
+        my_camera = self.camera(job['resolution'], window_size(job))
+        my_solver, colors = self.solver(job)
+
+        my_camera.set_view(job['pov'], job['focal'], job['look_at'], job['fov'])
+        my_camera.set_window(*(job['window'][:2] if job['window'] is not None else (0, 0)))
+        with tracer.phase('generate_rays'):
+            positions, directions = my_camera.get_all_rays()
+        colors.fill(0.0)
+        with tracer.phase('solve', integrator=job['integrator']):
+            my_solver.solve(job['integrator'], positions, directions, colors)
+        with tracer.phase('render_scene'):
+            my_camera.render_scene(colors)
+        with tracer.phase('to_numpy'):
+            img = my_camera.read_image()
+        if key is not None:
+            with tracer.phase('cache_store'):
+                self.cache.put(key, img)
+        return img
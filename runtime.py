@@ -0,0 +1,105 @@
+import contextlib
+import os
+import time
+
+import taichi as ti
+from taichi.lang import impl
+
+from solver import INTEGRATORS
+
+# Persistent compiled-kernel cache, shared by every entry point of the project
+DEFAULT_KERNEL_CACHE = os.environ.get(
+    'BLACKHOLE_KERNEL_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'blackhole_rendering', 'kernels'))
+
+
+def init_taichi(cpu=False, kernel_cache=DEFAULT_KERNEL_CACHE, **kwargs):
+    """
+    Initializes Taichi with the project's offline kernel cache.
+
+    Parameters:
+    - cpu: bool, use the CPU backend instead of the GPU.
+    - kernel_cache: str or None, directory of the offline kernel cache. None disables it.
+    - kwargs: forwarded to ti.init (e.g. cpu_max_num_threads, kernel_profiler).
+    """
+    arch = ti.cpu if cpu else ti.gpu
+    if kernel_cache:
+        os.makedirs(kernel_cache, exist_ok=True)
+        ti.init(arch=arch, offline_cache=True, offline_cache_file_path=kernel_cache, **kwargs)
+    else:
+        ti.init(arch=arch, offline_cache=False, **kwargs)
+
+
+@contextlib.contextmanager
+def field_trees():
+    """
+    Collects the SNode trees of every field allocated in the block, so their memory can be
+    released later with free_fields. Taichi only frees memory by whole trees (a field whose
+    last reference is dropped keeps its memory), and fields are placed in the runtime's root
+    tree until a kernel or field access materializes it. The block therefore starts from a
+    materialized root and keeps every tree materialized inside it, including the last one.
+
+    Yields:
+    - trees: list of SNodeTree, filled when the block exits.
+    """
+    runtime = impl.get_runtime()
+    runtime.materialize_root_fb(False)  # Fields allocated before the block stay out of it
+    trees = []
+
+    def materialize_root_fb(is_first_call):
+        # As PyTaichi.materialize_root_fb, keeping the finalized tree
+        if impl.root.finalized or (not is_first_call and impl.root.empty):
+            return
+        trees.append(impl.root.finalize(raise_warning=not is_first_call))
+        impl._root_fb = ti.FieldsBuilder()
+
+    runtime.materialize_root_fb = materialize_root_fb
+    try:
+        yield trees
+    finally:
+        try:
+            materialize_root_fb(False)
+        finally:
+            del runtime.materialize_root_fb
+
+
+def free_fields(trees):
+    """
+    Releases the memory of trees collected by field_trees. Their fields must not be used again.
+    """
+    ti.sync()
+    for tree in trees:
+        tree.destroy()
+    trees.clear()
+
+
+def warmup_kernels(camera, solver, colors, integrators=INTEGRATORS):
+    """
+    Compiles ray generation, every integrator and rendering for this camera/solver without
+    tracing a full frame, so later calls (in this or any process sharing the kernel cache)
+    start immediately. Overwrites the camera's rays and the colors field.
+
+    Returns:
+    - timings: dict, seconds spent per kernel.
+    """
+    timings = {}
+    start = time.perf_counter()
+    positions, directions = camera.get_all_rays()
+    ti.sync()
+    timings['generate_rays'] = time.perf_counter() - start
+
+    for integrator in integrators:
+        # Rays starting outside the skymap sphere leave after a single step
+        positions.fill(solver.scene.skymap.r_max * 2)
+        directions.fill(1.0)
+        colors.fill(0.0)
+        start = time.perf_counter()
+        solver.solve(integrator, positions, directions, colors)
+        ti.sync()
+        timings[integrator] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    camera.render(colors)
+    timings['render_scene'] = time.perf_counter() - start
+
+    camera.generate_rays()
+    return timings
@@ -9,6 +9,8 @@ from skymap import Skymap
 class Scene:
     def __init__(self, blackhole_r: ti.f32, accretion_r1: ti.f32,
                  accretion_r2: ti.f32, accretion_temp: ti.f32, accretion_alpha: ti.f32, skymap: Skymap):
+        # Pass plain Python floats: they are baked into every kernel as constants, whereas a
+        # ti.cast(...) made outside Taichi scope is only valid in the first kernel compiled with it
         self.blackhole_r = blackhole_r
         self.accretion_r1 = accretion_r1
         self.accretion_r2 = accretion_r2
@@ -21,12 +23,22 @@ class Scene:
         self.img_width = None
         self.texture_field = None
 
-    def set_accretion_disk_texture(self, image_path):
+    def set_accretion_disk_texture(self, image_path, texture_field=None):
+        """
+        Sets the accretion disk texture.
+
+        Parameters:
+        - image_path: str, path to the image file.
+        - texture_field: optional Taichi field already holding this texture (e.g. shared by
+          several scenes); when given, the image is not loaded again.
+        """
         self.has_accretion_disk_texture = True
-        self.accretion_image = self.load_texture(image_path)
-        self.img_height, self.img_width, _ = self.accretion_image.shape
-        self.texture_field = ti.Vector.field(3, dtype=ti.f32, shape=(self.img_height, self.img_width))
-        self.texture_field.from_numpy(self.accretion_image)
+        if texture_field is None:
+            self.accretion_image = self.load_texture(image_path)
+            texture_field = ti.Vector.field(3, dtype=ti.f32, shape=self.accretion_image.shape[:2])
+            texture_field.from_numpy(self.accretion_image)
+        self.img_height, self.img_width = texture_field.shape
+        self.texture_field = texture_field
 
     def load_texture(self, image_path):
         """
@@ -2,23 +2,59 @@ import numpy as np
 from PIL import Image
 import taichi as ti
 
+from cubemap import DEFAULT_CUBEMAP_CACHE, load_cubemap
+from startup import texture_shape
+
+PROJECTIONS = ('equirect', 'cube')
+FILTERS = ('nearest', 'bilinear')
+
 
 @ti.data_oriented
 class Skymap:
-    def __init__(self, image_path, r_max):
+    def __init__(self, image_path, r_max, projection='equirect', filtering='nearest', face_size=None,
+                 cache_dir=DEFAULT_CUBEMAP_CACHE, deferred=False):
         """
         Initializes the Skymap with the given image.
 
         Parameters:
         - image_path: str, path to the .jpg or .png image file.
+        - projection: str, 'equirect' samples the image directly (acos/atan2 per ray); 'cube'
+          converts it to a cube map at load time, sampled with a face select and a divide.
+        - filtering: str, 'nearest' or 'bilinear' cube map lookups.
+        - face_size: int, cube face edge in texels (default: image width / 4).
+        - cache_dir: str or None, where converted cube maps are cached.
+        - deferred: bool, only read the image size and allocate the texture field, so kernels
+          can compile while the image is decoded elsewhere (see startup.py); fill it with upload.
         """
+        if projection not in PROJECTIONS:
+            raise ValueError(f"Unknown skymap projection '{projection}', use one of {PROJECTIONS}")
+        if filtering not in FILTERS:
+            raise ValueError(f"Unknown skymap filtering '{filtering}', use one of {FILTERS}")
         self.image_path = image_path
-        self.texture = self.load_texture(image_path)
-        self.img_height, self.img_width, _ = self.texture.shape
-        self.texture_field = ti.Vector.field(3, dtype=ti.f32, shape=(self.img_height, self.img_width))
-        self.texture_field.from_numpy(self.texture)
+        if deferred:
+            self.texture = None
+            self.img_height, self.img_width = texture_shape(image_path)
+        else:
+            self.texture = self.load_texture(image_path)
+            self.img_height, self.img_width, _ = self.texture.shape
+        self.is_cube = projection == 'cube'
+        self.is_bilinear = filtering == 'bilinear'
+        if self.is_cube:
+            # Same default as load_cubemap
+            self.face_size = int(face_size) if face_size else max(1, self.img_width // 4)
+            self.texture_field = ti.Vector.field(3, dtype=ti.f32, shape=(6, self.face_size + 2, self.face_size + 2))
+            if not deferred:
+                self.upload(load_cubemap(image_path, self.texture, self.face_size, cache_dir))
+        else:
+            self.texture_field = ti.Vector.field(3, dtype=ti.f32, shape=(self.img_height, self.img_width))
+            if not deferred:
+                self.upload(self.texture)
         self.r_max = r_max
 
+    def upload(self, data):
+        # Texture field contents: the (height, width, 3) texture, or the cube map faces
+        self.texture_field.from_numpy(data)
+
     def load_texture(self, image_path):
         """
         Loads the image and converts it into a numpy array.
@@ -38,6 +74,15 @@ class Skymap:
 
     @ti.func
     def get_color_from_ray_ti(self, D):
+        color = ti.Vector([0.0, 0.0, 0.0])
+        if ti.static(self.is_cube):
+            color = self.get_cube_color_ti(D)
+        else:
+            color = self.get_equirect_color_ti(D)
+        return color
+
+    @ti.func
+    def get_equirect_color_ti(self, D):
         D = D.normalized()
         x, y, z = D[0], D[1], D[2]
 
@@ -60,3 +105,38 @@ class Skymap:
         tex_u = ti.min(ti.max(tex_u, 0), self.img_width - 1)
         tex_v = ti.min(ti.max(tex_v, 0), self.img_height - 1)
         return self.texture_field[tex_v, tex_u]
+
+    @ti.func
+    def get_cube_color_ti(self, D):
+        # Face of the largest component (layout in cubemap.py); no normalization needed
+        a = ti.abs(D)
+        face = 0
+        major, s, t = D[0], D[1], D[2]
+        if a[0] >= a[1] and a[0] >= a[2]:
+            face, major, s, t = 0, D[0], D[1], D[2]
+        elif a[1] >= a[2]:
+            face, major, s, t = 2, D[1], D[0], D[2]
+        else:
+            face, major, s, t = 4, D[2], D[0], D[1]
+        if major < 0:
+            face += 1
+
+        # Texel coordinates with centers at integers; texel 0 and face_size + 1 are the border
+        scale = 0.5 * self.face_size / ti.abs(major)
+        x = s * scale + 0.5 * self.face_size + 0.5
+        y = t * scale + 0.5 * self.face_size + 0.5
+        color = ti.Vector([0.0, 0.0, 0.0])
+        if ti.static(self.is_bilinear):
+            x0 = ti.min(ti.max(ti.cast(ti.floor(x), ti.i32), 0), self.face_size)
+            y0 = ti.min(ti.max(ti.cast(ti.floor(y), ti.i32), 0), self.face_size)
+            fx = x - x0
+            fy = y - y0
+            color = ((1 - fx) * (1 - fy) * self.texture_field[face, x0, y0]
+                     + fx * (1 - fy) * self.texture_field[face, x0 + 1, y0]
+                     + (1 - fx) * fy * self.texture_field[face, x0, y0 + 1]
+                     + fx * fy * self.texture_field[face, x0 + 1, y0 + 1])
+        else:
+            xi = ti.min(ti.max(ti.cast(x + 0.5, ti.i32), 1), self.face_size)
+            yi = ti.min(ti.max(ti.cast(y + 0.5, ti.i32), 1), self.face_size)
+            color = self.texture_field[face, xi, yi]
+        return color
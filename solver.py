@@ -4,12 +4,43 @@ import taichi as ti
 from scene import Scene
 
 
+INTEGRATORS = ("euler", "rk4", "leapfrog", "ab2", "am4")
+
+
 @ti.data_oriented
 class Solver:
-    def __init__(self, scene: Scene, h):
+    def __init__(self, scene: Scene, h, diagnostics_shape=None, trajectory=None):
         self.scene = scene
         self.h = h
 
+        # Optional per-ray diagnostics (step count and 1 if the ray fell into the horizon),
+        # recorded by every kernel. Compiled out entirely when diagnostics_shape is None.
+        self.has_diagnostics = diagnostics_shape is not None
+        self.step_counts = None
+        self.horizon_hits = None
+        if self.has_diagnostics:
+            self.step_counts = ti.field(dtype=ti.i32, shape=tuple(diagnostics_shape))
+            self.horizon_hits = ti.field(dtype=ti.i32, shape=tuple(diagnostics_shape))
+
+        # Optional TrajectoryRecorder for the paths of selected pixels, also compiled out when None
+        self.has_trajectory = trajectory is not None
+        self.trajectory = trajectory
+
+    def solve(self, integrator, positions, directions, colors):
+        # Dispatch to the kernel of the named integrator
+        if integrator == "euler":
+            self.solve_forward_euler(positions, directions, colors)
+        elif integrator == 'rk4':
+            self.solve_rk4(positions, directions, colors)
+        elif integrator == 'leapfrog':
+            self.solve_leapfrog(positions, directions, colors)
+        elif integrator == 'ab2':
+            self.solve_ab2(positions, directions, colors)
+        elif integrator == 'am4':
+            self.solve_am4(positions, directions, colors)
+        else:
+            raise ValueError(f"Unknown integrator: {integrator}")
+
     # function for RK4
     @ti.func
     def rk4_f(self, pos, L_square):
@@ -17,6 +48,29 @@ class Solver:
         one_point_five = ti.cast(1.5, ti.f32)
         return - (L_square * pos * one_point_five) / (r ** 5)
 
+    @ti.func
+    def record_diagnostics(self, i, j, steps, event_horizon_hit):
+        if ti.static(self.has_diagnostics):
+            self.step_counts[i, j] = steps
+            self.horizon_hits[i, j] = ti.cast(event_horizon_hit, ti.i32)
+
+    @ti.func
+    def get_trajectory_slot(self, i, j):
+        slot = -1
+        if ti.static(self.has_trajectory):
+            slot = self.trajectory.slot[i, j]
+        return slot
+
+    @ti.func
+    def record_trajectory(self, slot, steps, pos):
+        if ti.static(self.has_trajectory):
+            self.trajectory.record(slot, steps, pos)
+
+    @ti.func
+    def finish_trajectory(self, slot, steps, pos):
+        if ti.static(self.has_trajectory):
+            self.trajectory.finish(slot, steps, pos)
+
     @ti.func
     def determine_color(self, event_horizon_hit, accretion_disk_hit, pos, accretion_disk_hit_x, accretion_disk_hit_y):
         color = ti.Vector([0.0, 0.0, 0.0])
@@ -48,9 +102,13 @@ class Solver:
             dir_ = directions[i, j]
             dir_ = dir_.normalized()
             L_square = dir_.cross(pos).norm() ** 2
+            trajectory_slot = self.get_trajectory_slot(i, j)
+            self.record_trajectory(trajectory_slot, 0, pos)
 
             event_horizon_hit = False
+            steps = 0
             while True:
+                steps += 1
                 new_pos = pos + self.h * dir_
                 r = new_pos.norm()
                 constant = - (L_square * one_point_five) / (r ** 5)
@@ -68,6 +126,7 @@ class Solver:
 
                 pos = new_pos
                 dir_ = new_dir
+                self.record_trajectory(trajectory_slot, steps, pos)
 
                 if r < self.scene.blackhole_r:
                     event_horizon_hit = True
@@ -84,6 +143,8 @@ class Solver:
                     pos) + self.scene.accretion_alpha * colors[i, j]
 
             colors[i, j] = ti.math.clamp(colors[i, j], 0.0, 1.0)
+            self.finish_trajectory(trajectory_slot, steps, pos)
+            self.record_diagnostics(i, j, steps, event_horizon_hit)
 
     # Runge-Kutta 4-step method
     @ti.kernel
@@ -93,9 +154,13 @@ class Solver:
             pos = positions[i, j]
             dir_ = directions[i, j]
             L_square = dir_.cross(pos).norm() ** 2
+            trajectory_slot = self.get_trajectory_slot(i, j)
+            self.record_trajectory(trajectory_slot, 0, pos)
 
             event_horizon_hit = False
+            steps = 0
             while True:
+                steps += 1
                 # RK4 integration for position
                 k1_pos = self.h * dir_
                 k1_dir = self.h * self.rk4_f(pos, L_square)
@@ -131,6 +196,7 @@ class Solver:
 
                 pos = new_pos
                 dir_ = new_dir_
+                self.record_trajectory(trajectory_slot, steps, pos)
 
             if event_horizon_hit:
                 colors[i, j] = ti.Vector(
@@ -141,6 +207,9 @@ class Solver:
                     pos) + self.scene.accretion_alpha * colors[i, j]
 
             colors[i, j] = ti.math.clamp(colors[i, j], 0.0, 1.0)
+            # The last step only tested pos, so pos is the position after steps - 1 steps
+            self.finish_trajectory(trajectory_slot, steps - 1, pos)
+            self.record_diagnostics(i, j, steps, event_horizon_hit)
 
     # Leapfrog method
     @ti.kernel
@@ -151,6 +220,8 @@ class Solver:
             pos = positions[i, j]
             dir_ = directions[i, j]
             L_square = dir_.cross(pos).norm() ** 2
+            trajectory_slot = self.get_trajectory_slot(i, j)
+            self.record_trajectory(trajectory_slot, 0, pos)
 
             # Half-step velocity update
             r = pos.norm()
@@ -159,7 +230,9 @@ class Solver:
 
             event_horizon_hit = False
             accretion_disk_hit = False
+            steps = 0
             while True:
+                steps += 1
                 # Full-step position update
                 new_pos = pos + self.h * dir_
 
@@ -181,6 +254,7 @@ class Solver:
 
                 pos = new_pos
                 dir_ = new_dir_
+                self.record_trajectory(trajectory_slot, steps, pos)
 
                 # Check if the ray hits the event horizon or the skymap
                 r = ti.sqrt(pos.dot(pos))
@@ -199,6 +273,8 @@ class Solver:
                     pos) + self.scene.accretion_alpha * colors[i, j]
 
             colors[i, j] = ti.math.clamp(colors[i, j], 0.0, 1.0)
+            self.finish_trajectory(trajectory_slot, steps, pos)
+            self.record_diagnostics(i, j, steps, event_horizon_hit)
 
     # Adams-Bashforth 2-step method
     @ti.kernel
@@ -212,6 +288,8 @@ class Solver:
             pos = positions[i, j]
             dir_ = directions[i, j]
             L_square = dir_.cross(pos).norm() ** 2
+            trajectory_slot = self.get_trajectory_slot(i, j)
+            self.record_trajectory(trajectory_slot, 0, pos)
 
             # Initialize f_{n-1}
             f_pos_prev = dir_
@@ -221,7 +299,9 @@ class Solver:
 
             event_horizon_hit = False
             accretion_disk_hit = False
+            steps = 0
             while True:
+                steps += 1
                 # Compute f_n
                 f_pos_n = dir_
                 r = pos.norm()
@@ -242,6 +322,7 @@ class Solver:
 
                 pos = new_pos
                 dir_ = new_dir_
+                self.record_trajectory(trajectory_slot, steps, pos)
 
                 # Update previous function evaluations
                 f_pos_prev = f_pos_n
@@ -263,6 +344,8 @@ class Solver:
                     pos) + self.scene.accretion_alpha * colors[i, j]
 
             colors[i, j] = ti.math.clamp(colors[i, j], 0.0, 1.0)
+            self.finish_trajectory(trajectory_slot, steps, pos)
+            self.record_diagnostics(i, j, steps, event_horizon_hit)
 
     @ti.kernel
     def solve_am4(self, positions: ti.template(), directions: ti.template(), colors: ti.template()):
@@ -277,6 +360,8 @@ class Solver:
             pos = positions[i, j]
             dir_ = directions[i, j]
             L_square = dir_.cross(pos).norm() ** 2
+            trajectory_slot = self.get_trajectory_slot(i, j)
+            self.record_trajectory(trajectory_slot, 0, pos)
 
             # Initialize function evaluations
             f_pos_prev = [ti.Vector([0.0, 0.0, 0.0]) for _ in range(4)]
@@ -313,7 +398,9 @@ class Solver:
             # Start Adams-Moulton 4-step method
             event_horizon_hit = False
 
+            steps = 0
             while True:
+                steps += 1
                 # Predictor step: Adams-Bashforth 4-step
                 f_pos_predictor = ti.Vector([0.0, 0.0, 0.0])
                 f_dir_predictor = ti.Vector([0.0, 0.0, 0.0])
@@ -352,6 +439,7 @@ class Solver:
 
                 pos = new_pos
                 dir_ = new_dir_
+                self.record_trajectory(trajectory_slot, steps, pos)
 
                 # Shift previous function evaluations
                 for k in ti.static(range(3)):  # Reverse logic manually
@@ -378,3 +466,86 @@ class Solver:
                     pos) + self.scene.accretion_alpha * colors[i, j]
 
             colors[i, j] = ti.math.clamp(colors[i, j], 0.0, 1.0)
+            self.finish_trajectory(trajectory_slot, steps, pos)
+            self.record_diagnostics(i, j, steps, event_horizon_hit)
+
+    # Runge-Kutta 4-step method, recording ray geometry instead of colors
+    @ti.kernel
+    def trace_rk4(self, positions: ti.template(), directions: ti.template(), gbuffer: ti.template()):
+
+        for i, j in positions:
+            pos = positions[i, j]
+            dir_ = directions[i, j]
+            L_square = dir_.cross(pos).norm() ** 2
+            trajectory_slot = self.get_trajectory_slot(i, j)
+            self.record_trajectory(trajectory_slot, 0, pos)
+
+            event_horizon_hit = 0
+            disk_count = 0
+            steps = 0
+            while True:
+                steps += 1
+                k1_pos = self.h * dir_
+                k1_dir = self.h * self.rk4_f(pos, L_square)
+
+                k2_pos = self.h * (dir_ + 0.5 * k1_dir)
+                k2_dir = self.h * self.rk4_f(pos + 0.5 * k1_pos, L_square)
+
+                k3_pos = self.h * (dir_ + 0.5 * k2_dir)
+                k3_dir = self.h * self.rk4_f(pos + 0.5 * k2_pos, L_square)
+
+                k4_pos = self.h * (dir_ + k3_dir)
+                k4_dir = self.h * self.rk4_f(pos + k3_pos, L_square)
+
+                new_pos = pos + (k1_pos + 2 * k2_pos + 2 * k3_pos + k4_pos) / 6
+                new_dir_ = dir_ + (k1_dir + 2 * k2_dir + 2 * k3_dir + k4_dir) / 6
+
+                # Record accretion disk crossings instead of shading them
+                if pos[2] * new_pos[2] < 0:
+                    t = -pos[2] / (new_pos[2] - pos[2])
+                    ad_hit_coord = pos[:2] + t * (new_pos[:2] - pos[:2])
+
+                    if self.scene.accretion_r2 >= ad_hit_coord.norm() >= self.scene.accretion_r1:
+                        if disk_count < gbuffer.max_disk_hits:
+                            gbuffer.disk_hits[i, j, disk_count] = ad_hit_coord
+                        disk_count += 1
+
+                r = pos.norm()
+                if r < self.scene.blackhole_r:
+                    event_horizon_hit = 1
+                    break
+                elif r > self.scene.skymap.r_max:
+                    break
+
+                pos = new_pos
+                dir_ = new_dir_
+                self.record_trajectory(trajectory_slot, steps, pos)
+
+            gbuffer.escape[i, j] = pos
+            gbuffer.horizon[i, j] = event_horizon_hit
+            gbuffer.disk_count[i, j] = disk_count
+            # The last step only tested pos, so pos is the position after steps - 1 steps
+            self.finish_trajectory(trajectory_slot, steps - 1, pos)
+            self.record_diagnostics(i, j, steps, event_horizon_hit)
+
+    # Shade recorded geometry, rotated by phi_offset about the z-axis
+    @ti.kernel
+    def shade_gbuffer(self, gbuffer: ti.template(), phi_offset: ti.f32, colors: ti.template()):
+        c, s = ti.cos(phi_offset), ti.sin(phi_offset)
+
+        for i, j in colors:
+            accretion_color = ti.Vector([0.0, 0.0, 0.0])
+            for k in range(ti.min(gbuffer.disk_count[i, j], gbuffer.max_disk_hits)):
+                hit = gbuffer.disk_hits[i, j, k]
+                accretion_color += self.scene.get_accretion_disk_color_ti(
+                    c * hit[0] - s * hit[1], s * hit[0] + c * hit[1])
+
+            color = ti.Vector([0.0, 0.0, 0.0])
+            if gbuffer.horizon[i, j] == 1:
+                color = self.scene.accretion_alpha * accretion_color
+            else:
+                esc = gbuffer.escape[i, j]
+                rotated = ti.Vector([c * esc[0] - s * esc[1], s * esc[0] + c * esc[1], esc[2]])
+                color = self.scene.skymap.get_color_from_ray_ti(rotated) + self.scene.accretion_alpha * accretion_color
+
+            colors[i, j] = ti.math.clamp(color, 0.0, 1.0)
@@ -0,0 +1,174 @@
+import numpy as np
+import taichi as ti
+
+from gbuffer import GBuffer
+
+
+class SparseTracer:
+    def __init__(self, solver, max_cell=8, direction_tolerance=0.001, disk_tolerance=0.004,
+                 batch_size=1 << 16, max_disk_hits=4):
+        """
+        Fills a GBuffer by integrating rays on a coarse pixel grid and interpolating the rest.
+
+        Rays are traced at the corners of max_cell x max_cell pixel cells, and at each cell's
+        center. A cell is interpolated bilinearly when all five rays end the same way (horizon or
+        escape, same number of disk crossings) and the bilinear prediction of the center ray from
+        the corners is within tolerance. Otherwise its edge midpoints are traced and its four
+        quarters are checked the same way, down to single pixels, so only the regions around the
+        shadow edge, the photon ring and the disk edges are integrated densely.
+
+        Rays are integrated with Solver.trace_rk4 in fixed-size batches padded with rays that
+        leave the scene after one step, so the kernel compiles once.
+
+        Parameters:
+        - solver: Solver without diagnostics or trajectory (trace_rk4 would record them at batch indices).
+        - max_cell: int, initial cell size in pixels.
+        - direction_tolerance: float, largest angle (radians) between the predicted and traced
+          escape direction of a cell's center.
+        - disk_tolerance: float, largest distance between the predicted and traced disk hit
+          points of a cell's center, in scene units.
+        - batch_size: int, rays per trace_rk4 launch.
+        - max_disk_hits: int, disk crossings stored per ray (as in GBuffer).
+        """
+        if solver.has_diagnostics or solver.has_trajectory:
+            raise ValueError("SparseTracer needs a Solver created without diagnostics_shape or trajectory")
+        self.solver = solver
+        self.max_cell = int(max_cell)
+        self.direction_tolerance = direction_tolerance
+        self.disk_tolerance = disk_tolerance
+        self.batch_size = int(batch_size)
+        self.max_disk_hits = int(max_disk_hits)
+
+        self.batch_positions = ti.Vector.field(3, dtype=ti.f32, shape=(self.batch_size, 1))
+        self.batch_directions = ti.Vector.field(3, dtype=ti.f32, shape=(self.batch_size, 1))
+        self.batch_gbuffer = GBuffer(self.batch_size, 1, self.max_disk_hits)
+
+    def trace(self, positions, directions, gbuffer):
+        """
+        Computes the geometry of every pixel into gbuffer, integrating as few rays as possible.
+
+        Parameters:
+        - positions, directions: Taichi fields of shape (width, height), e.g. Camera.positions.
+        - gbuffer: GBuffer of the same resolution and max_disk_hits.
+
+        Returns:
+        - stats: dict with the number and fraction of integrated rays.
+        """
+        if gbuffer.max_disk_hits != self.max_disk_hits:
+            raise ValueError("gbuffer.max_disk_hits does not match the tracer's")
+        width, height = gbuffer.width, gbuffer.height
+        self._positions = positions.to_numpy()
+        self._directions = directions.to_numpy()
+        self._geometry = {
+            'escape': np.zeros((width, height, 3), dtype=np.float32),
+            'horizon': np.zeros((width, height), dtype=np.int32),
+            'disk_count': np.zeros((width, height), dtype=np.int32),
+            'disk_hits': np.zeros((width, height, self.max_disk_hits, 2), dtype=np.float32),
+        }
+        self._traced = np.zeros((width, height), dtype=bool)
+
+        # Coarse grid, always including the last row and column
+        xs = np.unique(np.append(np.arange(0, width, self.max_cell), width - 1))
+        ys = np.unique(np.append(np.arange(0, height, self.max_cell), height - 1))
+        grid_x, grid_y = np.meshgrid(xs, ys, indexing='ij')
+        self._trace_pixels(grid_x.ravel(), grid_y.ravel())
+
+        x0, y0 = np.meshgrid(xs[:-1], ys[:-1], indexing='ij')
+        x1, y1 = np.meshgrid(xs[1:], ys[1:], indexing='ij')
+        cells = np.stack([x0.ravel(), x1.ravel(), y0.ravel(), y1.ravel()], axis=1)
+
+        while len(cells):
+            # Cells without interior pixels are complete
+            cells = cells[(cells[:, 1] - cells[:, 0] > 1) | (cells[:, 3] - cells[:, 2] > 1)]
+            x0, x1, y0, y1 = cells.T
+            xm, ym = (x0 + x1) // 2, (y0 + y1) // 2
+            self._trace_pixels(xm, ym)
+            smooth = self._is_smooth(cells, xm, ym)
+            self._interpolate(cells[smooth])
+
+            # Split the others at their midpoints
+            x0, x1, y0, y1, xm, ym = (c[~smooth] for c in (x0, x1, y0, y1, xm, ym))
+            self._trace_pixels(np.concatenate([xm, xm, x0, x1]), np.concatenate([y0, y1, ym, ym]))
+            cells = np.concatenate([
+                np.stack([x0, xm, y0, ym], axis=1), np.stack([xm, x1, y0, ym], axis=1),
+                np.stack([x0, xm, ym, y1], axis=1), np.stack([xm, x1, ym, y1], axis=1)])
+            cells = cells[(cells[:, 1] > cells[:, 0]) & (cells[:, 3] > cells[:, 2])]
+
+        gbuffer.from_numpy(self._geometry)
+        traced = int(self._traced.sum())
+        return {'traced_rays': traced, 'traced_fraction': traced / (width * height)}
+
+    def _trace_pixels(self, xs, ys):
+        # Integrate the listed pixels that have not been traced yet, batch by batch
+        keep = ~self._traced[xs, ys]
+        pixels = np.unique(np.stack([xs[keep], ys[keep]], axis=1), axis=0)
+        r_max = self.solver.scene.skymap.r_max
+        for start in range(0, len(pixels), self.batch_size):
+            px, py = pixels[start:start + self.batch_size].T
+            count = len(px)
+            # Padding rays start outside the skymap sphere and stop after one step
+            batch_positions = np.full((self.batch_size, 1, 3), 2.0 * r_max, dtype=np.float32)
+            batch_directions = np.ones((self.batch_size, 1, 3), dtype=np.float32)
+            batch_positions[:count, 0] = self._positions[px, py]
+            batch_directions[:count, 0] = self._directions[px, py]
+            self.batch_positions.from_numpy(batch_positions)
+            self.batch_directions.from_numpy(batch_directions)
+            self.solver.trace_rk4(self.batch_positions, self.batch_directions, self.batch_gbuffer)
+
+            result = self.batch_gbuffer.to_numpy()
+            for key, value in result.items():
+                self._geometry[key][px, py] = value[:count, 0]
+            self._traced[px, py] = True
+
+    def _blend(self, key, x, y, x0, x1, y0, y1):
+        # Bilinear interpolation of a geometry array at pixels (x, y) from the cell corners
+        fx = (x - x0) / np.maximum(x1 - x0, 1)
+        fy = (y - y0) / np.maximum(y1 - y0, 1)
+        values = self._geometry[key]
+        weights = [(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy]
+        corners = [(x0, y0), (x1, y0), (x0, y1), (x1, y1)]
+        return sum(w.reshape((-1,) + (1,) * (values.ndim - 2)).astype(np.float32) * values[cx, cy]
+                   for w, (cx, cy) in zip(weights, corners))
+
+    def _is_smooth(self, cells, xm, ym):
+        # True for cells whose corners and traced center end the same way and whose center the
+        # corners predict within tolerance
+        x0, x1, y0, y1 = cells.T
+        points = [(x0, y0), (x1, y0), (x0, y1), (x1, y1), (xm, ym)]
+        horizon = np.stack([self._geometry['horizon'][x, y] for x, y in points])
+        disk_count = np.stack([np.minimum(self._geometry['disk_count'][x, y], self.max_disk_hits) for x, y in points])
+        smooth = np.all(horizon == horizon[0], axis=0) & np.all(disk_count == disk_count[0], axis=0)
+
+        # Escape points lie just outside r_max; the sky lookup only uses their direction
+        predicted = self._blend('escape', xm, ym, x0, x1, y0, y1)
+        traced = self._geometry['escape'][xm, ym]
+        cosine = np.sum(predicted * traced, axis=-1) / np.maximum(
+            np.linalg.norm(predicted, axis=-1) * np.linalg.norm(traced, axis=-1), 1e-12)
+        error = np.arccos(np.clip(cosine, -1.0, 1.0))
+        smooth &= (horizon[0] == 1) | (error <= self.direction_tolerance)
+
+        predicted = self._blend('disk_hits', xm, ym, x0, x1, y0, y1)
+        error = np.linalg.norm(predicted - self._geometry['disk_hits'][xm, ym], axis=-1)
+        used = np.arange(self.max_disk_hits)[None, :] < disk_count[0][:, None]
+        smooth &= np.all(~used | (error <= self.disk_tolerance), axis=1)
+        return smooth
+
+    def _interpolate(self, cells):
+        # Fill every untraced pixel inside the cells, in chunks of cells to bound memory
+        if not len(cells):
+            return
+        span = int(max(np.max(cells[:, 1] - cells[:, 0]), np.max(cells[:, 3] - cells[:, 2])))
+        offsets = np.arange(span + 1)
+        chunk = max(1, (1 << 22) // ((span + 1) ** 2))
+        for start in range(0, len(cells), chunk):
+            x0, x1, y0, y1 = (c[:, None, None] for c in cells[start:start + chunk].T)
+            x, y = np.broadcast_arrays(x0 + offsets[None, :, None], y0 + offsets[None, None, :])
+            x0, x1, y0, y1 = (np.broadcast_to(c, x.shape) for c in (x0, x1, y0, y1))
+            inside = (x <= x1) & (y <= y1)
+            inside &= ~self._traced[np.where(inside, x, 0), np.where(inside, y, 0)]
+            x, y, x0, x1, y0, y1 = (c[inside] for c in (x, y, x0, x1, y0, y1))
+
+            self._geometry['escape'][x, y] = self._blend('escape', x, y, x0, x1, y0, y1)
+            self._geometry['disk_hits'][x, y] = self._blend('disk_hits', x, y, x0, x1, y0, y1)
+            self._geometry['horizon'][x, y] = self._geometry['horizon'][x0, y0]
+            self._geometry['disk_count'][x, y] = self._geometry['disk_count'][x0, y0]
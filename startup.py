@@ -0,0 +1,89 @@
+# Overlapped startup: decode the sky and disk textures on background threads while the main
+# thread initializes Taichi, generates rays and compiles kernels.
+#
+# Kernels only need a texture field's shape, not its contents, so the fields are allocated from
+# the image headers (Skymap(deferred=True), texture_shape) and compiled against empty fields;
+# the decoded textures are uploaded just before the solve. PIL decoding, the float conversion
+# and the cube map conversion all run in C/NumPy with the GIL released for most of their time.
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from cubemap import load_cubemap
+
+
+def texture_shape(image_path):
+    """
+    Returns the (height, width) of an image from its header, without decoding it.
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+    return height, width
+
+
+def decode_texture(image_path):
+    # Same conversion as Skymap.load_texture and Scene.load_texture
+    with Image.open(image_path) as image:
+        return np.asarray(image.convert('RGB'), dtype=np.float32) / 255.0
+
+
+def load_sky(image_path, projection='equirect', face_size=None, cache_dir=None):
+    """
+    Decodes a sky texture into the contents of Skymap.texture_field: the texture itself, or its
+    cube map (see cubemap.load_cubemap) for projection='cube'.
+    """
+    texture = decode_texture(image_path)
+    if projection == 'cube':
+        return load_cubemap(image_path, texture, face_size, cache_dir)
+    return texture
+
+
+class TextureLoader:
+    def __init__(self, tasks):
+        """
+        Starts every task on its own thread immediately.
+
+        Parameters:
+        - tasks: dict, name -> callable returning an array.
+        """
+        self.seconds = {}
+        self.wait_seconds = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix='texture')
+        self._futures = {name: self._executor.submit(self._run, name, task) for name, task in tasks.items()}
+
+    def _run(self, name, task):
+        start = time.perf_counter()
+        result = task()
+        self.seconds[name] = time.perf_counter() - start
+        return result
+
+    def result(self, name):
+        # Blocks until the task is done; the time spent blocked is what the overlap did not hide
+        start = time.perf_counter()
+        try:
+            return self._futures[name].result()
+        finally:
+            self.wait_seconds += time.perf_counter() - start
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def report(self, main_seconds):
+        """
+        Summary of the overlap.
+
+        Parameters:
+        - main_seconds: float, main-thread work that ran alongside the threads (init, ray
+          generation, compilation).
+
+        Returns:
+        - text: str. Saved time is the decode time that did not show up as waiting. Threads
+          sharing cores run slower than alone, so with few cores it is an upper bound.
+        """
+        decode = sum(self.seconds.values())
+        tasks = ', '.join(f'{name} {seconds:.2f} s' for name, seconds in self.seconds.items())
+        return (f'Startup overlap: decoded textures ({tasks}) alongside {main_seconds:.2f} s of init, '
+                f'ray generation and compilation; waited {self.wait_seconds:.2f} s, '
+                f'saved ~{max(decode - self.wait_seconds, 0.0):.2f} s')
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import taichi as ti
+
+from camera import Camera
+from gbuffer import GBuffer
+from runtime import init_taichi
+from scene import Scene
+from skymap import Skymap
+from solver import INTEGRATORS, Solver
+from trajectory import TrajectoryRecorder
+
+WIDTH, HEIGHT = 16, 12
+EVERY = 4
+
+
+@pytest.fixture(scope='module')
+def setup():
+    init_taichi(cpu=True, kernel_cache=None)
+    camera = Camera(np.array([6, 0, 0.5], dtype=np.float32), np.float32(1.8), np.array([0, 0, 0], dtype=np.float32),
+                    np.array([WIDTH, HEIGHT]), fov=np.float32(60))
+    camera.generate_rays()
+    scene = Scene(blackhole_r=1.0, accretion_r1=2.0, accretion_r2=3.0, accretion_temp=400.0, accretion_alpha=1.0,
+                  skymap=Skymap('texture/high_res/space_texture_high1.jpg', r_max=10))
+    scene.set_accretion_disk_texture('texture/ad/adisk.jpg')
+    return camera, scene
+
+
+def record_every_pixel(setup, run):
+    camera, scene = setup
+    pixels = [(i, j) for i in range(WIDTH) for j in range(HEIGHT)]
+    recorder = TrajectoryRecorder(WIDTH, HEIGHT, pixels, every=EVERY, capacity=4096)
+    solver = Solver(scene, h=0.05, trajectory=recorder)
+    run(solver, camera)
+    return recorder.to_numpy()
+
+
+def check_counts(paths):
+    # Start point, every EVERY-th step and the final position, which is written once
+    steps = paths['steps']
+    expected = 1 + steps // EVERY + (steps % EVERY != 0)
+    assert (paths['dropped'] == 0).all()
+    np.testing.assert_array_equal(paths['count'], expected)
+    # Both the remainders that used to drop and to duplicate the final position occur
+    assert {0, 1} <= set(steps % EVERY)
+
+
+@pytest.mark.parametrize('integrator', INTEGRATORS)
+def test_solve_counts(setup, integrator):
+    def run(solver, camera):
+        colors = ti.Vector.field(3, dtype=ti.f32, shape=(WIDTH, HEIGHT))
+        solver.solve(integrator, camera.positions, camera.directions, colors)
+
+    check_counts(record_every_pixel(setup, run))
+
+
+def test_trace_rk4_counts(setup):
+    def run(solver, camera):
+        solver.trace_rk4(camera.positions, camera.directions, GBuffer(WIDTH, HEIGHT))
+
+    check_counts(record_every_pixel(setup, run))
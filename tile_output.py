@@ -0,0 +1,118 @@
+# Streaming tile output for images too large to assemble in memory.
+#
+# Tiles are written straight into a memory-mapped file as they arrive, so host memory holds only
+# the tiles in flight; the OS writes finished pages back to disk. Formats:
+#   .npy  NumPy array of shape (height, width, 3), readable with np.load(path, mmap_mode='r')
+#   .raw  the same bytes without a header; shape and dtype are in the sidecar
+# A JSON sidecar (<output>.tiles.json) records the layout, the render parameters and every tile
+# written, so an interrupted render resumes into the same file and skips finished tiles.
+import json
+import os
+
+import numpy as np
+
+from frame_manifest import atomic_save
+from image_io import to_rows, to_uint8, to_uint16
+
+STREAM_FORMATS = ('.npy', '.raw')
+STREAM_DTYPES = ('float32', 'uint16', 'uint8')
+SIDECAR_VERSION = 1
+
+
+def is_stream_output(path):
+    return os.path.splitext(path)[1].lower() in STREAM_FORMATS
+
+
+def sidecar_path(path):
+    return f'{path}.tiles.json'
+
+
+def load_progress(path, width, height, params, dtype='float32'):
+    """
+    Tiles already written to path by a render with the same layout and parameters.
+
+    Returns:
+    - done: set of (x0, y0, width, height) tuples; empty if there is nothing to resume.
+    """
+    if not (os.path.exists(path) and os.path.exists(sidecar_path(path))):
+        return set()
+    with open(sidecar_path(path)) as f:
+        sidecar = json.load(f)
+    expected = {'version': SIDECAR_VERSION, 'shape': [int(height), int(width), 3], 'dtype': dtype,
+                'params': json.loads(json.dumps(params))}
+    if any(sidecar.get(key) != value for key, value in expected.items()):
+        print(f'{path} was written with other settings; rendering it again')
+        return set()
+    return {tuple(tile) for tile in sidecar.get('done', [])}
+
+
+class TileWriter:
+    def __init__(self, path, width, height, params, dtype='float32'):
+        """
+        Opens a memory-mapped image file for tile-by-tile writing, resuming it if its sidecar
+        matches (see load_progress) and creating it otherwise.
+
+        Parameters:
+        - path: str, .npy or .raw output file.
+        - width, height: int, image resolution.
+        - params: dict, JSON-serializable render parameters; a file written under different
+          parameters is started over.
+        - dtype: str, 'float32' (values as rendered), 'uint16' or 'uint8'.
+        """
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in STREAM_FORMATS:
+            raise ValueError(f"Unsupported streaming format '{ext}', use one of {STREAM_FORMATS}")
+        if dtype not in STREAM_DTYPES:
+            raise ValueError(f"Unsupported streaming dtype '{dtype}', use one of {STREAM_DTYPES}")
+        self.path = path
+        self.dtype = dtype
+        self.shape = (int(height), int(width), 3)
+        self.params = json.loads(json.dumps(params))
+        self.done = load_progress(path, width, height, params, dtype)
+
+        mode = 'r+' if self.done else 'w+'
+        if self.done:
+            print(f'Resuming {path}: {len(self.done)} tiles already written')
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if ext == '.npy':
+            self.image = np.lib.format.open_memmap(path, mode=mode, dtype=dtype, shape=self.shape)
+        else:
+            self.image = np.memmap(path, mode=mode, dtype=dtype, shape=self.shape)
+        if not self.done:
+            self.save_sidecar()
+
+    def write(self, tile, img):
+        """
+        Writes one tile and records it once it has been flushed to the file.
+
+        Parameters:
+        - tile: (x0, y0, width, height) of the tile in the image.
+        - img: numpy.ndarray, (width, height, 3) render of the tile, as Camera.render.
+        """
+        x0, y0, width, height = (int(v) for v in tile)
+        if self.dtype == 'uint8':
+            rows = to_uint8(img)
+        elif self.dtype == 'uint16':
+            rows = to_uint16(img)
+        else:
+            rows = to_rows(img.astype(np.float32))
+        self.image[y0:y0 + height, x0:x0 + width] = rows
+        self.image.flush()
+        self.done.add((x0, y0, width, height))
+        self.save_sidecar()
+
+    def save_sidecar(self):
+        sidecar = {'version': SIDECAR_VERSION, 'shape': list(self.shape), 'dtype': self.dtype,
+                   'layout': 'row-major (height, width, 3) RGB', 'params': self.params,
+                   'done': sorted(self.done)}
+
+        def write(tmp_path):
+            with open(tmp_path, 'w') as f:
+                json.dump(sidecar, f)
+
+        atomic_save(sidecar_path(self.path), write)
+
+    def close(self):
+        self.image.flush()
+        del self.image
@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import taichi as ti
+
+
+class Tracer:
+    """
+    Wall-clock timer for named pipeline phases that writes Chrome trace / Perfetto JSON.
+
+    Taichi kernels launch asynchronously, so each phase calls ti.sync() on entry (to not be
+    charged for work queued before it) and on exit (to include the kernels it launched).
+    A disabled tracer does nothing, not even the syncs.
+
+    Parameters:
+    - enabled: bool, record phases.
+    - sync: bool, synchronize the Taichi device at phase boundaries.
+    """
+
+    def __init__(self, enabled=True, sync=True):
+        self.enabled = enabled
+        self.sync = sync
+        self.events = []
+        self._depth = 0
+
+    @contextmanager
+    def phase(self, name, sync=True, **args):
+        # sync=False for phases that run before ti.init
+        if not self.enabled:
+            yield
+            return
+        sync = sync and self.sync
+        if sync:
+            ti.sync()
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if sync:
+                ti.sync()
+            end = time.perf_counter()
+            self._depth -= 1
+            self.events.append({
+                'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                'pid': os.getpid(), 'tid': threading.get_native_id(),
+                'args': {**args, 'depth': self._depth},
+            })
+
+    def add_events(self, events):
+        # Events recorded by another process, e.g. a frame worker
+        self.events.extend(events)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': sorted(self.events, key=lambda e: e['ts']), 'displayTimeUnit': 'ms'}, f)
+
+    def totals(self):
+        """
+        Returns an ordered dict of phase name to (calls, total seconds), in order of first appearance.
+        """
+        totals = OrderedDict()
+        for event in sorted(self.events, key=lambda e: e['ts']):
+            calls, total = totals.get(event['name'], (0, 0.0))
+            totals[event['name']] = (calls + 1, total + event['dur'] / 1e6)
+        return totals
+
+    def summary(self):
+        """
+        Returns a table of calls, total and mean time and share of wall time per phase, in order
+        of first appearance. 'untracked' is wall time outside top-level phases; it is omitted when
+        events from several processes overlap.
+        """
+        if not self.events:
+            return 'No phases recorded'
+        totals = self.totals()
+
+        start = min(e['ts'] for e in self.events)
+        wall = (max(e['ts'] + e['dur'] for e in self.events) - start) / 1e6
+
+        width = max(len(name) for name in list(totals) + ['untracked'])
+        lines = [f"{'phase':{width}s} {'calls':>6s} {'total s':>10s} {'mean ms':>10s} {'% wall':>7s}"]
+        for name, (calls, total) in totals.items():
+            share = 100.0 * total / wall if wall else 0.0
+            lines.append(f'{name:{width}s} {calls:6d} {total:10.3f} {1000.0 * total / calls:10.2f} {share:7.1f}')
+        if len({e['pid'] for e in self.events}) == 1:
+            # With several processes phases overlap, so only single-process traces have gaps to report
+            top_level = sum(e['dur'] for e in self.events if e['args'].get('depth') == 0) / 1e6
+            untracked = max(wall - top_level, 0.0)
+            lines.append(f"{'untracked':{width}s} {'':6s} {untracked:10.3f} {'':10s} {100.0 * untracked / wall if wall else 0.0:7.1f}")
+        lines.append(f"{'wall':{width}s} {'':6s} {wall:10.3f}")
+        return '\n'.join(lines)
+
+
+# Shared no-op tracer for code paths that take an optional tracer
+NULL_TRACER = Tracer(enabled=False)
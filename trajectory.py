@@ -0,0 +1,103 @@
+import numpy as np
+import taichi as ti
+
+
+@ti.data_oriented
+class TrajectoryRecorder:
+    def __init__(self, width, height, pixels, every=1, capacity=1024):
+        """
+        Records the paths of a few selected rays while the Solver integrates them.
+
+        Every ray looks up its slot once before integrating; unselected rays (slot -1) then skip
+        recording with a register compare per step. Each selected ray writes its start point and
+        every `every`-th position into its own ring buffer of `capacity` points, so a ray that
+        orbits for longer than that keeps its most recent points. Pass the recorder to the
+        Solver as trajectory=...; without one, recording is compiled out.
+
+        Parameters:
+        - width, height: int, shape of the solver's ray fields.
+        - pixels: sequence of (i, j) pixels to record.
+        - every: int, record one position every this many steps.
+        - capacity: int, points kept per ray.
+        """
+        self.width = int(width)
+        self.height = int(height)
+        self.pixels = np.array(pixels, dtype=np.int32).reshape(-1, 2)
+        if len(self.pixels) == 0:
+            raise ValueError("TrajectoryRecorder needs at least one pixel")
+        if (self.pixels < 0).any() or (self.pixels[:, 0] >= self.width).any() or (self.pixels[:, 1] >= self.height).any():
+            raise ValueError(f"Trajectory pixels must lie in the {self.width}x{self.height} image")
+        self.every = int(every)
+        self.capacity = int(capacity)
+        if self.every < 1 or self.capacity < 2:
+            raise ValueError("TrajectoryRecorder needs every >= 1 and capacity >= 2")
+
+        # Slot of each pixel's ray in the buffers, -1 if it is not recorded
+        slots = np.full((self.width, self.height), -1, dtype=np.int32)
+        slots[self.pixels[:, 0], self.pixels[:, 1]] = np.arange(len(self.pixels), dtype=np.int32)
+        self.slot = ti.field(dtype=ti.i32, shape=(self.width, self.height))
+        self.slot.from_numpy(slots)
+
+        # Ring buffer of positions per slot, the number of points written, the step of the latest
+        # one and the steps taken
+        self.points = ti.Vector.field(3, dtype=ti.f32, shape=(len(self.pixels), self.capacity))
+        self.count = ti.field(dtype=ti.i32, shape=len(self.pixels))
+        self.last = ti.field(dtype=ti.i32, shape=len(self.pixels))
+        self.steps = ti.field(dtype=ti.i32, shape=len(self.pixels))
+        self.reset()
+
+    @ti.func
+    def write(self, slot, steps, pos):
+        n = self.count[slot]
+        self.points[slot, n % self.capacity] = pos
+        self.count[slot] = n + 1
+        self.last[slot] = steps
+
+    @ti.func
+    def record(self, slot, steps, pos):
+        # Start point (steps == 0) and every `every`-th position of a selected ray
+        if slot >= 0 and steps % self.every == 0:
+            self.write(slot, steps, pos)
+
+    @ti.func
+    def finish(self, slot, steps, pos):
+        # Final position, i.e. the position after `steps` steps, unless it was already written
+        if slot >= 0:
+            if self.last[slot] != steps:
+                self.write(slot, steps, pos)
+            self.steps[slot] = steps
+
+    def reset(self):
+        self.count.fill(0)
+        self.last.fill(-1)
+        self.steps.fill(0)
+
+    def to_numpy(self):
+        """
+        Returns the recorded paths in chronological order.
+
+        Returns:
+        - paths: numpy.ndarray, structured (num_pixels,) array with fields 'pixel' (i, j),
+          'steps' (steps the final position is after), 'count' (points kept, at most capacity),
+          'dropped' (oldest points overwritten by the ring buffer) and 'points'
+          ((capacity, 3) float32, NaN past count).
+        """
+        points = self.points.to_numpy()
+        written = self.count.to_numpy()
+        dtype = np.dtype([('pixel', np.int32, (2,)), ('steps', np.int32), ('count', np.int32),
+                          ('dropped', np.int32), ('points', np.float32, (self.capacity, 3))])
+        paths = np.zeros(len(self.pixels), dtype=dtype)
+        paths['pixel'] = self.pixels
+        paths['steps'] = self.steps.to_numpy()
+        paths['count'] = np.minimum(written, self.capacity)
+        paths['dropped'] = np.maximum(written - self.capacity, 0)
+        paths['points'] = np.nan
+        for s, n in enumerate(written):
+            # Unroll the ring: the oldest kept point is at n % capacity once it has wrapped
+            order = (np.arange(min(n, self.capacity)) + max(n - self.capacity, 0)) % self.capacity
+            paths['points'][s, :len(order)] = points[s, order]
+        return paths
+
+    def save(self, path):
+        # .npy of the structured array from to_numpy; no pickle needed to load it
+        np.save(path, self.to_numpy())
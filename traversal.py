@@ -0,0 +1,226 @@
+import numpy as np
+import taichi as ti
+
+ORDERS = ('row', 'morton', 'hilbert', 'cost')
+
+# Impact parameter of the photon sphere (r = 1.5) for the solver's units (horizon at r = 1)
+CRITICAL_IMPACT_PARAMETER = 1.5 * np.sqrt(3.0)
+
+
+def morton_index(x, y):
+    """
+    Z-order (Morton) index of integer coordinates: the bits of x and y interleaved.
+    """
+    x, y = np.asarray(x, dtype=np.uint64), np.asarray(y, dtype=np.uint64)
+    index = np.zeros(np.broadcast(x, y).shape, dtype=np.uint64)
+    for bit in range(32):
+        index |= ((x >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+        index |= ((y >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+    return index
+
+
+def hilbert_index(x, y, bits):
+    """
+    Distance along the Hilbert curve filling a 2**bits x 2**bits grid, for integer coordinates.
+    """
+    x, y = np.array(x, dtype=np.int64), np.array(y, dtype=np.int64)
+    n = 1 << bits
+    index = np.zeros(np.broadcast(x, y).shape, dtype=np.int64)
+    s = n // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        index += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the sub-curve starts and ends where the parent expects
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s //= 2
+    return index
+
+
+def estimate_costs(positions, directions, r_max=10.0):
+    """
+    Estimated integration cost (path length in scene units, proportional to steps) of rays from
+    their geometry, before tracing them. A ray with impact parameter b = |pos x dir| travels
+    about its straight-line distance to the skymap sphere, or to its closest approach if it is
+    captured (b < b_c), plus the winding around the photon sphere: the distance to the critical
+    b_c grows by e^pi every half orbit of length 1.5 pi, which adds about 1.5 log(b_c / |b - b_c|).
+
+    Parameters:
+    - positions, directions: numpy.ndarray, (..., 3) ray origins and directions.
+    - r_max: float, radius of the skymap sphere where rays stop.
+
+    Returns:
+    - costs: numpy.ndarray, (...) float32 estimated path lengths.
+    """
+    d = directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+    b = np.linalg.norm(np.cross(positions, d), axis=-1)
+    along = np.sum(positions * d, axis=-1)
+    exit_distance = -along + np.sqrt(np.maximum(along ** 2 - np.sum(positions ** 2, axis=-1) + r_max ** 2, 0.0))
+    straight = np.where(b < CRITICAL_IMPACT_PARAMETER, np.maximum(-along, 0.0), exit_distance)
+    closeness = CRITICAL_IMPACT_PARAMETER / np.maximum(np.abs(b - CRITICAL_IMPACT_PARAMETER), 1e-6)
+    return (straight + 1.5 * np.log(np.maximum(closeness, 1.0))).astype(np.float32)
+
+
+def cost_order(costs, tile=8, threads=1):
+    """
+    Keys of a cost-balanced visiting order of tiles.
+
+    Tiles are dealt, most expensive first, to `threads` bins in a back-and-forth pattern
+    (0, 1, ..., T-1, T-1, ..., 0, ...), so every bin holds the same number of tiles and nearly
+    the same cost. The bins are visited one after another, each from its most expensive tile
+    down. A static split into `threads` equal ranges then gives every thread one bin. When
+    threads take chunks as they become free, the expensive work starts early and cheap tiles
+    finish the frame.
+
+    Parameters:
+    - costs: numpy.ndarray, (width, height) cost of every pixel, e.g. estimate_costs or the
+      step counts of a previous frame.
+    - tile: int, tile edge in pixels; pixels inside a tile are visited row by row.
+    - threads: int, number of bins (CPU threads; 1 sorts tiles by cost only).
+
+    Returns:
+    - key: numpy.ndarray, (width * height,) int64 visiting rank of every pixel, in the
+      raveled (x, y) order of pixel_order.
+    """
+    width, height = costs.shape
+    tiles_x = -(-width // tile)
+    x, y = np.meshgrid(np.arange(width), np.arange(height), indexing='ij')
+    x, y = x.ravel(), y.ravel()
+    tile_id = (y // tile) * tiles_x + x // tile
+    tile_cost = np.bincount(tile_id, weights=np.asarray(costs, dtype=np.float64).ravel())
+    by_cost = np.argsort(-tile_cost, kind='stable')
+
+    threads = max(1, int(threads))
+    rank = np.arange(len(by_cost))
+    sweep, position = np.divmod(rank, threads)
+    bins = np.where(sweep % 2 == 0, position, threads - 1 - position)
+    # Visiting rank of every tile: by bin, then most expensive first
+    tile_rank = np.empty_like(rank)
+    tile_rank[by_cost] = np.argsort(np.lexsort((rank, bins)))
+    return (tile_rank[tile_id] * tile + y % tile) * tile + x % tile
+
+
+def pixel_order(width, height, order='hilbert', tile=8, costs=None, threads=1):
+    """
+    Visiting order of an image's pixels.
+
+    Parameters:
+    - width, height: int, image resolution.
+    - order: str, 'row' (rows top to bottom), 'morton', 'hilbert' or 'cost'. The curves order
+      tile x tile pixel tiles; 'cost' orders them by costs (see cost_order). Pixels inside a
+      tile are visited row by row.
+    - tile: int, tile edge in pixels for the tiled orders.
+    - costs: numpy.ndarray, (width, height) per-pixel cost for 'cost'.
+    - threads: int, CPU threads the 'cost' order balances.
+
+    Returns:
+    - pixels: numpy.ndarray, (width * height, 2) int32 array of (x, y), in visiting order.
+    """
+    if order not in ORDERS:
+        raise ValueError(f"Unknown traversal order '{order}', use one of {ORDERS}")
+    if order == 'cost' and (costs is None or tuple(np.shape(costs)) != (width, height)):
+        raise ValueError(f"The 'cost' traversal order needs a ({width}, {height}) costs array")
+    x, y = np.meshgrid(np.arange(width), np.arange(height), indexing='ij')
+    x, y = x.ravel(), y.ravel()
+    if order == 'row':
+        key = y.astype(np.int64) * width + x
+    elif order == 'cost':
+        key = cost_order(costs, tile, threads)
+    else:
+        tx, ty = x // tile, y // tile
+        if order == 'morton':
+            curve = morton_index(tx, ty).astype(np.int64)
+        else:
+            bits = max(1, int(np.ceil(np.log2(max(tx.max(), ty.max()) + 1))))
+            curve = hilbert_index(tx, ty, bits)
+        key = (curve * tile + y % tile) * tile + x % tile
+    permutation = np.argsort(key, kind='stable')
+    return np.stack([x[permutation], y[permutation]], axis=1).astype(np.int32)
+
+
+@ti.data_oriented
+class Traversal:
+    def __init__(self, width, height, order='hilbert', tile=8, costs=None, threads=1):
+        """
+        Generates, solves and shades rays in a space-filling-curve or cost-balanced order, then
+        writes the colors back in image order.
+
+        The solver kernels parallelize over their fields' linear index, so with (N, 1) fields
+        filled in curve order each CPU thread's chunk of work is a compact patch of the image:
+        neighbouring rays exit through nearby texels, and expensive regions (the photon ring)
+        are spread over many chunks instead of a few columns. The 'cost' order instead starts
+        the expensive tiles first and balances them over the threads (see cost_order).
+
+        Parameters:
+        - width, height: int, image resolution.
+        - order: str, see pixel_order.
+        - tile: int, tile edge in pixels for the tiled orders.
+        - costs: numpy.ndarray, (width, height) per-pixel cost for the 'cost' order.
+        - threads: int, CPU threads the 'cost' order balances.
+        """
+        self.width = int(width)
+        self.height = int(height)
+        self.order = order
+        self.tile = int(tile)
+        self.threads = int(threads)
+        self.count = self.width * self.height
+        count = self.count
+        self.pixels = ti.Vector.field(2, dtype=ti.i32, shape=count)
+        self.pixel_array = pixel_order(self.width, self.height, order, self.tile, costs, self.threads)
+        self.pixels.from_numpy(self.pixel_array)
+        self.positions = ti.Vector.field(3, dtype=ti.f32, shape=(count, 1))
+        self.directions = ti.Vector.field(3, dtype=ti.f32, shape=(count, 1))
+        self.colors = ti.Vector.field(3, dtype=ti.f32, shape=(count, 1))
+
+    def reorder(self, costs):
+        """
+        Switches to the 'cost' order for new per-pixel costs, e.g. the step counts of the
+        previous frame (see measured_costs). Rays must be generated again afterwards.
+        """
+        self.order = 'cost'
+        self.pixel_array = pixel_order(self.width, self.height, 'cost', self.tile, costs, self.threads)
+        self.pixels.from_numpy(self.pixel_array)
+
+    def measured_costs(self, solver):
+        """
+        Returns the (width, height) step counts of the last solve, from a solver created with
+        diagnostics_shape=(width * height, 1).
+        """
+        costs = np.zeros((self.width, self.height), dtype=np.int32)
+        costs[self.pixel_array[:, 0], self.pixel_array[:, 1]] = solver.step_counts.to_numpy()[:, 0]
+        return costs
+
+    def generate_rays(self, camera):
+        camera.generate_rays_at(self.pixels, self.positions, self.directions)
+        return self.positions, self.directions
+
+    def solve(self, solver, integrator, colors):
+        """
+        Solves every ray in traversal order and writes the colors into colors, a (width, height) field.
+        The solver must not record trajectories, which are indexed by pixel, and may only record
+        diagnostics in traversal order (diagnostics_shape=(width * height, 1)).
+        """
+        if solver.has_trajectory:
+            raise ValueError("Traversal needs a Solver created without trajectory")
+        if solver.has_diagnostics and tuple(solver.step_counts.shape) != (self.count, 1):
+            raise ValueError(f"Traversal needs a Solver with diagnostics_shape=({self.count}, 1) or none")
+        self.colors.fill(0.0)
+        solver.solve(integrator, self.positions, self.directions, self.colors)
+        self.scatter(self.colors, colors)
+
+    @ti.kernel
+    def scatter(self, ordered: ti.template(), image: ti.template()):
+        # Values in traversal order back to their pixels
+        for k in self.pixels:
+            pixel = self.pixels[k]
+            image[pixel[0], pixel[1]] = ordered[k, 0]
+
+    @ti.kernel
+    def gather(self, image: ti.template(), ordered: ti.template()):
+        # Values of a (width, height) field into traversal order
+        for k in self.pixels:
+            pixel = self.pixels[k]
+            ordered[k, 0] = image[pixel[0], pixel[1]]
@@ -0,0 +1,101 @@
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+
+from image_io import to_uint8
+
+
+class VideoWriter:
+    def __init__(self, path, width, height, fps=30.0, codec=None, quality=90, backend='auto'):
+        """
+        Streams rendered frames straight into a video container.
+
+        Parameters:
+        - path: str, output video file (e.g. 'orbit.mp4').
+        - width, height: int, frame size in pixels.
+        - fps: float, frames per second.
+        - codec: str, FOURCC for OpenCV (default 'mp4v') or encoder name for ffmpeg (default 'libx264').
+        - quality: int, 0-100 (higher is better). Mapped to CRF for ffmpeg and to
+          VIDEOWRITER_PROP_QUALITY for OpenCV codecs that support it.
+        - backend: str, 'auto' (ffmpeg if found on PATH, else OpenCV), 'ffmpeg' or 'opencv'.
+        """
+        if backend not in ('auto', 'ffmpeg', 'opencv'):
+            raise ValueError(f"Unknown video backend: {backend}")
+        if backend == 'auto':
+            backend = 'ffmpeg' if shutil.which('ffmpeg') is not None else 'opencv'
+        if backend == 'ffmpeg' and shutil.which('ffmpeg') is None:
+            raise RuntimeError("ffmpeg backend requested but ffmpeg was not found on PATH")
+
+        self.path = path
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = float(fps)
+        self.quality = int(np.clip(quality, 0, 100))
+        self.backend = backend
+        self.num_frames = 0
+
+        if backend == 'ffmpeg':
+            self.codec = codec or 'libx264'
+            self._process = self._open_ffmpeg()
+            self._writer = None
+        else:
+            self.codec = codec or 'mp4v'
+            self._process = None
+            self._writer = self._open_opencv()
+
+    def _open_ffmpeg(self):
+        # Map quality 0-100 onto the x264/x265 CRF scale (51 worst, 0 lossless)
+        crf = int(round(51 * (1.0 - self.quality / 100.0)))
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+            '-s', f'{self.width}x{self.height}', '-r', str(self.fps),
+            '-i', '-',
+            '-c:v', self.codec, '-crf', str(crf), '-pix_fmt', 'yuv420p',
+            self.path,
+        ]
+        return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def _open_opencv(self):
+        fourcc = cv2.VideoWriter_fourcc(*self.codec)
+        writer = cv2.VideoWriter(self.path, fourcc, self.fps, (self.width, self.height))
+        if not writer.isOpened():
+            raise RuntimeError(f"OpenCV could not open {self.path} with codec '{self.codec}'")
+        writer.set(cv2.VIDEOWRITER_PROP_QUALITY, self.quality)
+        return writer
+
+    def write(self, img):
+        """
+        Appends one frame.
+
+        Parameters:
+        - img: numpy.ndarray, (width, height, 3) float image in [0, 1] as returned by Camera.render,
+          or the same layout already quantized to uint8.
+        """
+        if img.shape[:2] != (self.width, self.height):
+            raise ValueError(f"Frame shape {img.shape[:2]} does not match video size {(self.width, self.height)}")
+        frame = to_uint8(img)
+
+        if self._process is not None:
+            self._process.stdin.write(frame.tobytes())
+        else:
+            self._writer.write(np.ascontiguousarray(frame[:, :, ::-1]))  # OpenCV expects BGR
+        self.num_frames += 1
+
+    def close(self):
+        if self._process is not None:
+            self._process.stdin.close()
+            if self._process.wait() != 0:
+                raise RuntimeError(f"ffmpeg exited with code {self._process.returncode} while writing {self.path}")
+            self._process = None
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()